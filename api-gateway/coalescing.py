@@ -0,0 +1,94 @@
+import time
+
+
+def normalize_question(question):
+    """Key text of a question: case and whitespace differences do not matter."""
+    return " ".join(str(question or "").split()).casefold()
+
+
+class Run:
+    def __init__(self, run_id, key):
+        self.run_id = run_id
+        self.key = key
+        self.started = time.monotonic()
+        self.waiters = [run_id]
+        # Resultados ya recibidos, para quien se une a mitad de un stream por lotes
+        self.delivered = []
+
+
+class Coalescer:
+    """Single-flight table of the questions being answered by this replica.
+
+    A request whose key (datasource, question, preview flag) matches a run
+    started less than ``window`` seconds ago joins it instead of entering the
+    pipeline again: the run keeps the request id of the first one (its
+    ``correlation_id`` in the pipeline) and every result is fanned out to all
+    waiters. A run ends with its final result; ``window=0`` disables coalescing.
+    """
+
+    def __init__(self, window=5):
+        self.window = window
+        self._runs = {}
+        self._by_key = {}
+        self._run_of = {}
+
+    def join(self, request_id, key):
+        """Attach ``request_id`` to an open run of ``key``.
+
+        Returns the results that run already delivered, or ``None`` if there is
+        no such run and the caller must start one with ``start``.
+        """
+        if self.window <= 0:
+            return None
+        run = self._by_key.get(key)
+        if run is None or time.monotonic() - run.started > self.window:
+            return None
+        run.waiters.append(request_id)
+        self._run_of[request_id] = run
+        return list(run.delivered)
+
+    def start(self, request_id, key):
+        run = Run(request_id, key)
+        self._runs[request_id] = run
+        self._run_of[request_id] = run
+        if self.window > 0:
+            # Una petición posterior a la ventana abre otra ejecución que sustituye a esta para nuevas uniones
+            self._by_key[key] = run
+
+    def deliver(self, run_id, payload):
+        """Request ids waiting for this result of run ``run_id``."""
+        run = self._runs.get(run_id)
+        if run is None:
+            return [run_id]
+        waiters = list(run.waiters)
+        if payload.get("final", True):
+            self._finish(run)
+        else:
+            run.delivered.append(payload)
+        return waiters
+
+    def leave(self, request_id):
+        """Detach a cancelled waiter; returns the run id to cancel in the
+        pipeline if nobody else waits for it, else ``None``."""
+        run = self._run_of.pop(request_id, None)
+        if run is None:
+            return request_id
+        if request_id in run.waiters:
+            run.waiters.remove(request_id)
+        if run.waiters:
+            return None
+        self._finish(run)
+        return run.run_id
+
+    def expire(self, ttl):
+        """Forget runs whose final result never arrived within ``ttl`` seconds."""
+        now = time.monotonic()
+        for run in [run for run in self._runs.values() if now - run.started > ttl]:
+            self._finish(run)
+
+    def _finish(self, run):
+        self._runs.pop(run.run_id, None)
+        if self._by_key.get(run.key) is run:
+            del self._by_key[run.key]
+        for request_id in run.waiters:
+            self._run_of.pop(request_id, None)
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class ChunkSequencer:
+    """Puts the chunks of each request back in ``seq`` order.
+
+    Chunks of one result can reach the gateway out of order (several
+    formatting workers, a chunk redelivered by a retry). The final chunk's
+    ``seq`` is the last one, so the result is complete once every ``seq`` up
+    to it has arrived: only then is the final chunk released. Payloads
+    without ``seq`` (errors of earlier stages) pass straight through, a
+    preview is only passed on while the full result has not started and
+    duplicated chunks are dropped. The formatting service only decides the
+    ``shape`` of a table on its first chunk; the later ones get it here. The
+    ids of the last ``max_finished`` completed requests are remembered, so a
+    preview or a redelivered chunk that arrives after the final one is
+    dropped instead of opening a new stream.
+    """
+
+    def __init__(self, max_finished=10000):
+        self.max_finished = max_finished
+        self._streams = {}
+        self._finished = OrderedDict()
+
+    def accept(self, request_id, payload):
+        """Payloads of ``request_id`` that can be delivered now, in order."""
+        if request_id in self._finished:
+            return []
+        if "seq" not in payload:
+            if payload.get("final", True):
+                self._finish(request_id)
+            return [payload]
+        stream = self._streams.setdefault(request_id, {"next": 0, "pending": {}, "started": time.monotonic()})
+        if payload.get("preview"):
+            return [payload] if stream["next"] == 0 else []
+        seq = payload["seq"]
+        if seq < stream["next"] or seq in stream["pending"]:
+            return []
+        stream["pending"][seq] = payload
+        ready = []
+        while stream["next"] in stream["pending"]:
+            chunk = stream["pending"].pop(stream["next"])
+            if stream["next"] == 0:
+                stream["shape"] = chunk.get("shape")
+            elif chunk.get("type") == "table" and stream.get("shape") is not None:
+                chunk["shape"] = stream["shape"]
+            stream["next"] += 1
+            ready.append(chunk)
+            if chunk.get("final", True):
+                self._finish(request_id)
+                break
+        return ready
+
+    def _finish(self, request_id):
+        self._streams.pop(request_id, None)
+        self._finished[request_id] = None
+        while len(self._finished) > self.max_finished:
+            self._finished.popitem(last=False)
+
+    def expire(self, ttl):
+        """Forget requests whose missing chunks never arrived within ``ttl`` seconds."""
+        now = time.monotonic()
+        for request_id in [r for r, stream in self._streams.items() if now - stream["started"] > ttl]:
+            del self._streams[request_id]
+
+
+class ResultDispatcher:
+    """In-memory dispatch table from request id to the waiters of that request.
+
+    A request is registered as soon as ``/query`` publishes it, so results that
+    arrive before the client opens its ``/events`` stream are buffered instead
+    of lost. Entries that nobody collects are dropped after ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._queues = {}
+        self._expires = {}
+
+    def register(self, request_id):
+        self._queues[request_id] = asyncio.Queue()
+        self._expires[request_id] = time.monotonic() + self.ttl
+
+    def is_registered(self, request_id):
+        return request_id in self._queues
+
+    def deliver(self, request_id, payload):
+        queue = self._queues.get(request_id)
+        if queue is None:
+            return False
+        queue.put_nowait(payload)
+        return True
+
+    def release(self, request_id):
+        self._queues.pop(request_id, None)
+        self._expires.pop(request_id, None)
+
+    def expire(self):
+        now = time.monotonic()
+        for request_id in [r for r, expires in self._expires.items() if expires < now]:
+            self.release(request_id)
+
+    async def results(self, request_id, timeout=None):
+        """Yield the results of ``request_id`` until the final one arrives.
+
+        A timeout leaves the entry registered, so the caller can come back later.
+        """
+        queue = self._queues[request_id]
+        while True:
+            payload = await asyncio.wait_for(queue.get(), timeout)
+            final = payload.get("final", True)
+            if final:
+                self.release(request_id)
+            yield payload
+            if final:
+                return
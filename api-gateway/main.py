@@ -1,15 +1,173 @@
 import json
 import os
+import logging
+import threading
+import uuid
+from contextlib import asynccontextmanager
 from sse_starlette.sse import EventSourceResponse
-from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from common.utils import get_rabbitmq_connection
-import pika
+import aio_pika
 import asyncio
+from common.datasources import DATASOURCE_HEADER
+from common.events import PREVIEW_HEADER, QUERY_CONTROL_EXCHANGE
+from common.metrics import registry
+from common.queues import queue_arguments
+from common.readiness import backoff_delays
+from common.tracing import TRACE_HEADER, TRACE_SENT_HEADER, STAGE_BUCKETS, now_us, start_trace, stage_breakdown
+from common.transport import InMemoryTransport, Properties, get_transport
+from dispatch import ChunkSequencer, ResultDispatcher
+from coalescing import Coalescer, normalize_question
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
+# Reintentos de conexión a RabbitMQ, como en common.utils.get_rabbitmq_connection
+RABBITMQ_MAX_RETRIES = int(os.getenv("RABBITMQ_MAX_RETRIES", "30"))
+RABBITMQ_RETRY_DELAY = float(os.getenv("RABBITMQ_RETRY_DELAY", "0.1"))
+RABBITMQ_MAX_RETRY_DELAY = float(os.getenv("RABBITMQ_MAX_RETRY_DELAY", "5"))
+# Segundos que se guarda un resultado que ningún cliente ha recogido
+RESULT_TTL = float(os.getenv("RESULT_TTL", "300"))
+# Cola de respuestas propia de cada réplica del gateway
+REPLY_QUEUE = f"gateway.{uuid.uuid4().hex}"
+# Segundos durante los que una pregunta idéntica (misma fuente de datos) se une a
+# la ejecución en curso en lugar de recorrer de nuevo la tubería; 0 = desactivado
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "5"))
+# Preguntas máximas por petición a /query/batch
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "100"))
+# Segundos sin noticias de una pregunta del lote tras los que se da por fallida
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "120"))
+# Vista previa rápida antes del resultado completo para las peticiones que no
+# indican "preview"
+QUERY_PREVIEW = os.getenv("QUERY_PREVIEW", "false").lower() in ("1", "true", "yes")
+
+dispatcher = ResultDispatcher(ttl=RESULT_TTL)
+sequencer = ChunkSequencer()
+coalescer = Coalescer(window=COALESCE_WINDOW)
+
+queries_total = registry.counter("gateway_queries_total", "Queries received by /query")
+coalesced_total = registry.counter(
+    "gateway_queries_coalesced_total", "Queries answered by joining an identical query already in flight"
+)
+
+# Vista extremo a extremo de las trazas que vuelven en las respuestas (common.tracing)
+end_to_end_seconds = registry.histogram(
+    "gateway_end_to_end_seconds", "Time from /query to the final result reaching the gateway", buckets=STAGE_BUCKETS
+)
+first_result_seconds = registry.histogram(
+    "gateway_first_result_seconds", "Time from /query to the first result reaching the gateway", buckets=STAGE_BUCKETS
+)
+first_preview_seconds = registry.histogram(
+    "gateway_first_preview_seconds", "Time from /query to the preview of the result reaching the gateway",
+    buckets=STAGE_BUCKETS
+)
+
+
+async def connect_rabbitmq(host, max_retries=RABBITMQ_MAX_RETRIES, retry_delay=RABBITMQ_RETRY_DELAY):
+    # Versión asíncrona de common.utils.get_rabbitmq_connection: una única conexión
+    # robusta (se reconecta sola) compartida por todo el proceso
+    delays = backoff_delays(retry_delay, max(retry_delay, RABBITMQ_MAX_RETRY_DELAY))
+    for attempt in range(max_retries):
+        try:
+            return await aio_pika.connect_robust(host=host)
+        except (aio_pika.exceptions.AMQPConnectionError, OSError):
+            delay = next(delays)
+            logger.warning(f"Unable to connect to RabbitMQ. Attempt {attempt + 1}/{max_retries}. Retrying in {delay:.2f} seconds...")
+            await asyncio.sleep(delay)
+    raise aio_pika.exceptions.AMQPConnectionError(f"Failed to connect to RabbitMQ after {max_retries} attempts.")
+
+
+def observe_trace(headers, payload):
+    trace = (headers or {}).get(TRACE_HEADER)
+    if not trace or "gateway" not in trace:
+        return
+    received = now_us()
+    elapsed = max(received - trace["gateway"][0], 0) / 1e6
+    if payload.get("preview"):
+        first_preview_seconds.observe(elapsed)
+        return
+    if payload.get("seq", 0) == 0:
+        first_result_seconds.observe(elapsed)
+    if payload.get("final", True):
+        end_to_end_seconds.observe(elapsed)
+        # Desglose por etapa tal como lo ve la petición completa
+        for stage, queue_wait, processing in stage_breakdown(trace, received):
+            registry.histogram(
+                f"gateway_stage_{stage}_queue_wait_seconds", f"Queue wait before {stage} as seen end to end",
+                buckets=STAGE_BUCKETS
+            ).observe(queue_wait)
+            registry.histogram(
+                f"gateway_stage_{stage}_processing_seconds", f"Processing time of {stage} as seen end to end",
+                buckets=STAGE_BUCKETS
+            ).observe(processing)
+
+
+def handle_response(correlation_id, headers, payload):
+    observe_trace(headers, payload)
+    # Los lotes pueden llegar desordenados (varios workers de formateo, reintentos):
+    # se entregan por orden de seq y el final solo cuando han llegado todos
+    for chunk in sequencer.accept(correlation_id, payload):
+        # Mismo resultado para todas las peticiones unidas a esta ejecución
+        for request_id in coalescer.deliver(correlation_id, chunk):
+            if not dispatcher.deliver(request_id, chunk):
+                logger.warning(f"Discarding result for unknown or expired request {request_id}")
+
+
+async def on_response(message):
+    async with message.process():
+        handle_response(message.correlation_id, message.headers, json.loads(message.body))
+
+
+async def expire_results():
+    while True:
+        await asyncio.sleep(RESULT_TTL / 10)
+        dispatcher.expire()
+        coalescer.expire(RESULT_TTL)
+        sequencer.expire(RESULT_TTL)
+
+
+def consume_in_memory(transport):
+    # Modo embebido (benchmarks.embedded): las respuestas llegan a hilos del
+    # transporte y se entregan en el bucle de eventos
+    loop = asyncio.get_running_loop()
+
+    def on_reply(ch, method, properties, body):
+        loop.call_soon_threadsafe(handle_response, properties.correlation_id, properties.headers, json.loads(body))
+
+    threading.Thread(
+        target=transport.consume, args=(REPLY_QUEUE, on_reply), name="gateway-replies", daemon=True
+    ).start()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    transport = get_transport(RABBITMQ_HOST)
+    if isinstance(transport, InMemoryTransport):
+        app.state.transport = transport
+        consume_in_memory(transport)
+        expiry_task = asyncio.create_task(expire_results())
+        yield
+        expiry_task.cancel()
+        return
+    app.state.transport = None
+    app.state.connection = await connect_rabbitmq(RABBITMQ_HOST)
+    app.state.channel = await app.state.connection.channel()
+    for queue in ('nlp_queue', 'credentials_queue'):
+        await app.state.channel.declare_queue(queue, arguments=queue_arguments(queue))
+    app.state.control_exchange = await app.state.channel.declare_exchange(
+        QUERY_CONTROL_EXCHANGE, aio_pika.ExchangeType.FANOUT
+    )
+    reply_queue = await app.state.channel.declare_queue(REPLY_QUEUE, exclusive=True, auto_delete=True)
+    await reply_queue.consume(on_response)
+    expiry_task = asyncio.create_task(expire_results())
+    yield
+    expiry_task.cancel()
+    await app.state.connection.close()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,52 +177,212 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
+
+async def publish(queue, payload, request_id=None, headers=None):
+    if app.state.transport is not None:
+        app.state.transport.publish(queue, json.dumps(payload), Properties(
+            correlation_id=request_id,
+            reply_to=REPLY_QUEUE if request_id else None,
+            headers=headers
+        ))
+        return
+    await app.state.channel.default_exchange.publish(
+        aio_pika.Message(
+            body=json.dumps(payload).encode(),
+            correlation_id=request_id,
+            reply_to=REPLY_QUEUE if request_id else None,
+            headers=headers
+        ),
+        routing_key=queue
+    )
 
 
 @app.post("/query")
 async def handle_query(request: Request):
     data = await request.json()
     query = data.get("query")
-    connection = get_rabbitmq_connection(RABBITMQ_HOST)
-    channel = connection.channel()
-    channel.queue_declare(queue='nlp_queue')
-    channel.basic_publish(exchange='', routing_key='nlp_queue', body=json.dumps({"query": query}))
-    connection.close()
-    return JSONResponse(content={"message": "Query sent to NLP Service"})
-
-# Update the credentials (DB)
+    # Fuente de datos sobre la que se pregunta; sin ella, la fuente por defecto
+    datasource_id = data.get("datasource_id")
+    preview = bool(data.get("preview", QUERY_PREVIEW))
+    request_id, coalesced = register_query(query, datasource_id, preview)
+    if not coalesced:
+        headers = pipeline_headers(request_id, datasource_id, preview)
+        await publish('nlp_queue', {"query": query}, request_id=request_id, headers=headers)
+    return JSONResponse(content={"message": "Query sent to NLP Service", "request_id": request_id})
+
+# Varias preguntas en una petición: el servicio NLP las recibe en un único mensaje
+# (una lectura del esquema, llamadas al LLM en paralelo) y cada una sigue la
+# tubería por su cuenta. La respuesta es un stream NDJSON con cada resultado según
+# llega, marcado con su posición en el lote, y un resumen final de los fallos.
+@app.post("/query/batch")
+async def handle_query_batch(request: Request):
+    data = await request.json()
+    queries = data.get("queries")
+    if not isinstance(queries, list) or not queries:
+        raise HTTPException(status_code=400, detail="'queries' must be a non-empty list")
+    if len(queries) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_SIZE} queries per batch")
+    datasource_id = data.get("datasource_id")
+    preview = bool(data.get("preview", QUERY_PREVIEW))
+    batch_id = uuid.uuid4().hex
+    request_ids, items = [], []
+    for query in queries:
+        request_id, coalesced = register_query(query, datasource_id, preview)
+        request_ids.append(request_id)
+        if not coalesced:
+            items.append({"request_id": request_id, "query": query})
+    if items:
+        headers = pipeline_headers(batch_id, datasource_id, preview)
+        await publish('nlp_queue', {"batch": items}, request_id=batch_id, headers=headers)
+    return StreamingResponse(batch_results(batch_id, request_ids), media_type="application/x-ndjson")
+
+
+def register_query(query, datasource_id, preview=False):
+    """Register a new request id; returns ``(request_id, coalesced)``, where
+    ``coalesced`` means it joined an identical query already in flight."""
+    request_id = uuid.uuid4().hex
+    dispatcher.register(request_id)
+    queries_total.inc()
+    # Con y sin vista previa llegan resultados distintos: no se unen entre sí
+    key = (datasource_id, normalize_question(query), preview)
+    delivered = coalescer.join(request_id, key)
+    if delivered is None:
+        coalescer.start(request_id, key)
+        return request_id, False
+    coalesced_total.inc()
+    for payload in delivered:
+        dispatcher.deliver(request_id, payload)
+    return request_id, True
+
+
+def pipeline_headers(trace_id, datasource_id, preview=False):
+    headers = start_trace(trace_id)
+    if datasource_id:
+        headers[DATASOURCE_HEADER] = datasource_id
+    if preview:
+        headers[PREVIEW_HEADER] = True
+    return headers
+
+
+async def batch_results(batch_id, request_ids):
+    merged = asyncio.Queue()
+
+    async def collect(index, request_id):
+        try:
+            async for payload in dispatcher.results(request_id, timeout=BATCH_TIMEOUT):
+                await merged.put((index, request_id, payload))
+        except asyncio.TimeoutError:
+            dispatcher.release(request_id)
+            await merged.put((index, request_id, {"type": "error", "data": "Timed out waiting for the result", "final": True}))
+
+    tasks = [asyncio.create_task(collect(index, request_id)) for index, request_id in enumerate(request_ids)]
+    failed = {}
+    pending = len(request_ids)
+    try:
+        while pending:
+            index, request_id, payload = await merged.get()
+            if payload.get("type") == "error":
+                failed[index] = payload.get("data")
+            if payload.get("final", True):
+                pending -= 1
+            yield json.dumps({"index": index, "request_id": request_id, **payload}) + "\n"
+        yield json.dumps({
+            "type": "summary",
+            "batch_id": batch_id,
+            "total": len(request_ids),
+            "succeeded": len(request_ids) - len(failed),
+            "failed": [{"index": index, "error": error} for index, error in sorted(failed.items())]
+        }) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def publish_control(payload):
+    if app.state.transport is not None:
+        app.state.transport.publish_event(QUERY_CONTROL_EXCHANGE, json.dumps(payload))
+        return
+    await app.state.control_exchange.publish(aio_pika.Message(body=json.dumps(payload).encode()), routing_key='')
+
+# Cancela una consulta: el servicio de ejecución la interrumpe en la base de datos
+# si ya está en marcha o la descarta cuando le llegue. La orden se difunde a todas
+# las réplicas, así que funciona aunque la consulta se lanzara desde otra.
+@app.delete("/query/{request_id}")
+async def cancel_query(request_id: str):
+    # Una petición unida a otras solo se descuelga: la ejecución sigue mientras alguien la espere
+    run_id = coalescer.leave(request_id)
+    if run_id is not None:
+        await publish_control({"event": "cancel", "request_id": run_id})
+    if dispatcher.is_registered(request_id):
+        # Quien espera el resultado en esta réplica se entera sin esperar al servicio de ejecución
+        dispatcher.deliver(request_id, {"type": "error", "data": "Query cancelled", "final": True})
+    return JSONResponse(status_code=202, content={"message": "Cancellation requested", "request_id": request_id})
+
+# Update the credentials (DB); el cuerpo puede incluir "datasource_id" para
+# registrar o actualizar una fuente de datos distinta de la por defecto
 @app.post("/credentials")
 async def update_credentials(request: Request):
     data = await request.json()
-    connection = get_rabbitmq_connection(RABBITMQ_HOST)
-    channel = connection.channel()
-    channel.queue_declare(queue='credentials_queue')
-    channel.basic_publish(exchange='', routing_key='credentials_queue', body=json.dumps(data))
-    connection.close()
+    await publish('credentials_queue', data, headers={TRACE_SENT_HEADER: now_us()})
     return JSONResponse(content={"message": "Credentials updated and metadata update requested"})
 
 
 @app.get("/events")
-async def handle_events(request: Request):
+async def handle_events(request: Request, request_id: str = None):
+    # Cada cliente recibe solo los resultados de su petición: sin request_id no hay stream
+    if request_id is None:
+        raise HTTPException(status_code=400, detail="Missing request_id (returned by POST /query)")
+    if not dispatcher.is_registered(request_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired request id")
+
     async def event_generator():
-        connection = get_rabbitmq_connection(RABBITMQ_HOST)
-        channel = connection.channel()
-        channel.queue_declare(queue='response_queue')
-
-        while True:
-            for method_frame, properties, body in channel.consume('response_queue', inactivity_timeout=1):
-                if method_frame:
-                    data = json.loads(body)
-                    yield {
-                        "event": "message",
-                        "data": json.dumps(data)
-                    }
-                    channel.basic_ack(method_frame.delivery_tag)
-                await asyncio.sleep(0.1)
+        async for data in dispatcher.results(request_id):
+            # Los resultados grandes llegan en varios eventos consecutivos (seq);
+            # el último lleva final=true. Una vista previa (preview=true) llega
+            # antes y el resultado completo la sustituye
+            yield {
+                "event": "message",
+                "id": "preview" if data.get("preview") else str(data.get("seq", 0)),
+                "data": json.dumps(data)
+            }
 
     return EventSourceResponse(event_generator())
 
+
+# Long-polling alternativo a /events para clientes sin SSE: devuelve el siguiente
+# resultado pendiente de la petición
+@app.get("/result/{request_id}")
+async def get_result(request_id: str, timeout: float = 30):
+    if not dispatcher.is_registered(request_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired request id")
+    results = dispatcher.results(request_id, timeout=timeout)
+    try:
+        return JSONResponse(content=await results.__anext__())
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=202, content={"message": "Result not ready", "request_id": request_id})
+    finally:
+        await results.aclose()
+
+
+# Sondas: /healthz indica que el proceso responde; /readyz, que puede aceptar consultas
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    if getattr(app.state, "transport", None) is not None:
+        return JSONResponse(content={"ready": True, "conditions": {"transport": True}})
+    connection = getattr(app.state, "connection", None)
+    ready = connection is not None and not connection.is_closed
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "conditions": {"rabbitmq": ready}})
+
+
+# Métricas del gateway en formato Prometheus, incluidas las de las trazas
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
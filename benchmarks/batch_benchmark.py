@@ -0,0 +1,83 @@
+# benchmarks/batch_benchmark.py
+#
+# Tiempo total de responder N preguntas con N peticiones POST /query seguidas
+# (cada una esperando su resultado con GET /result, como hacen los informes hoy)
+# frente a una única petición POST /query/batch.
+#
+# Las preguntas llevan una etiqueta distinta en cada pasada para que ni la caché
+# de SQL del servicio NLP ni la unión de preguntas idénticas del gateway
+# favorezcan a la segunda. Requiere httpx y la pila levantada. Uso (desde la raíz
+# del repositorio):
+#     python -m benchmarks.batch_benchmark --url http://localhost:8000 --queries 20
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+import httpx
+
+QUESTIONS = (
+    "¿Cuántos usuarios hay?",
+    "Lista los 10 productos más caros",
+    "¿Cuántos pedidos hay por estado?",
+    "Muestra los usuarios registrados este año",
+    "¿Cuál es el importe total de los pedidos?",
+)
+
+
+def questions(count):
+    tag = uuid.uuid4().hex[:6]
+    return [f"{QUESTIONS[i % len(QUESTIONS)]} (#{i} {tag})" for i in range(count)]
+
+
+async def wait_final(client, url, request_id):
+    while True:
+        response = await client.get(f"{url}/result/{request_id}", params={"timeout": 30})
+        if response.status_code == 202:
+            continue
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("final", True):
+            return payload.get("type") != "error"
+
+
+async def sequential(client, url, count):
+    succeeded = 0
+    for query in questions(count):
+        response = await client.post(f"{url}/query", json={"query": query})
+        response.raise_for_status()
+        succeeded += await wait_final(client, url, response.json()["request_id"])
+    return succeeded
+
+
+async def batch(client, url, count):
+    async with client.stream("POST", f"{url}/query/batch", json={"queries": questions(count)}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line:
+                payload = json.loads(line)
+                if payload.get("type") == "summary":
+                    return payload["succeeded"]
+    return 0
+
+
+async def run(url, count):
+    async with httpx.AsyncClient(timeout=None) as client:
+        print(f"{'mode':<12} {'queries':>8} {'ok':>5} {'wall s':>9}")
+        for name, fn in (("sequential", sequential), ("batch", batch)):
+            start = time.perf_counter()
+            succeeded = await fn(client, url, count)
+            print(f"{name:<12} {count:>8} {succeeded:>5} {time.perf_counter() - start:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# benchmarks/chaos_test.py
+#
+# Prueba de caos de la entrega fiable de common.consumer: varios procesos worker
+# consumen una cola de prueba y reenvían cada mensaje a una cola de salida;
+# algunos callbacks fallan al azar (reintentos) y mientras hay carga se matan
+# workers con SIGKILL y se arrancan otros. Al terminar, cada mensaje enviado debe
+# estar en la salida o en la DLQ: si falta alguno el script termina con error.
+# Los duplicados son esperables (entrega al menos una vez: un worker muerto entre
+# publicar y confirmar) y solo se informan. Los workers publican con publisher
+# confirms (RABBITMQ_CONFIRM_DELIVERY, activado por defecto); sin ellos una
+# publicación que RabbitMQ descarte no se detecta y la prueba no garantiza nada.
+# No se reinicia RabbitMQ: las colas no son durables.
+#
+# Necesita RabbitMQ pero no los servicios. Uso desde la raíz del repositorio:
+#     RABBITMQ_HOST=localhost python -m benchmarks.chaos_test --messages 2000 --workers 4 --kill-every 1
+
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter
+
+CHAOS_QUEUE = 'chaos_queue'
+OUTPUT_QUEUE = 'chaos_output_queue'
+
+
+def worker(host, failure_rate, work_seconds):
+    from common.consumer import Consumer
+    from common.publisher import get_publisher
+
+    def callback(ch, method, properties, body):
+        time.sleep(random.uniform(0, work_seconds))
+        if random.random() < failure_rate:
+            raise RuntimeError("fallo provocado")
+        get_publisher(host, confirm_delivery=True).publish(OUTPUT_QUEUE, body)
+
+    Consumer(host, CHAOS_QUEUE, callback, concurrency=2).run()
+
+
+def start_worker(args):
+    return subprocess.Popen([
+        sys.executable, "-m", "benchmarks.chaos_test", "--worker",
+        "--host", args.host, "--failure-rate", str(args.failure_rate), "--work-seconds", str(args.work_seconds),
+    ])
+
+
+def drain(channel, queue):
+    ids = []
+    while True:
+        method_frame, _, body = channel.basic_get(queue, auto_ack=True)
+        if method_frame is None:
+            return ids
+        ids.append(json.loads(body)["id"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("RABBITMQ_HOST", "localhost"))
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--kill-every", type=float, default=1.0, help="segundos entre SIGKILLs")
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--work-seconds", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.host, args.failure_rate, args.work_seconds)
+        return
+
+    from common.utils import get_rabbitmq_connection
+    from common.queues import declare_queue, declare_retry_queues, retry_queue, DEAD_LETTER_SUFFIX, MESSAGE_MAX_RETRIES
+
+    connection = get_rabbitmq_connection(args.host)
+    channel = connection.channel()
+    declare_queue(channel, CHAOS_QUEUE)
+    declare_retry_queues(channel, CHAOS_QUEUE)
+    declare_queue(channel, OUTPUT_QUEUE)
+    retry_queues = [retry_queue(CHAOS_QUEUE, retries) for retries in range(MESSAGE_MAX_RETRIES)]
+    for queue in [CHAOS_QUEUE, CHAOS_QUEUE + DEAD_LETTER_SUFFIX, OUTPUT_QUEUE] + retry_queues:
+        channel.queue_purge(queue=queue)
+
+    for i in range(args.messages):
+        channel.basic_publish(exchange='', routing_key=CHAOS_QUEUE, body=json.dumps({"id": i}))
+
+    workers = [start_worker(args) for _ in range(args.workers)]
+    kills = 0
+    output, dead = [], []
+    start = time.monotonic()
+    next_kill = start + args.kill_every
+    try:
+        while time.monotonic() - start < args.timeout:
+            output += drain(channel, OUTPUT_QUEUE)
+            dead += drain(channel, CHAOS_QUEUE + DEAD_LETTER_SUFFIX)
+            if len(set(output) | set(dead)) >= args.messages:
+                break
+            now = time.monotonic()
+            # Se mata mientras quede trabajo en la cola; después se deja terminar
+            pending = channel.queue_declare(queue=CHAOS_QUEUE, passive=True).method.message_count
+            if now >= next_kill and pending:
+                victim = random.randrange(len(workers))
+                workers[victim].send_signal(signal.SIGKILL)
+                workers[victim].wait()
+                workers[victim] = start_worker(args)
+                kills += 1
+                next_kill = now + args.kill_every
+            connection.sleep(0.1)
+    finally:
+        for process in workers:
+            process.send_signal(signal.SIGKILL)
+            process.wait()
+    elapsed = time.monotonic() - start
+    connection.close()
+
+    delivered = Counter(output)
+    lost = set(range(args.messages)) - set(output) - set(dead)
+    duplicates = sum(count - 1 for count in delivered.values())
+    print(f"messages:       {args.messages}")
+    print(f"workers killed: {kills} in {elapsed:.1f} s")
+    print(f"delivered:      {len(delivered)} (+{duplicates} duplicates)")
+    print(f"dead-lettered:  {len(set(dead))} (failed {MESSAGE_MAX_RETRIES + 1} times)")
+    print(f"lost:           {len(lost)}")
+    if lost:
+        print(f"FAIL: lost messages {sorted(lost)[:20]}")
+        sys.exit(1)
+    print("OK: no messages lost")
+
+
+if __name__ == "__main__":
+    main()
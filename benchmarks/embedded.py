@@ -0,0 +1,183 @@
+# benchmarks/embedded.py
+#
+# Modo embebido: la tubería completa (gateway -> NLP -> validación -> ejecución ->
+# formateo) en un único proceso, sin RabbitMQ, MongoDB ni LLM. Las etapas son los
+# mismos módulos de cada servicio y se comunican por colas en memoria
+# (common.transport.InMemoryTransport); el SQL lo genera el generador "template"
+# (o un LLM falso local, benchmarks.fake_llm_server, con --llm-latency) y las
+# consultas se ejecutan contra SQLite cargado desde db-init/init.sql (o contra un
+# PostgreSQL ya inicializado con --database postgresql). El propio proceso sirve
+# el esquema en metadata_request_queue con la introspección del servicio de
+# metadatos.
+#
+# Uso desde la raíz del repositorio (API en http://localhost:8000):
+#     python -m benchmarks.embedded
+#     python -m benchmarks.embedded --database postgresql --llm-latency 1.5
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+from benchmarks.fake_llm_server import start_fake_llm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INIT_SQL = os.path.join(ROOT, "db-init", "init.sql")
+
+SERVICE_DIRS = (
+    "api-gateway", "nlp-service", "validation-service", "execution-service", "formatting-service", "metadata-service"
+)
+# (módulo, cola, variable de concurrencia del servicio)
+STAGES = (
+    ("nlp_service", "nlp_queue", "NLP_CONCURRENCY"),
+    ("validation_service", "validation_queue", None),
+    ("execution_service", "execution_queue", "EXECUTION_CONCURRENCY"),
+    ("formatting_service", "formatting_queue", None),
+)
+# SQL que devuelve el LLM falso: válido en el fixture con cualquier base de datos
+FAKE_LLM_SQL = "SELECT COUNT(*) FROM usuarios;"
+
+
+def sqlite_script(sql):
+    """db-init/init.sql (PostgreSQL) as SQL that SQLite accepts."""
+    return re.sub(r"\bSERIAL PRIMARY KEY\b", "INTEGER PRIMARY KEY", sql, flags=re.IGNORECASE)
+
+
+def load_sqlite_fixture(path, init_sql=INIT_SQL):
+    """Create the SQLite database ``path`` from scratch with ``init_sql``."""
+    if os.path.exists(path):
+        os.remove(path)
+    with open(init_sql, encoding="utf-8") as f:
+        script = sqlite_script(f.read())
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(script)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def sqlite_credentials(path):
+    return {"db_type": "sqlite", "db_name": path}
+
+
+def postgresql_credentials():
+    return {
+        "db_type": "postgresql",
+        "db_host": os.getenv("DB_HOST", "localhost"),
+        "db_user": os.getenv("DB_USER", "user"),
+        "db_password": os.getenv("DB_PASSWORD", "password"),
+        "db_name": os.getenv("DB_NAME", "mydatabase"),
+    }
+
+
+class EmbeddedPipeline:
+    """Every stage of the pipeline running in this process.
+
+    ``start`` installs an ``InMemoryTransport``, imports the service modules
+    (configured through the same environment variables as their containers) and
+    starts their consumers on daemon threads; the gateway's FastAPI app is then
+    ``self.gateway.app``, whose lifespan attaches it to the same transport.
+    ``llm_latency`` replaces the template generator with the fake LLM, which
+    answers every question with ``llm_sql``.
+    """
+
+    def __init__(self, credentials, llm_latency=None, llm_sql=FAKE_LLM_SQL, env=None):
+        self.credentials = credentials
+        self.llm_latency = llm_latency
+        self.llm_sql = llm_sql
+        self.env = env or {}
+        self.transport = None
+        self.modules = {}
+        self.gateway = None
+        self._schema = None
+
+    def _configure(self):
+        os.environ.update(self.env)
+        if self.llm_latency is not None:
+            llm = start_fake_llm(latency=self.llm_latency, sql=self.llm_sql)
+            os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{llm.server_port}/v1"
+            os.environ.setdefault("OPENAI_API_KEY", "fake")
+            os.environ["SQL_GENERATOR"] = "openai"
+        else:
+            os.environ.setdefault("SQL_GENERATOR", "template")
+        for directory in SERVICE_DIRS:
+            path = os.path.join(ROOT, directory)
+            if path not in sys.path:
+                sys.path.insert(0, path)
+
+    def _serve_schema(self, ch, method, properties, body):
+        from common.transport import Properties
+        # Lo que haría el servicio de metadatos, sin MongoDB: el esquema del fixture
+        self.transport.publish(
+            properties.reply_to,
+            json.dumps(self._schema),
+            Properties(correlation_id=properties.correlation_id, headers={"schema_version": 1}),
+            declare=False
+        )
+
+    def _run(self, queue, callback, concurrency=1):
+        threading.Thread(
+            target=self.transport.consume, args=(queue, callback, concurrency), name=f"embedded-{queue}", daemon=True
+        ).start()
+
+    def start(self):
+        self._configure()
+        from common.transport import InMemoryTransport, set_transport
+        from common.metadata import METADATA_REQUEST_QUEUE
+        from common.datasources import DEFAULT_DATASOURCE_ID
+        self.transport = InMemoryTransport()
+        set_transport(self.transport)
+
+        schema_introspection = importlib.import_module("utils")
+        self._schema = schema_introspection.get_db_schema(self.credentials)
+        if not self._schema:
+            raise RuntimeError(f"Could not read the schema of {self.credentials['db_type']} database")
+        self._run(METADATA_REQUEST_QUEUE, self._serve_schema)
+
+        for name, queue, concurrency_name in STAGES:
+            module = importlib.import_module(name)
+            self.modules[name] = module
+            if hasattr(module, "credentials_cache"):
+                # Sin servicio de credenciales: la fuente por defecto es el fixture
+                module.credentials_cache.put(DEFAULT_DATASOURCE_ID, self.credentials)
+            if hasattr(module, "setup"):
+                module.setup()
+            self._run(queue, module.callback, getattr(module, concurrency_name) if concurrency_name else 1)
+        self.gateway = importlib.import_module("main")
+        return self
+
+    def stop(self):
+        self.transport.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", choices=("sqlite", "postgresql"), default="sqlite")
+    parser.add_argument("--sqlite-path", default=os.path.join(tempfile.gettempdir(), "smart_query_embedded.db"))
+    parser.add_argument("--llm-latency", type=float, help="usar el LLM falso con esta latencia en segundos")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.database == "sqlite":
+        load_sqlite_fixture(args.sqlite_path)
+        credentials = sqlite_credentials(args.sqlite_path)
+    else:
+        credentials = postgresql_credentials()
+    pipeline = EmbeddedPipeline(credentials, llm_latency=args.llm_latency).start()
+
+    import uvicorn
+    logging.getLogger(__name__).info("Embedded pipeline ready on port %d (%s)", args.port, args.database)
+    try:
+        uvicorn.run(pipeline.gateway.app, host="127.0.0.1", port=args.port)
+    finally:
+        pipeline.stop()
+
+
+if __name__ == "__main__":
+    main()
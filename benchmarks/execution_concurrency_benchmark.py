@@ -0,0 +1,121 @@
+# benchmarks/execution_concurrency_benchmark.py
+#
+# Latencia de las consultas rápidas del servicio de ejecución cuando compiten con
+# consultas lentas (pg_sleep), con un único worker y con EXECUTION_CONCURRENCY > 1.
+# Para cada concurrencia se mide primero solo la carga rápida (referencia) y después
+# la mezcla; con suficientes workers la p50 de las rápidas no debería moverse.
+#
+# Necesita RabbitMQ y PostgreSQL (p. ej. los de docker-compose) pero NO el servicio
+# de ejecución en marcha: el benchmark consume execution_queue y vacía
+# execution_queue/formatting_queue. Uso desde la raíz del repositorio:
+#     RABBITMQ_HOST=localhost DB_HOST=localhost python -m benchmarks.execution_concurrency_benchmark --concurrency 1 4
+
+import argparse
+import os
+import sys
+import json
+import threading
+import time
+import uuid
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAST_QUERY = "SELECT 1 AS uno"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(execution_service, host, concurrency, fast, slow, slow_seconds):
+    import pika
+    from common.consumer import Consumer
+    from common.utils import get_rabbitmq_connection
+    from common.queues import declare_queue
+
+    connection = get_rabbitmq_connection(host)
+    channel = connection.channel()
+    for queue in ('execution_queue', 'formatting_queue'):
+        declare_queue(channel, queue)
+        channel.queue_purge(queue=queue)
+
+    # Las lentas se encolan primero: sin concurrencia, las rápidas esperan detrás
+    jobs = [(f"slow-{i}", f"SELECT pg_sleep({slow_seconds})") for i in range(slow)]
+    jobs += [(f"fast-{i}-{uuid.uuid4().hex[:6]}", FAST_QUERY) for i in range(fast)]
+    sent = {}
+    for request_id, sql_query in jobs:
+        sent[request_id] = time.perf_counter()
+        channel.basic_publish(
+            exchange='',
+            routing_key='execution_queue',
+            properties=pika.BasicProperties(correlation_id=request_id),
+            body=json.dumps({"sql_query": sql_query})
+        )
+
+    consumer = Consumer(host, 'execution_queue', execution_service.callback, concurrency=concurrency)
+    thread = threading.Thread(target=consumer.run, daemon=True)
+    thread.start()
+
+    latencies = {}
+    for method_frame, properties, body in channel.consume('formatting_queue', inactivity_timeout=slow_seconds * (slow + 2) + 30):
+        if method_frame is None:
+            break
+        channel.basic_ack(method_frame.delivery_tag)
+        if (properties.headers or {}).get("final", True):
+            latencies[properties.correlation_id] = time.perf_counter() - sent[properties.correlation_id]
+        if len(latencies) == len(jobs):
+            break
+    channel.cancel()
+
+    consumer.stop()
+    thread.join()
+    connection.close()
+
+    fast_latencies = [v for k, v in latencies.items() if k.startswith("fast-")]
+    if len(fast_latencies) < fast:
+        print(f"  warning: only {len(fast_latencies)} of {fast} fast queries completed")
+    return fast_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("RABBITMQ_HOST", "localhost"))
+    parser.add_argument("--db-host", default=os.getenv("DB_HOST", "localhost"))
+    parser.add_argument("--db-user", default=os.getenv("DB_USER", "user"))
+    parser.add_argument("--db-password", default=os.getenv("DB_PASSWORD", "password"))
+    parser.add_argument("--db-name", default=os.getenv("DB_NAME", "mydatabase"))
+    parser.add_argument("--fast", type=int, default=50)
+    parser.add_argument("--slow", type=int, default=2)
+    parser.add_argument("--slow-seconds", type=float, default=3.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    os.environ["RABBITMQ_HOST"] = args.host
+    # Sin caché de resultados: todas las consultas rápidas son iguales
+    os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+    os.environ["DB_POOL_MAX_SIZE"] = str(max(args.concurrency))
+    sys.path.insert(0, os.path.join(ROOT, "execution-service"))
+    import execution_service
+
+    credentials = {
+        "db_type": "postgresql",
+        "db_host": args.db_host,
+        "db_user": args.db_user,
+        "db_password": args.db_password,
+        "db_name": args.db_name,
+    }
+    execution_service.get_credentials = lambda datasource_id=None: credentials
+
+    print(f"{'workers':>7} {'load':>10} {'fast p50 ms':>12} {'fast p95 ms':>12}")
+    for concurrency in args.concurrency:
+        for label, slow in (("fast only", 0), ("mixed", args.slow)):
+            latencies = run(execution_service, args.host, concurrency, args.fast, slow, args.slow_seconds)
+            if not latencies:
+                continue
+            print(f"{concurrency:>7} {label:>10} {statistics.median(latencies) * 1000:>12.1f} {percentile(latencies, 95) * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
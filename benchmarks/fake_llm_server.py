@@ -0,0 +1,138 @@
+# benchmarks/fake_llm_server.py
+#
+# Servidor local que imita el endpoint /v1/chat/completions de OpenAI con una
+# latencia configurable, para medir la tubería sin red ni coste de API.
+#
+# Uso independiente:
+#     python -m benchmarks.fake_llm_server --port 8099 --latency 1.5
+# y en el servicio NLP: OPENAI_BASE_URL=http://localhost:8099/v1 OPENAI_API_KEY=fake
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SQL = "SELECT COUNT(*) FROM usuarios;"
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    latency = 1.0
+    max_concurrent = 0
+    sql = DEFAULT_SQL
+    _in_flight = 0
+    _lock = threading.Lock()
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, request, sql):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for token in sql.split(" "):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": token + " "}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if (request.get("stream_options") or {}).get("include_usage"):
+            # Como la API: un último fragmento sin choices con el uso de tokens
+            prompt = request.get("messages", [{}])[-1].get("content", "")
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [],
+                "usage": {
+                    "prompt_tokens": len(prompt.split()),
+                    "completion_tokens": len(sql.split()),
+                    "total_tokens": len(prompt.split()) + len(sql.split()),
+                },
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        cls = type(self)
+        with cls._lock:
+            # Simular el rate limit del proveedor por encima de max_concurrent
+            if cls.max_concurrent and cls._in_flight >= cls.max_concurrent:
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, {"retry-after": "1"})
+                return
+            cls._in_flight += 1
+        try:
+            time.sleep(cls.latency)
+            prompt = request.get("messages", [{}])[-1].get("content", "")
+            if request.get("stream"):
+                self._send_stream(request, cls.sql)
+                return
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": cls.sql},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": len(prompt.split()),
+                    "completion_tokens": len(cls.sql.split()),
+                    "total_tokens": len(prompt.split()) + len(cls.sql.split()),
+                },
+            })
+        finally:
+            with cls._lock:
+                cls._in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_llm(port=0, latency=1.0, max_concurrent=0, sql=DEFAULT_SQL):
+    """Start the fake LLM on a daemon thread and return the server (``server.server_port``)."""
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "latency": latency,
+        "max_concurrent": max_concurrent,
+        "sql": sql,
+        "_in_flight": 0,
+        "_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--max-concurrent", type=int, default=0)
+    args = parser.parse_args()
+
+    server = start_fake_llm(args.port, args.latency, args.max_concurrent)
+    print(f"Fake LLM listening on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
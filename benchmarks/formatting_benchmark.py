@@ -0,0 +1,78 @@
+# benchmarks/formatting_benchmark.py
+#
+# CPU del formateo de un resultado: el formateo anterior por celdas
+# (astype(object) + where + to_dict(records)) frente al formateo por columnas de
+# formatting-service/formatter.py, incluida la serialización JSON de la respuesta.
+# El formateo por columnas se mide para el primer lote de un resultado (que decide
+# su forma) y para los siguientes (que no la vuelven a calcular).
+#
+# Uso desde la raíz del repositorio:
+#     python -m benchmarks.formatting_benchmark --rows 100000
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_frame(n):
+    # Mismo aspecto que un lote de Entradas tras pasar por el cable
+    rng = np.random.default_rng(0)
+    precio = rng.uniform(10, 100, n).round(2)
+    precio[::50] = np.nan
+    return pd.DataFrame({
+        "id_entrada": np.arange(n),
+        "id_evento": rng.integers(1, 500, n),
+        "precio": precio,
+        "fecha_compra": pd.date_range("2024-01-01", periods=n, freq="min").strftime("%Y-%m-%d").to_numpy(dtype=object),
+        "nombre": np.array([f"usuario {i % 1000}" for i in range(n)], dtype=object),
+    })
+
+
+def format_by_cell(df):
+    df = df.astype(object).where(pd.notnull(df), None)
+    return {"type": "table", "data": df.to_dict(orient='records')}
+
+
+def measure(fn, df, repeat):
+    # Mejor de `repeat` ejecuciones: formateo solo y formateo + json.dumps
+    best_format, best_total = None, None
+    for _ in range(repeat):
+        start = time.process_time()
+        formatted = fn(df)
+        format_cpu = time.process_time() - start
+        payload = json.dumps(formatted)
+        total_cpu = time.process_time() - start
+        best_format = format_cpu if best_format is None else min(best_format, format_cpu)
+        best_total = total_cpu if best_total is None else min(best_total, total_cpu)
+    return best_format, best_total, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(ROOT, "formatting-service"))
+    from formatter import format_frame
+
+    print(f"{'rows':>9} {'':>9} {'format s':>9} {'+ json s':>9} {'bytes':>12}")
+    for n in args.rows:
+        df = make_frame(n)
+        cell = measure(format_by_cell, df, args.repeat)
+        first = measure(format_frame, df, args.repeat)
+        later = measure(lambda df: format_frame(df, with_shape=False), df, args.repeat)
+        for label, (format_cpu, total_cpu, size) in (("by cell", cell), ("1st chunk", first), ("next", later)):
+            print(f"{n:>9} {label:>9} {format_cpu:>9.3f} {total_cpu:>9.3f} {size:>12,}")
+        for label, columnar in (("x 1st", first), ("x next", later)):
+            print(f"{'':>9} {label:>9} {cell[0] / columnar[0]:>8.1f}x {cell[1] / columnar[1]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/gateway_load_test.py
+#
+# Prueba de carga del API Gateway: abre N streams concurrentes a /events y mide
+# la latencia (p50/p99) de POST /query mientras siguen abiertos. Cada stream es
+# el de una consulta propia (/events exige request_id); cuando llega su
+# resultado final se lanza otra y se vuelve a abrir.
+#
+# Requiere httpx. Uso (desde la raíz del repositorio, con la pila levantada):
+#     python -m benchmarks.gateway_load_test --url http://localhost:8000 --streams 0 100 500 --queries 200
+
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+
+async def hold_stream(client, url, ready, stop, index):
+    first = True
+    while not stop.is_set():
+        response = await client.post(f"{url}/query", json={"query": f"load test stream {index}"})
+        response.raise_for_status()
+        request_id = response.json()["request_id"]
+        async with client.stream("GET", f"{url}/events", params={"request_id": request_id}) as response:
+            if first:
+                ready.release()
+                first = False
+            async for _ in response.aiter_lines():
+                if stop.is_set():
+                    break
+
+
+async def measure_queries(client, url, queries, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(i):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(f"{url}/query", json={"query": f"load test query {i}"})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(post(i) for i in range(queries)))
+    return sorted(latencies)
+
+
+def percentile(values, pct):
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run(url, streams, queries, concurrency):
+    limits = httpx.Limits(max_connections=streams + concurrency + 10)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        ready = asyncio.Semaphore(0)
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(hold_stream(client, url, ready, stop, i)) for i in range(streams)]
+        for _ in range(streams):
+            await ready.acquire()
+
+        latencies = await measure_queries(client, url, queries, concurrency)
+
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(
+        f"{streams:>6} streams  {queries:>6} queries  "
+        f"p50 {statistics.median(latencies) * 1000:>8.2f} ms  "
+        f"p99 {percentile(latencies, 99) * 1000:>8.2f} ms  "
+        f"max {latencies[-1] * 1000:>8.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--streams", type=int, nargs="+", default=[0, 100, 500])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    for streams in args.streams:
+        asyncio.run(run(args.url, streams, args.queries, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# benchmarks/nlp_concurrency_benchmark.py
+#
+# Mide el throughput del worker NLP frente a un LLM local falso con latencia fija
+# para distintos niveles de concurrencia (NLP_CONCURRENCY).
+#
+# Necesita RabbitMQ pero NO el servicio NLP en marcha (el benchmark consume
+# nlp_queue y vacía nlp_queue/validation_queue). Uso desde la raíz del repositorio:
+#     RABBITMQ_HOST=localhost python -m benchmarks.nlp_concurrency_benchmark --concurrency 1 2 4 8 16
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from benchmarks.fake_llm_server import start_fake_llm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARK_SCHEMA = {
+    "usuarios": {
+        "columns": [
+            {"column_name": "id_usuario", "data_type": "integer"},
+            {"column_name": "nombre", "data_type": "character varying"},
+            {"column_name": "email", "data_type": "character varying"},
+            {"column_name": "fecha_registro", "data_type": "date"},
+        ],
+        "primary_keys": ["id_usuario"],
+        "foreign_keys": [],
+    }
+}
+
+
+def queue_depth(channel, queue):
+    return channel.queue_declare(queue=queue, passive=True).method.message_count
+
+
+def run(nlp_service, host, messages, concurrency):
+    from common.consumer import Consumer
+    from common.utils import get_rabbitmq_connection
+    from common.queues import declare_queue
+
+    connection = get_rabbitmq_connection(host)
+    channel = connection.channel()
+    for queue in ('nlp_queue', 'validation_queue'):
+        declare_queue(channel, queue)
+        channel.queue_purge(queue=queue)
+    for i in range(messages):
+        channel.basic_publish(exchange='', routing_key='nlp_queue', body=json.dumps({"query": f"benchmark question {i}"}))
+
+    consumer = Consumer(host, 'nlp_queue', nlp_service.callback, concurrency=concurrency)
+    thread = threading.Thread(target=consumer.run, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    while queue_depth(channel, 'validation_queue') < messages:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    consumer.stop()
+    thread.join()
+
+    channel.queue_purge(queue='validation_queue')
+    connection.close()
+    print(f"concurrency {concurrency:>3}  {messages:>5} msgs  {elapsed:>8.2f} s  {messages / elapsed:>8.2f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("RABBITMQ_HOST", "localhost"))
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=1.0, help="Fake LLM latency in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    llm = start_fake_llm(latency=args.latency)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{llm.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ["RABBITMQ_HOST"] = args.host
+    os.environ["SQL_CACHE_SIMILARITY"] = "1"
+    sys.path.insert(0, os.path.join(ROOT, "nlp-service"))
+    import nlp_service
+
+    # Esquema fijo: el benchmark mide el LLM y la concurrencia, no el servicio de metadatos
+    nlp_service.get_schema_cache(nlp_service.DEFAULT_DATASOURCE_ID).loader = lambda: (BENCHMARK_SCHEMA, 0)
+
+    print(f"Fake LLM latency {args.latency:.2f} s -> ideal throughput {1 / args.latency:.2f} msg/s per worker")
+    for concurrency in args.concurrency:
+        nlp_service.sql_cache.invalidate()
+        run(nlp_service, args.host, args.messages, concurrency)
+
+
+if __name__ == "__main__":
+    main()
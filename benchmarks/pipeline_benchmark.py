@@ -0,0 +1,205 @@
+# benchmarks/pipeline_benchmark.py
+#
+# Throughput y latencia por etapa de la tubería completa sin infraestructura: usa
+# el modo embebido (benchmarks.embedded, colas en memoria, generador "template" o
+# LLM falso, SQLite cargado desde db-init/init.sql) y atraviesa el gateway por
+# ASGI, sin red. Para cada número de clientes simultáneos envía las mismas
+# preguntas (POST /query + GET /result) y muestra las consultas por segundo, la
+# latencia extremo a extremo y, de los histogramas de common.tracing, la espera en
+# cola y el tiempo de proceso medios de cada etapa (p95 como límite del bucket).
+#
+# Reproducible: fixture recreado en cada ejecución, preguntas fijas y cachés
+# (SQL, resultados, unión de preguntas) desactivadas salvo con --caches. Con
+# --output se guardan los resultados en JSON junto al commit, para comparar
+# commits. Uso desde la raíz del repositorio:
+#     python -m benchmarks.pipeline_benchmark --queries 500 --clients 1 8 32
+#     python -m benchmarks.pipeline_benchmark --llm-latency 0.5 --output results.json
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import httpx
+from benchmarks.embedded import ROOT, EmbeddedPipeline, load_sqlite_fixture, sqlite_credentials, postgresql_credentials
+
+STAGES = ("nlp", "validation", "execution", "formatting")
+QUESTIONS = (
+    "¿Cuántos usuarios hay?",
+    "Lista los eventos",
+    "¿Cuál es el precio medio de las entradas?",
+    "Muestra los artistas",
+    "¿Cuántas opiniones hay?",
+    "Suma de la capacidad de los locales",
+    "Lista las categorías",
+    "¿Cuántos eventos hay por artista?",
+)
+# Sin cachés cada consulta recorre todas las etapas
+NO_CACHES = {"SQL_CACHE_SIZE": "0", "RESULT_CACHE_MAX_BYTES": "0", "COALESCE_WINDOW": "0"}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def snapshot(registry):
+    """``{histogram: (count, sum, bucket counts)}`` of the per-stage histograms."""
+    histograms = {}
+    for stage in STAGES:
+        for kind in ("queue_wait", "processing"):
+            histogram = registry.histogram(f"{stage}_{kind}_seconds", "")
+            histograms[(stage, kind)] = (histogram.count, histogram.sum, list(histogram.counts), histogram.buckets)
+    return histograms
+
+
+def stage_latencies(before, after):
+    """Mean and p95 (bucket upper bound) in ms of each stage between two snapshots."""
+    latencies = {}
+    for key, (count, total, counts, buckets) in after.items():
+        count -= before[key][0]
+        total -= before[key][1]
+        deltas = [c - b for c, b in zip(counts, before[key][2])]
+        p95, cumulative = None, 0
+        for bound, delta in zip(buckets, deltas):
+            cumulative += delta
+            if count and cumulative >= 0.95 * count:
+                p95 = bound * 1000
+                break
+        latencies[key] = {"count": count, "mean_ms": total / count * 1000 if count else 0.0, "p95_le_ms": p95}
+    return latencies
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def ask(client, query):
+    start = time.perf_counter()
+    response = await client.post("/query", json={"query": query})
+    response.raise_for_status()
+    request_id = response.json()["request_id"]
+    while True:
+        response = await client.get(f"/result/{request_id}", params={"timeout": 30})
+        if response.status_code == 202:
+            continue
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("final", True):
+            return time.perf_counter() - start, payload.get("type") != "error"
+
+
+async def run_level(client, queries, clients):
+    pending = iter(queries)
+    latencies, failures = [], 0
+
+    async def worker():
+        nonlocal failures
+        for query in pending:
+            elapsed, ok = await ask(client, query)
+            latencies.append(elapsed)
+            failures += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return time.perf_counter() - start, latencies, failures
+
+
+async def run(pipeline, args):
+    from common.metrics import registry
+    gateway = pipeline.gateway
+    queries = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.queries)]
+    results = []
+    async with gateway.lifespan(gateway.app):
+        transport = httpx.ASGITransport(app=gateway.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://embedded", timeout=None) as client:
+            # Calentamiento: imports perezosos, pools de conexiones, esquema
+            await run_level(client, queries[:len(QUESTIONS)], 1)
+            for clients in args.clients:
+                before = snapshot(registry)
+                wall, latencies, failures = await run_level(client, queries, clients)
+                results.append({
+                    "clients": clients,
+                    "queries": len(queries),
+                    "failures": failures,
+                    "wall_s": wall,
+                    "throughput_qps": len(queries) / wall,
+                    "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+                    "latency_p95_ms": percentile(latencies, 0.95) * 1000,
+                    "stages": {
+                        f"{stage}.{kind}": values
+                        for (stage, kind), values in stage_latencies(before, snapshot(registry)).items()
+                    },
+                })
+    return results
+
+
+def report(results):
+    print(f"{'clients':>7} {'queries':>7} {'fail':>5} {'q/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for result in results:
+        print(
+            f"{result['clients']:>7} {result['queries']:>7} {result['failures']:>5} {result['throughput_qps']:>9.1f} "
+            f"{result['latency_p50_ms']:>8.2f} {result['latency_p95_ms']:>8.2f}"
+        )
+    for result in results:
+        print(f"\nper stage, {result['clients']} clients (mean ms / p95 bucket ms)")
+        print(f"  {'stage':<12} {'queue wait':>18} {'processing':>18}")
+        for stage in STAGES:
+            cells = []
+            for kind in ("queue_wait", "processing"):
+                values = result["stages"][f"{stage}.{kind}"]
+                p95 = f"<={values['p95_le_ms']:g}" if values["p95_le_ms"] is not None else ">60000"
+                cells.append(f"{values['mean_ms']:>8.2f} / {p95:<7}")
+            print(f"  {stage:<12} {cells[0]:>18} {cells[1]:>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--database", choices=("sqlite", "postgresql"), default="sqlite")
+    parser.add_argument("--llm-latency", type=float, help="usar el LLM falso con esta latencia en segundos")
+    parser.add_argument("--caches", action="store_true", help="dejar activadas las cachés de SQL y de resultados")
+    parser.add_argument("--output", help="guardar los resultados en este fichero JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    if args.database == "sqlite":
+        path = os.path.join(tempfile.mkdtemp(prefix="smart_query_bench_"), "fixture.db")
+        load_sqlite_fixture(path)
+        credentials = sqlite_credentials(path)
+    else:
+        credentials = postgresql_credentials()
+    pipeline = EmbeddedPipeline(
+        credentials, llm_latency=args.llm_latency, env=None if args.caches else NO_CACHES
+    ).start()
+    try:
+        results = asyncio.run(run(pipeline, args))
+    finally:
+        pipeline.stop()
+
+    report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "database": args.database,
+                "generator": "fake-llm" if args.llm_latency is not None else "template",
+                "llm_latency": args.llm_latency,
+                "caches": args.caches,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
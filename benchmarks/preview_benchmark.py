@@ -0,0 +1,109 @@
+# benchmarks/preview_benchmark.py
+#
+# Tiempo hasta el primer resultado visible (time-to-first-pixel) de una consulta
+# analítica pesada con y sin vista previa (POST /query con "preview"). Crea en
+# PostgreSQL una tabla de entradas con --rows filas (una vez; se reutiliza) y
+# ejecuta la tubería en modo embebido (benchmarks.embedded) con un LLM falso que
+# siempre devuelve la misma agregación (sin COUNT ni SUM, que no se previsualizan
+# sobre una muestra), de modo que solo cambia la ejecución.
+# Muestra, por modo, la mediana del tiempo hasta el primer payload (la vista
+# previa si la hay) y hasta el resultado final.
+#
+# Requiere PostgreSQL (DB_HOST, DB_USER, DB_PASSWORD, DB_NAME). Uso desde la raíz:
+#     docker-compose up -d db
+#     python -m benchmarks.preview_benchmark --rows 5000000 --runs 5
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+import httpx
+import psycopg2
+from benchmarks.embedded import EmbeddedPipeline, postgresql_credentials
+
+TABLE = "preview_benchmark_entradas"
+HEAVY_SQL = (
+    f"SELECT id_evento, AVG(precio) AS precio_medio, MAX(precio) AS precio_maximo "
+    f"FROM {TABLE} GROUP BY id_evento ORDER BY precio_medio DESC;"
+)
+
+
+def create_table(credentials, rows):
+    conn = psycopg2.connect(
+        host=credentials["db_host"], user=credentials["db_user"],
+        password=credentials["db_password"], dbname=credentials["db_name"]
+    )
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s)", (TABLE,))
+            if cur.fetchone()[0] is not None:
+                cur.execute(f"SELECT COUNT(*) FROM {TABLE}")
+                if cur.fetchone()[0] == rows:
+                    return
+                cur.execute(f"DROP TABLE {TABLE}")
+            print(f"Creating {TABLE} with {rows} rows...")
+            cur.execute(
+                f"CREATE TABLE {TABLE} AS "
+                f"SELECT i AS id_entrada, i %% 1000 AS id_evento, (i %% 9000) / 100.0 AS precio "
+                f"FROM generate_series(1, %s) AS i",
+                (rows,)
+            )
+            cur.execute(f"ANALYZE {TABLE}")
+    finally:
+        conn.close()
+
+
+async def ask(client, preview):
+    start = time.perf_counter()
+    response = await client.post("/query", json={"query": "precio medio de las entradas por evento", "preview": preview})
+    response.raise_for_status()
+    request_id = response.json()["request_id"]
+    first = None
+    while True:
+        response = await client.get(f"/result/{request_id}", params={"timeout": 120})
+        if response.status_code == 202:
+            continue
+        response.raise_for_status()
+        payload = response.json()
+        if first is None:
+            first = time.perf_counter() - start
+        if payload.get("final", True):
+            return first, time.perf_counter() - start
+
+
+async def run(pipeline, runs):
+    gateway = pipeline.gateway
+    async with gateway.lifespan(gateway.app):
+        transport = httpx.ASGITransport(app=gateway.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://embedded", timeout=None) as client:
+            await ask(client, False)
+            print(f"{'mode':<10} {'first s':>9} {'final s':>9}")
+            for preview in (False, True):
+                timings = [await ask(client, preview) for _ in range(runs)]
+                first = statistics.median(t[0] for t in timings)
+                final = statistics.median(t[1] for t in timings)
+                print(f"{'preview' if preview else 'full':<10} {first:>9.3f} {final:>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    credentials = postgresql_credentials()
+    create_table(credentials, args.rows)
+    pipeline = EmbeddedPipeline(
+        credentials, llm_latency=0, llm_sql=HEAVY_SQL,
+        env={"SQL_CACHE_SIZE": "0", "RESULT_CACHE_MAX_BYTES": "0", "COALESCE_WINDOW": "0"}
+    ).start()
+    try:
+        asyncio.run(run(pipeline, args.runs))
+    finally:
+        pipeline.stop()
+
+
+if __name__ == "__main__":
+    main()
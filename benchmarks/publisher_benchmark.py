@@ -0,0 +1,70 @@
+# benchmarks/publisher_benchmark.py
+#
+# Compara los mensajes/segundo del patrón "una conexión por mensaje" con el
+# publicador persistente de common.publisher.
+#
+# Uso (desde la raíz del repositorio, con RabbitMQ levantado):
+#     RABBITMQ_HOST=localhost python -m benchmarks.publisher_benchmark --messages 2000
+
+import argparse
+import json
+import os
+import time
+from common.utils import get_rabbitmq_connection
+from common.publisher import Publisher
+from common.queues import declare_queue
+
+BENCHMARK_QUEUE = 'publisher_benchmark_queue'
+
+
+def connect_per_message(host, bodies):
+    for body in bodies:
+        connection = get_rabbitmq_connection(host)
+        channel = connection.channel()
+        declare_queue(channel, BENCHMARK_QUEUE)
+        channel.basic_publish(exchange='', routing_key=BENCHMARK_QUEUE, body=body)
+        connection.close()
+
+
+def pooled_publisher(host, bodies, confirm_delivery=False):
+    publisher = Publisher(host, confirm_delivery=confirm_delivery)
+    for body in bodies:
+        publisher.publish(BENCHMARK_QUEUE, body)
+    publisher.close()
+
+
+def purge(host):
+    connection = get_rabbitmq_connection(host)
+    channel = connection.channel()
+    declare_queue(channel, BENCHMARK_QUEUE)
+    channel.queue_purge(queue=BENCHMARK_QUEUE)
+    connection.close()
+
+
+def run(name, fn, host, bodies):
+    purge(host)
+    start = time.perf_counter()
+    fn(host, bodies)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {len(bodies):>8} msgs {elapsed:>9.3f} s {len(bodies) / elapsed:>12.1f} msg/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=os.getenv("RABBITMQ_HOST", "localhost"))
+    parser.add_argument("--messages", type=int, default=1000)
+    args = parser.parse_args()
+
+    bodies = [json.dumps({"query": f"benchmark query {i}"}) for i in range(args.messages)]
+
+    baseline = run("connect-per-message", connect_per_message, args.host, bodies)
+    pooled = run("pooled", pooled_publisher, args.host, bodies)
+    confirmed = run("pooled + confirms", lambda host, b: pooled_publisher(host, b, confirm_delivery=True), args.host, bodies)
+    purge(args.host)
+
+    print(f"\nSpeed-up pooled: {baseline / pooled:.1f}x, pooled + confirms: {baseline / confirmed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
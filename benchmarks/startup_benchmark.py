@@ -0,0 +1,154 @@
+# benchmarks/startup_benchmark.py
+#
+# Tiempo desde que se arrancan los servicios hasta que cada uno está listo
+# (/readyz) y hasta que la primera consulta devuelve su resultado final
+# (time-to-first-query). Lanza el gateway y los servicios como procesos locales
+# contra RabbitMQ, MongoDB y PostgreSQL ya levantados (p. ej. solo esos
+# contenedores de docker-compose) y usa el generador de SQL "template", así que no
+# necesita OpenAI. Con --runs > 1 se repite el arranque (arranques en caliente:
+# el esquema ya está guardado en MongoDB).
+#
+# Uso desde la raíz del repositorio:
+#     docker-compose up -d rabbitmq mongo db
+#     python -m benchmarks.startup_benchmark --runs 3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = (
+    ("credentials-service", "credentials_service.py"),
+    ("metadata-service", "metadata_service.py"),
+    ("nlp-service", "nlp_service.py"),
+    ("validation-service", "validation_service.py"),
+    ("execution-service", "execution_service.py"),
+    ("formatting-service", "formatting_service.py"),
+)
+FIRST_QUERY = "¿Cuántos usuarios hay?"
+
+
+def http(method, url, payload=None, timeout=5):
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status, json.loads(response.read() or b"null")
+
+
+def is_ready(url):
+    try:
+        return http("GET", url, timeout=1)[0] == 200
+    except (urllib.error.URLError, OSError, ValueError):
+        return False
+
+
+def start(args):
+    env = {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "RABBITMQ_HOST": args.rabbitmq_host,
+        "MONGO_URI": args.mongo_uri,
+        "DB_HOST": args.db_host,
+        "DB_USER": args.db_user,
+        "DB_PASSWORD": args.db_password,
+        "DB_NAME": args.db_name,
+        "SQL_GENERATOR": "template",
+    }
+    processes, probes = [], {}
+    for i, (directory, script) in enumerate(SERVICES):
+        port = args.metrics_port + i
+        processes.append(subprocess.Popen(
+            [sys.executable, script], cwd=os.path.join(ROOT, directory),
+            env={**env, "METRICS_PORT": str(port)}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ))
+        probes[directory] = f"http://localhost:{port}/readyz"
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.gateway_port)],
+        cwd=os.path.join(ROOT, "api-gateway"), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ))
+    probes["api-gateway"] = f"http://localhost:{args.gateway_port}/readyz"
+    return processes, probes
+
+
+def first_query(gateway, deadline):
+    while time.monotonic() < deadline:
+        try:
+            _, accepted = http("POST", f"{gateway}/query", {"query": FIRST_QUERY})
+            break
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.05)
+    else:
+        return None
+    while time.monotonic() < deadline:
+        status, payload = http("GET", f"{gateway}/result/{accepted['request_id']}?timeout=5", timeout=10)
+        if status == 200 and payload.get("final", True):
+            return payload
+    return None
+
+
+def watch_readiness(probes, ready_at, start_time, stop):
+    while len(ready_at) < len(probes) and not stop.is_set():
+        for name, url in probes.items():
+            if name not in ready_at and is_ready(url):
+                ready_at[name] = time.monotonic() - start_time
+        stop.wait(0.05)
+
+
+def run_once(args):
+    start_time = time.monotonic()
+    processes, probes = start(args)
+    ready_at = {}
+    stop = threading.Event()
+    # Las sondas se consultan mientras la primera consulta espera su resultado
+    watcher = threading.Thread(target=watch_readiness, args=(probes, ready_at, start_time, stop), daemon=True)
+    watcher.start()
+    try:
+        result = first_query(f"http://localhost:{args.gateway_port}", start_time + args.timeout)
+        first_query_at = time.monotonic() - start_time
+        watcher.join(max(0.0, start_time + args.timeout - time.monotonic()))
+    finally:
+        stop.set()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    return ready_at, first_query_at if result is not None else None, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rabbitmq-host", default=os.getenv("RABBITMQ_HOST", "localhost"))
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db-host", default=os.getenv("DB_HOST", "localhost"))
+    parser.add_argument("--db-user", default=os.getenv("DB_USER", "user"))
+    parser.add_argument("--db-password", default=os.getenv("DB_PASSWORD", "password"))
+    parser.add_argument("--db-name", default=os.getenv("DB_NAME", "mydatabase"))
+    parser.add_argument("--gateway-port", type=int, default=8010)
+    parser.add_argument("--metrics-port", type=int, default=9301)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--target", type=float, default=5.0, help="objetivo de time-to-first-query en segundos")
+    args = parser.parse_args()
+
+    for run in range(args.runs):
+        ready_at, first_query_at, result = run_once(args)
+        print(f"run {run + 1}")
+        for name, _ in SERVICES + (("api-gateway", None),):
+            ready = f"{ready_at[name]:.2f} s" if name in ready_at else "not ready"
+            print(f"  {name:<22} ready after {ready}")
+        if first_query_at is None:
+            print("  first query: no result before the timeout")
+            continue
+        verdict = "OK" if first_query_at <= args.target else "over target"
+        print(f"  time to first query: {first_query_at:.2f} s ({result.get('type')}) -- {verdict} ({args.target:.0f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# benchmarks/tracing_overhead_benchmark.py
+#
+# Coste de las trazas de common.tracing por mensaje: un callback vacío que
+# reenvía el mensaje con propagate_properties, con y sin @traced y con y sin
+# trace_id en las cabeceras, más la codificación AMQP de las cabeceras (pika)
+# de un mensaje que ya ha atravesado toda la tubería.
+#
+# No necesita RabbitMQ ni ningún servicio. Uso desde la raíz del repositorio:
+#     python -m benchmarks.tracing_overhead_benchmark --messages 100000
+
+import argparse
+import time
+
+import pika
+from pika import data as amqp_data
+
+from common.publisher import propagate_properties
+from common.tracing import traced, start_trace, stage_breakdown, now_us
+
+STAGES = ("nlp", "validation", "execution", "formatting")
+
+
+def forward(ch, method, properties, body):
+    return propagate_properties(properties)
+
+
+def run(callback, properties, messages):
+    start = time.perf_counter()
+    for _ in range(messages):
+        callback(None, None, properties, b"{}")
+    return (time.perf_counter() - start) / messages * 1e6
+
+
+def full_trace_properties():
+    # Cabeceras tal como llegan al gateway tras pasar por todas las etapas
+    properties = pika.BasicProperties(correlation_id="bench", headers=start_trace("bench"))
+    for stage in STAGES:
+        properties = traced(stage)(forward)(None, None, properties, b"{}")
+    return properties
+
+
+def encoded_size(headers):
+    pieces = []
+    amqp_data.encode_table(pieces, headers)
+    return sum(len(p) for p in pieces)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    untraced = pika.BasicProperties(correlation_id="bench", headers={"datasource_id": "default"})
+    traced_headers = dict(start_trace("bench"), datasource_id="default")
+    with_trace = pika.BasicProperties(correlation_id="bench", headers=traced_headers)
+    cases = (
+        ("plain callback, no trace", forward, untraced),
+        ("@traced, no trace id", traced("bench_untraced")(forward), untraced),
+        ("@traced, trace id", traced("bench_traced")(forward), with_trace),
+    )
+    baseline = None
+    print(f"{'case':<28} {'us/msg':>8} {'overhead us':>12}")
+    for label, callback, properties in cases:
+        run(callback, properties, min(args.messages, 1000))
+        per_message = run(callback, properties, args.messages)
+        baseline = per_message if baseline is None else baseline
+        print(f"{label:<28} {per_message:>8.2f} {per_message - baseline:>12.2f}")
+
+    properties = full_trace_properties()
+    plain_size = encoded_size(untraced.headers)
+    traced_size = encoded_size(properties.headers)
+    print(f"\nAMQP headers after {len(STAGES)} stages: {traced_size} bytes ({traced_size - plain_size} added by the trace)")
+
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        stage_breakdown(properties.headers["trace"], now_us())
+    print(f"gateway stage_breakdown: {(time.perf_counter() - start) / args.messages * 1e6:.2f} us/msg")
+
+
+if __name__ == "__main__":
+    main()
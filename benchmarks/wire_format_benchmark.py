@@ -0,0 +1,57 @@
+# benchmarks/wire_format_benchmark.py
+#
+# Micro-benchmark del formato de los lotes execution -> formatting: tiempo de CPU
+# de serialización + deserialización (hasta DataFrame) y bytes en el cable, JSON
+# por filas frente a Arrow IPC por columnas.
+#
+# Requiere pandas y pyarrow. Uso desde la raíz del repositorio:
+#     python -m benchmarks.wire_format_benchmark --rows 10000 100000 1000000
+
+import argparse
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+import pandas as pd
+from common.wire import encode_result, decode_result, arrow_to_pandas
+
+COLUMNS = ["id_entrada", "id_evento", "precio", "fecha_compra", "nombre"]
+
+
+def make_rows(n):
+    # Filas con la forma de Entradas: enteros, DECIMAL(10,2), DATE y texto
+    start = date(2024, 1, 1)
+    return [
+        (i, i % 500, Decimal(f"{10 + i % 90}.{i % 100:02d}"), start + timedelta(days=i % 365), f"usuario {i % 1000}")
+        for i in range(n)
+    ]
+
+
+def roundtrip(rows, wire_format):
+    cpu_start = time.process_time()
+    body, content_type = encode_result(COLUMNS, rows, {"seq": 0, "final": True}, wire_format)
+    encode_cpu = time.process_time() - cpu_start
+
+    cpu_start = time.process_time()
+    columns, data = decode_result(body, content_type)
+    df = pd.DataFrame(data, columns=columns) if isinstance(data, list) else arrow_to_pandas(data)
+    decode_cpu = time.process_time() - cpu_start
+    assert len(df) == len(rows)
+    return content_type, len(body), encode_cpu, decode_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'format':>6} {'bytes':>12} {'encode s':>9} {'decode s':>9} {'total s':>9}")
+    for n in args.rows:
+        rows = make_rows(n)
+        for wire_format in ("json", "arrow"):
+            content_type, size, encode_cpu, decode_cpu = roundtrip(rows, wire_format)
+            label = "arrow" if "arrow" in content_type else "json"
+            print(f"{n:>9} {label:>6} {size:>12,} {encode_cpu:>9.3f} {decode_cpu:>9.3f} {encode_cpu + decode_cpu:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# common/consumer.py
+
+import os
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pika.exceptions import NackError, UnroutableError
+from common.utils import get_rabbitmq_connection
+from common.metrics import registry
+from common.readiness import readiness
+from common.queues import (
+    declare_queue, declare_retry_queues, retry_queue, MESSAGE_MAX_RETRIES, RETRIES_HEADER
+)
+
+logger = logging.getLogger(__name__)
+
+# Mensajes sin confirmar que RabbitMQ entrega a cada consumidor; por defecto, su concurrencia
+RABBITMQ_PREFETCH_COUNT = int(os.getenv("RABBITMQ_PREFETCH_COUNT", "0"))
+
+
+class Consumer:
+    """Consume a queue running up to ``concurrency`` callbacks at the same time.
+
+    ``callback`` keeps the usual pika signature ``(ch, method, properties, body)``
+    but runs on a worker thread, so it must not use ``ch`` directly. The message
+    is acked once the callback returns (i.e. after it has published downstream),
+    so a worker that dies mid-message leaves it to RabbitMQ to redeliver. If the
+    callback raises, the message is retried up to ``max_retries`` times with
+    exponential backoff and then dead-lettered (see ``common.queues``).
+    ``prefetch_count`` bounds how many unacked messages RabbitMQ hands to this
+    consumer, which is what provides backpressure when the workers slow down
+    and spreads the load across replicas.
+    """
+
+    def __init__(self, host, queue, callback, concurrency=1, prefetch_count=None, max_retries=MESSAGE_MAX_RETRIES):
+        self.host = host
+        self.queue = queue
+        self.callback = callback
+        self.concurrency = concurrency
+        self.prefetch_count = prefetch_count or RABBITMQ_PREFETCH_COUNT or concurrency
+        self.max_retries = max_retries
+        self._connection = None
+        self._channel = None
+        self._retried = registry.counter(f"{queue}_retries_total", f"Messages from {queue} scheduled for a retry")
+        self._dead_lettered = registry.counter(
+            f"{queue}_dead_lettered_total", f"Messages from {queue} sent to the dead-letter queue"
+        )
+
+    def _retry(self, method, properties, body, retries):
+        headers = dict(properties.headers or {})
+        headers[RETRIES_HEADER] = retries + 1
+        properties.headers = headers
+        # La espera la pone la cola del reintento (x-message-ttl); al caducar vuelve a la cola.
+        # El canal confirma las publicaciones: solo se confirma el original si RabbitMQ
+        # aceptó el reintento
+        try:
+            self._channel.basic_publish(
+                exchange='', routing_key=retry_queue(self.queue, retries), body=body,
+                properties=properties, mandatory=True
+            )
+        except (NackError, UnroutableError) as e:
+            logger.error(f"Could not schedule the retry of a message from '{self.queue}', requeuing it: {e!r}")
+            self._channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        self._channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _process(self, method, properties, body):
+        try:
+            self.callback(self._channel, method, properties, body)
+        except Exception as e:
+            retries = (properties.headers or {}).get(RETRIES_HEADER, 0)
+            if retries < self.max_retries:
+                logger.warning(f"Error processing message from '{self.queue}' (retry {retries + 1}/{self.max_retries}): {e}")
+                self._retried.inc()
+                ack = functools.partial(self._retry, method, properties, body, retries)
+            else:
+                logger.error(f"Error processing message from '{self.queue}', sending it to the dead-letter queue: {e}")
+                self._dead_lettered.inc()
+                ack = functools.partial(self._channel.basic_nack, delivery_tag=method.delivery_tag, requeue=False)
+        else:
+            ack = functools.partial(self._channel.basic_ack, delivery_tag=method.delivery_tag)
+        # Los canales de pika no son thread-safe: el ack se hace en el hilo de la conexión
+        self._connection.add_callback_threadsafe(ack)
+
+    def _on_message(self, ch, method, properties, body):
+        self._executor.submit(self._process, method, properties, body)
+
+    def run(self):
+        self._connection = get_rabbitmq_connection(self.host)
+        self._channel = self._connection.channel()
+        declare_queue(self._channel, self.queue)
+        declare_retry_queues(self._channel, self.queue, self.max_retries)
+        self._channel.confirm_delivery()
+        self._channel.basic_qos(prefetch_count=self.prefetch_count)
+        self._channel.basic_consume(queue=self.queue, on_message_callback=self._on_message, auto_ack=False)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=self.queue) as self._executor:
+            logger.info(f"Waiting for messages on '{self.queue}' (concurrency {self.concurrency})...")
+            readiness.set(f"consumer:{self.queue}")
+            try:
+                self._channel.start_consuming()
+            finally:
+                readiness.set(f"consumer:{self.queue}", False)
+        # Enviar los acks que los workers dejaron pendientes al terminar
+        self._connection.process_data_events(time_limit=0)
+        self._connection.close()
+
+    def stop(self):
+        """Stop consuming; safe to call from any thread."""
+        self._connection.add_callback_threadsafe(self._channel.stop_consuming)
@@ -0,0 +1,103 @@
+# common/datasources.py
+#
+# Cada petición lleva el identificador de la fuente de datos (datasource_id) en
+# las cabeceras AMQP; credenciales, esquemas, pools y cachés se guardan por ese
+# identificador. Las peticiones sin él usan la fuente por defecto, que es la única
+# que existía antes.
+
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_DATASOURCE_ID = os.getenv("DEFAULT_DATASOURCE_ID", "default")
+# Fuentes de datos que cada servicio mantiene en memoria (credenciales, esquemas, pools...)
+DATASOURCE_CACHE_SIZE = int(os.getenv("DATASOURCE_CACHE_SIZE", "128"))
+
+DATASOURCE_HEADER = "datasource_id"
+
+
+def get_datasource_id(properties):
+    """Datasource id carried by a message, or the default one."""
+    headers = getattr(properties, 'headers', None) or {}
+    return headers.get(DATASOURCE_HEADER) or DEFAULT_DATASOURCE_ID
+
+
+def find_credentials(collection, datasource_id):
+    """Credentials document of ``datasource_id`` (without ``_id``) or ``None``."""
+    credentials = collection.find_one({"datasource_id": datasource_id}, {'_id': False})
+    if credentials is None and datasource_id == DEFAULT_DATASOURCE_ID:
+        # Documento anterior a las fuentes de datos, aún sin migrar por credentials-service
+        credentials = collection.find_one({"datasource_id": {"$exists": False}}, {'_id': False})
+    return credentials
+
+
+class LRUCache:
+    """Thread-safe LRU map with at most ``max_entries`` items.
+
+    ``on_evict(key, value)`` is called (outside the lock) for every entry pushed
+    out or removed with ``pop``, e.g. to close a connection pool. Lookups are
+    O(1) however many keys exist, so a hot datasource is not slowed down by the
+    number of tenants.
+    """
+
+    def __init__(self, max_entries=DATASOURCE_CACHE_SIZE, on_evict=None):
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+        self._evict(evicted)
+
+    def get_or_create(self, key, factory):
+        """Value for ``key``, calling ``factory(key)`` outside the lock on a miss."""
+        value = self.get(key, self)
+        if value is not self:
+            return value
+        value = factory(key)
+        with self._lock:
+            # Otro hilo pudo crearlo mientras tanto: gana el primero
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        self.put(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            value = self._entries.pop(key, self)
+        if value is self:
+            return None
+        self._evict([(key, value)])
+        return value
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._entries.items())
+            self._entries.clear()
+        self._evict(evicted)
+
+    def values(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def _evict(self, evicted):
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
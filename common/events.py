@@ -0,0 +1,41 @@
+# common/events.py
+#
+# Eventos de difusión (exchanges fanout) para avisar a todos los servicios
+# interesados de cambios como un nuevo esquema o nuevas credenciales.
+
+import json
+import logging
+from common.transport import get_transport
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_EVENTS_EXCHANGE = 'schema_events'
+CREDENTIALS_EVENTS_EXCHANGE = 'credentials_events'
+# Órdenes sobre consultas en curso (p. ej. cancelar), enviadas por el gateway
+QUERY_CONTROL_EXCHANGE = 'query_control'
+# SQL rechazado por el servicio de validación (el servicio NLP lo saca de su caché)
+SQL_EVENTS_EXCHANGE = 'sql_events'
+
+# Cabecera de la petición: quiere una vista previa rápida antes del resultado
+# completo (la pone el gateway, la reenvía cada etapa, la lee el servicio de ejecución)
+PREVIEW_HEADER = "preview_requested"
+
+
+def publish_event(host, exchange, payload):
+    get_transport(host).publish_event(exchange, json.dumps(payload))
+
+
+def start_event_listener(host, exchange, handler):
+    """Call ``handler(payload)`` for every event published on ``exchange``.
+
+    With RabbitMQ it runs on a daemon thread with its own connection. Events
+    published while the listener is reconnecting are lost, so consumers must
+    not rely on them alone (e.g. caches keep a TTL as well).
+    """
+    def on_event(body):
+        try:
+            handler(json.loads(body))
+        except Exception as e:
+            logger.error(f"Error handling event from '{exchange}': {e}")
+
+    return get_transport(host).subscribe(exchange, on_event)
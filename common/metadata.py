@@ -0,0 +1,38 @@
+# common/metadata.py
+#
+# Petición RPC del esquema al servicio de metadatos, compartida por los servicios
+# que lo guardan en un SchemaCache (NLP y validación).
+
+import json
+import logging
+from common.datasources import DEFAULT_DATASOURCE_ID, DATASOURCE_HEADER
+from common.tracing import TRACE_SENT_HEADER, now_us
+from common.transport import Properties, get_transport
+
+logger = logging.getLogger(__name__)
+
+METADATA_REQUEST_QUEUE = 'metadata_request_queue'
+
+
+def request_metadata(host, datasource_id=DEFAULT_DATASOURCE_ID, timeout=10):
+    """Ask the metadata service for the schema of ``datasource_id``; returns
+    ``(schema, version)`` or ``(None, None)`` if there is no schema or no reply
+    arrives within ``timeout`` seconds."""
+    logger.info("Solicitud de metadatos de '%s' enviada, esperando respuesta...", datasource_id)
+    reply = get_transport(host).request(
+        METADATA_REQUEST_QUEUE,
+        json.dumps({}),
+        Properties(headers={DATASOURCE_HEADER: datasource_id, TRACE_SENT_HEADER: now_us()}),
+        timeout=timeout
+    )
+    if reply is None:
+        logger.error("No se recibió respuesta en el tiempo esperado")
+        return None, None
+    properties, body = reply
+    schema = json.loads(body)
+    if schema is None:
+        logger.error(f"El servicio de metadatos no tiene esquema de '{datasource_id}'")
+        return None, None
+    version = (properties.headers or {}).get("schema_version")
+    logger.info("Metadatos recibidos correctamente (versión %s)", version)
+    return schema, version
@@ -0,0 +1,163 @@
+# common/publisher.py
+
+import os
+import json
+import threading
+import logging
+import pika
+from common.utils import get_rabbitmq_connection
+from common.datasources import DATASOURCE_HEADER
+from common.events import PREVIEW_HEADER
+from common.queues import declare_queue
+from common.tracing import trace_headers
+from common.transport import Properties, get_transport
+
+logger = logging.getLogger(__name__)
+
+# Con confirms, publish solo vuelve cuando RabbitMQ tiene el mensaje (un nack
+# lanza una excepción y el consumidor reintenta el mensaje de entrada): es lo que
+# permite confirmar un mensaje solo tras haberlo publicado aguas abajo
+RABBITMQ_CONFIRM_DELIVERY = os.getenv("RABBITMQ_CONFIRM_DELIVERY", "true").lower() in ("1", "true", "yes")
+
+# Errores tras los cuales merece la pena reconectar y reintentar la publicación
+RECONNECT_ERRORS = (
+    pika.exceptions.AMQPConnectionError,
+    pika.exceptions.AMQPChannelError,
+)
+
+
+class Publisher:
+    """Long-lived RabbitMQ connection and channel used to publish messages.
+
+    Queues and exchanges are declared only once per channel, the connection is re-opened
+    transparently when the broker drops it, and with publisher confirms (the
+    default) ``publish`` only returns once the broker has the message; a nack
+    raises ``pika.exceptions.NackError``.
+    """
+
+    def __init__(self, host, confirm_delivery=True, max_retries=3, retry_delay=1):
+        self.host = host
+        self.confirm_delivery = confirm_delivery
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+        self._declared = set()
+
+    def _connect(self):
+        self._connection = get_rabbitmq_connection(self.host, max_retries=self.max_retries, retry_delay=self.retry_delay)
+        self._channel = self._connection.channel()
+        if self.confirm_delivery:
+            self._channel.confirm_delivery()
+        self._declared = set()
+        logger.info("Publisher connected to RabbitMQ at %s", self.host)
+
+    def _ensure_channel(self):
+        if self._connection is None or self._connection.is_closed or self._channel is None or self._channel.is_closed:
+            self._close()
+            self._connect()
+        else:
+            # Atender heartbeats pendientes para detectar antes una conexión caída
+            self._connection.process_data_events(time_limit=0)
+
+    def _close(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception as e:
+            logger.warning(f"Error closing publisher connection: {e}")
+        finally:
+            self._connection = None
+            self._channel = None
+
+    def _publish(self, exchange, routing_key, body, properties, declare):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    self._ensure_channel()
+                    if declare is not None and declare not in self._declared:
+                        kind, name = declare
+                        if kind == 'queue':
+                            declare_queue(self._channel, name)
+                        else:
+                            self._channel.exchange_declare(exchange=name, exchange_type=kind)
+                        self._declared.add(declare)
+                    self._channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+                    return
+                except RECONNECT_ERRORS as e:
+                    self._close()
+                    if attempt:
+                        raise
+                    logger.warning(f"Publishing to '{exchange or routing_key}' failed ({e!r}), reconnecting...")
+
+    def publish(self, queue, body, properties=None, declare=True):
+        # declare=False para colas que pertenecen a otro consumidor (p.ej. las
+        # colas de respuesta exclusivas de cada réplica del gateway)
+        self._publish('', queue, body, properties, ('queue', queue) if declare else None)
+
+    def publish_event(self, exchange, body, properties=None):
+        self._publish(exchange, '', body, properties, ('fanout', exchange))
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_publisher(host, confirm_delivery=None):
+    """Return the process-wide publisher for ``host``, creating it on first use."""
+    if confirm_delivery is None:
+        confirm_delivery = RABBITMQ_CONFIRM_DELIVERY
+    key = (host, confirm_delivery)
+    with _publishers_lock:
+        publisher = _publishers.get(key)
+        if publisher is None:
+            publisher = Publisher(host, confirm_delivery=confirm_delivery)
+            _publishers[key] = publisher
+        return publisher
+
+
+# Cabeceras de la petición que cada etapa reenvía a la siguiente
+PROPAGATED_HEADERS = (DATASOURCE_HEADER, PREVIEW_HEADER)
+
+
+def propagate_properties(properties):
+    """Properties for a downstream message that keep the request correlation.
+
+    The gateway stamps each query with ``correlation_id`` (the request id),
+    ``reply_to`` (its reply queue) and the ``PROPAGATED_HEADERS`` (e.g. the
+    datasource id); every stage forwards them untouched. The trace headers are
+    forwarded too, stamped with the current stage (see ``common.tracing``).
+    The result is transport-neutral (``common.transport.Properties``).
+    """
+    headers = getattr(properties, 'headers', None) or {}
+    propagated = {name: headers[name] for name in PROPAGATED_HEADERS if name in headers}
+    propagated.update(trace_headers(headers))
+    return Properties(
+        correlation_id=getattr(properties, 'correlation_id', None),
+        reply_to=getattr(properties, 'reply_to', None),
+        headers=propagated or None
+    )
+
+
+def publish_reply(host, properties, payload):
+    """Send a final payload back to the gateway replica that owns the request."""
+    reply_to = getattr(properties, 'reply_to', None)
+    get_transport(host).publish(
+        reply_to or 'response_queue',
+        json.dumps(payload),
+        properties=propagate_properties(properties),
+        declare=reply_to is None
+    )
+
+
+def publish_error(host, properties, message):
+    """Report a failed stage to the waiting client instead of leaving it hanging."""
+    try:
+        publish_reply(host, properties, {"type": "error", "data": message})
+    except Exception as e:
+        logger.error(f"Error reporting failure to the gateway: {e}")
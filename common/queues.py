@@ -0,0 +1,62 @@
+# common/queues.py
+#
+# Declaración única de las colas de trabajo. RabbitMQ rechaza (PRECONDITION_FAILED)
+# redeclarar una cola con argumentos distintos, así que todo el que declara una
+# cola de trabajo (consumidores, common.publisher, el gateway y los benchmarks)
+# pasa por aquí.
+#
+# Cada cola <cola> lleva asociadas:
+#   <cola>.retry.<n>  mensajes que fallaron n + 1 veces, esperando su reintento;
+#                     una cola por espera (x-message-ttl de la cola), así un
+#                     mensaje con una espera corta no queda detrás de uno con
+#                     una larga, y al caducar vuelven a <cola>
+#   <cola>.dlq        mensajes rechazados tras agotar los reintentos, para
+#                     revisarlos a mano (p. ej. desde la consola de RabbitMQ)
+# Las colas declaradas antes sin estos argumentos hay que borrarlas una vez (y la
+# antigua <cola>.retry, que ya no se usa).
+
+import os
+
+DEAD_LETTER_SUFFIX = ".dlq"
+RETRY_SUFFIX = ".retry"
+# Cabecera con los reintentos que lleva un mensaje
+RETRIES_HEADER = "x-retries"
+
+# Reintentos de un mensaje cuyo callback falla antes de mandarlo a la DLQ
+MESSAGE_MAX_RETRIES = int(os.getenv("MESSAGE_MAX_RETRIES", "3"))
+# Espera antes del primer reintento (segundos); se duplica en cada uno
+MESSAGE_RETRY_DELAY = float(os.getenv("MESSAGE_RETRY_DELAY", "1"))
+
+
+def queue_arguments(queue):
+    """Arguments every declaration of work queue ``queue`` must use."""
+    return {"x-dead-letter-exchange": "", "x-dead-letter-routing-key": queue + DEAD_LETTER_SUFFIX}
+
+
+def declare_queue(channel, queue):
+    """Declare work queue ``queue`` on a pika channel."""
+    channel.queue_declare(queue=queue, arguments=queue_arguments(queue))
+
+
+def retry_queue(queue, retries):
+    """Queue where a message of ``queue`` that already failed ``retries`` times waits."""
+    return f"{queue}{RETRY_SUFFIX}.{retries}"
+
+
+def declare_retry_queues(channel, queue, max_retries=MESSAGE_MAX_RETRIES):
+    """Declare the retry and dead-letter queues of ``queue`` (done by its consumer)."""
+    channel.queue_declare(queue=queue + DEAD_LETTER_SUFFIX)
+    for retries in range(max_retries):
+        channel.queue_declare(
+            queue=retry_queue(queue, retries),
+            arguments={
+                "x-message-ttl": int(retry_delay(retries) * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue,
+            }
+        )
+
+
+def retry_delay(retries):
+    """Seconds to wait before retrying a message that already failed ``retries`` times."""
+    return MESSAGE_RETRY_DELAY * 2 ** retries
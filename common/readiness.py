@@ -0,0 +1,84 @@
+# common/readiness.py
+#
+# Arranque guiado por la disponibilidad de las dependencias en lugar de esperas
+# fijas: ``wait_for`` reintenta una comprobación con esperas exponenciales con
+# jitter (para que las réplicas que arrancan a la vez no reintenten al unísono) y
+# ``readiness`` reúne lo que cada servicio necesita para atender peticiones, que
+# el servidor de métricas publica en /readyz (/healthz solo indica que el proceso
+# responde).
+#
+# Sin dependencias fuera de la biblioteca estándar: también lo usa el gateway.
+
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delays(initial=0.1, maximum=5.0, factor=2.0):
+    """Endless exponential delays capped at ``maximum``, each jittered to
+    between half and all of its nominal value."""
+    delay = initial
+    while True:
+        yield delay / 2 + random.uniform(0, delay / 2)
+        delay = min(delay * factor, maximum)
+
+
+def wait_for(name, check, timeout=120, initial=0.1, maximum=5.0):
+    """Call ``check()`` until it returns without raising and return its result.
+
+    Raises ``TimeoutError`` once ``name`` has been unavailable for ``timeout`` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    delays = backoff_delays(initial, maximum)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return check()
+        except Exception as e:
+            delay = next(delays)
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"{name} not available after {timeout} s: {e}") from e
+            logger.info(f"Waiting for {name} (attempt {attempt}, retrying in {delay:.2f} s): {e}")
+            time.sleep(delay)
+
+
+class Readiness:
+    """Named conditions a service needs before it can serve requests.
+
+    A condition is either a flag set with ``set`` or a callable registered with
+    ``add_check`` and evaluated on every probe (an exception counts as not ready).
+    """
+
+    def __init__(self):
+        self._conditions = {}
+        self._lock = threading.Lock()
+
+    def set(self, name, ready=True):
+        with self._lock:
+            self._conditions[name] = bool(ready)
+
+    def add_check(self, name, check):
+        with self._lock:
+            self._conditions[name] = check
+
+    def status(self):
+        """``(ready, {condition: bool})``; a service with no conditions is ready."""
+        with self._lock:
+            conditions = dict(self._conditions)
+        results = {}
+        for name, condition in conditions.items():
+            if callable(condition):
+                try:
+                    condition = bool(condition())
+                except Exception:
+                    condition = False
+            results[name] = condition
+        return all(results.values()), results
+
+
+# Estado por proceso compartido por todos los módulos de un servicio
+readiness = Readiness()
@@ -0,0 +1,69 @@
+# common/schema_cache.py
+
+import time
+import threading
+import logging
+from common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaCache:
+    """In-process copy of the database schema served by the metadata service.
+
+    ``loader`` performs the actual fetch and returns ``(schema, version)``. The
+    cached schema is reused until ``ttl`` seconds pass or ``invalidate`` is
+    called (normally from a "schema changed" event). If a refresh fails the
+    previous schema keeps being served rather than failing the query.
+    """
+
+    def __init__(self, loader, ttl=300, name="schema_cache"):
+        self.loader = loader
+        self.ttl = ttl
+        self.schema = None
+        self.version = None
+        self._expires = 0
+        self._lock = threading.Lock()
+        self.hits = registry.counter(f"{name}_hits_total", "Schema lookups served from memory")
+        self.misses = registry.counter(f"{name}_misses_total", "Schema lookups that required a refresh")
+        self.refresh_errors = registry.counter(f"{name}_refresh_errors_total", "Failed schema refreshes")
+        self.refresh_seconds = registry.histogram(f"{name}_refresh_seconds", "Latency of schema refreshes")
+
+    def get(self):
+        with self._lock:
+            if self.schema is not None and time.monotonic() < self._expires:
+                self.hits.inc()
+                return self.schema
+
+            self.misses.inc()
+            start = time.perf_counter()
+            try:
+                schema, version = self.loader()
+            except Exception as e:
+                logger.error(f"Error refreshing schema: {e}")
+                schema, version = None, None
+            self.refresh_seconds.observe(time.perf_counter() - start)
+
+            if schema is None:
+                self.refresh_errors.inc()
+                if self.schema is not None:
+                    logger.warning("Serving stale schema after a failed refresh")
+                return self.schema
+
+            self.schema = schema
+            self.version = version
+            self._expires = time.monotonic() + self.ttl
+            return self.schema
+
+    def prefetch(self):
+        """Load the schema in the background, so the first query does not wait for it."""
+        thread = threading.Thread(target=self.get, name="schema-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def invalidate(self, version=None):
+        with self._lock:
+            if version is not None and version == self.version:
+                return
+            self._expires = 0
+            logger.info(f"Schema cache invalidated (version {self.version} -> {version})")
@@ -0,0 +1,240 @@
+# common/supervisor.py
+#
+# Escalado automático de una etapa en un mismo host: ejecuta el ``callback`` de
+# un servicio en un grupo de procesos worker (cada uno con su Consumer) y ajusta
+# cuántos hay según la profundidad de la cola, entre un mínimo y un máximo.
+#
+#   - Crece en cuanto hay más de ``--backlog-per-worker`` mensajes esperando por
+#     worker (los ya entregados a los workers por el prefetch no cuentan).
+#   - Decrece de uno en uno cuando la cola lleva ``--cooldown`` segundos vacía y
+#     la utilización media de los workers está por debajo de ``--idle-utilization``.
+#     El worker que sobra recibe SIGTERM, termina los mensajes que tiene entre
+#     manos y los que no llegó a empezar vuelven a la cola.
+#   - Un worker que muere se sustituye.
+#
+# La utilización de un worker es la fracción del tiempo que sus hilos pasan
+# dentro del callback. Se expone con la profundidad y el número de workers en
+# METRICS_PORT (las métricas propias de la etapa quedan en cada worker).
+#
+# Uso, desde el directorio del servicio (donde está su módulo):
+#     python -m common.supervisor nlp_service nlp_queue --min-workers 1 --max-workers 4
+#
+# Antes de consumir, cada worker llama a ``setup()`` del módulo si existe (p. ej.
+# para escuchar los eventos de esquema o de cancelación).
+
+import os
+import sys
+import time
+import math
+import signal
+import logging
+import argparse
+import importlib
+import functools
+import multiprocessing
+
+from common.metrics import registry, start_metrics_server
+from common.queues import declare_queue
+
+logger = logging.getLogger(__name__)
+
+
+def _instrumented(callback, busy):
+    @functools.wraps(callback)
+    def wrapper(ch, method, properties, body):
+        start = time.perf_counter()
+        try:
+            return callback(ch, method, properties, body)
+        finally:
+            with busy.get_lock():
+                busy.value += time.perf_counter() - start
+    return wrapper
+
+
+def _run_worker(module_name, host, queue, concurrency, busy):
+    from common.consumer import Consumer
+
+    logging.basicConfig(level=logging.INFO)
+    module = importlib.import_module(module_name)
+    if hasattr(module, 'setup'):
+        module.setup()
+    consumer = Consumer(host, queue, _instrumented(module.callback, busy), concurrency=concurrency)
+
+    def on_sigterm(signum, frame):
+        if consumer._connection is None:
+            # Aún conectando: no hay mensajes entre manos
+            sys.exit(0)
+        consumer.stop()
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    consumer.run()
+
+
+class Worker:
+    def __init__(self, process, busy):
+        self.process = process
+        self.busy = busy
+        self.last_busy = 0.0
+        self.last_seen = time.monotonic()
+        self.utilization = 0.0
+
+    def sample(self, concurrency):
+        now = time.monotonic()
+        busy = self.busy.value
+        elapsed = now - self.last_seen
+        if elapsed > 0:
+            self.utilization = min((busy - self.last_busy) / (elapsed * concurrency), 1.0)
+        self.last_busy, self.last_seen = busy, now
+        return self.utilization
+
+
+class Supervisor:
+    """Keep between ``min_workers`` and ``max_workers`` processes consuming ``queue``."""
+
+    def __init__(self, module_name, host, queue, min_workers=1, max_workers=4, concurrency=1,
+                 backlog_per_worker=10, idle_utilization=0.5, cooldown=30, interval=2):
+        self.module_name = module_name
+        self.host = host
+        self.queue = queue
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.concurrency = concurrency
+        self.backlog_per_worker = backlog_per_worker
+        self.idle_utilization = idle_utilization
+        self.cooldown = cooldown
+        self.interval = interval
+        # spawn: los workers no heredan la conexión a RabbitMQ del supervisor
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._running = True
+        self._idle_since = None
+        self._depth = registry.gauge(f"{queue}_depth", f"Messages waiting in {queue}")
+        self._size = registry.gauge(f"{queue}_workers", f"Worker processes consuming {queue}")
+        self._utilization = registry.gauge(
+            f"{queue}_worker_utilization", f"Mean fraction of time the {queue} workers spend processing"
+        )
+        self._slot_utilization = [
+            registry.gauge(f"{queue}_worker_{i}_utilization", f"Fraction of time worker {i} of {queue} spends processing")
+            for i in range(max_workers)
+        ]
+
+    def _spawn(self):
+        busy = self._context.Value('d', 0.0)
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.module_name, self.host, self.queue, self.concurrency, busy),
+            name=f"{self.queue}-worker",
+            daemon=False
+        )
+        process.start()
+        return Worker(process, busy)
+
+    def _grow(self, count):
+        for _ in range(count):
+            self._workers.append(self._spawn())
+        logger.info(f"Scaled '{self.queue}' up to {len(self._workers)} workers")
+
+    def _shrink(self):
+        worker = self._workers.pop()
+        worker.process.terminate()
+        logger.info(f"Scaled '{self.queue}' down to {len(self._workers)} workers")
+        return worker
+
+    def _replace_dead(self):
+        for i, worker in enumerate(self._workers):
+            if not worker.process.is_alive():
+                logger.warning(f"Worker {i} of '{self.queue}' exited with code {worker.process.exitcode}, restarting it")
+                self._workers[i] = self._spawn()
+
+    def _report(self):
+        utilizations = [worker.sample(self.concurrency) for worker in self._workers]
+        for gauge, utilization in zip(self._slot_utilization, utilizations + [0.0] * self.max_workers):
+            gauge.set(round(utilization, 3))
+        mean = sum(utilizations) / len(utilizations) if utilizations else 0.0
+        self._utilization.set(round(mean, 3))
+        self._size.set(len(self._workers))
+        return mean
+
+    def desired_workers(self, depth, utilization, now):
+        """Number of workers for the observed ``depth`` and mean ``utilization``."""
+        current = len(self._workers)
+        if depth > self.backlog_per_worker * current:
+            self._idle_since = None
+            return min(self.max_workers, max(current + 1, math.ceil(depth / self.backlog_per_worker)))
+        if depth == 0 and utilization < self.idle_utilization:
+            if self._idle_since is None:
+                self._idle_since = now
+            if now - self._idle_since >= self.cooldown:
+                self._idle_since = now
+                return max(self.min_workers, current - 1)
+        else:
+            self._idle_since = None
+        return max(self.min_workers, min(self.max_workers, current))
+
+    def stop(self):
+        self._running = False
+
+    def run(self):
+        from common.utils import get_rabbitmq_connection
+
+        connection = get_rabbitmq_connection(self.host)
+        channel = connection.channel()
+        declare_queue(channel, self.queue)
+        self._grow(self.min_workers)
+        stopping = []
+        try:
+            while self._running:
+                connection.sleep(self.interval)
+                self._replace_dead()
+                depth = channel.queue_declare(queue=self.queue, passive=True).method.message_count
+                self._depth.set(depth)
+                utilization = self._report()
+                desired = self.desired_workers(depth, utilization, time.monotonic())
+                if desired > len(self._workers):
+                    self._grow(desired - len(self._workers))
+                elif desired < len(self._workers):
+                    stopping.append(self._shrink())
+                stopping = [worker for worker in stopping if worker.process.is_alive()]
+        finally:
+            for worker in self._workers:
+                worker.process.terminate()
+            for worker in self._workers + stopping:
+                worker.process.join()
+            connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stage callback in a pool of processes scaled by queue depth")
+    parser.add_argument("module", help="módulo del servicio con callback (y opcionalmente setup), p. ej. nlp_service")
+    parser.add_argument("queue", help="cola que consume la etapa, p. ej. nlp_queue")
+    parser.add_argument("--host", default=os.getenv("RABBITMQ_HOST", "localhost"))
+    parser.add_argument("--min-workers", type=int, default=int(os.getenv("SUPERVISOR_MIN_WORKERS", "1")))
+    parser.add_argument("--max-workers", type=int, default=int(os.getenv("SUPERVISOR_MAX_WORKERS", "4")))
+    parser.add_argument("--concurrency", type=int, default=1, help="hilos por worker")
+    parser.add_argument("--backlog-per-worker", type=int, default=10)
+    parser.add_argument("--idle-utilization", type=float, default=0.5)
+    parser.add_argument("--cooldown", type=float, default=30)
+    parser.add_argument("--interval", type=float, default=2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # El módulo del servicio se busca en el directorio actual, como al ejecutarlo directamente
+    sys.path.insert(0, os.getcwd())
+    if os.getenv("METRICS_PORT"):
+        start_metrics_server(os.getenv("METRICS_PORT"))
+
+    supervisor = Supervisor(
+        args.module, args.host, args.queue,
+        min_workers=args.min_workers, max_workers=args.max_workers, concurrency=args.concurrency,
+        backlog_per_worker=args.backlog_per_worker, idle_utilization=args.idle_utilization,
+        cooldown=args.cooldown, interval=args.interval
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.stop())
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# common/tracing.py
+#
+# Trazas de la tubería sin colector externo: cada mensaje lleva en sus cabeceras
+# AMQP el identificador de traza y, por cada etapa que ha atravesado, cuándo la
+# recibió y cuándo publicó el siguiente mensaje (microsegundos epoch enteros: pika
+# no codifica floats en las cabeceras y aio-pika los reduce a precisión simple). Cada servicio
+# registra su espera en cola y su tiempo de proceso en histogramas de
+# common.metrics; el gateway reconstruye la vista extremo a extremo.
+#
+# La espera en cola se calcula con relojes de máquinas distintas: es fiable con
+# los contenedores en el mismo host o sincronizados por NTP, y nunca es negativa.
+
+import time
+import functools
+import threading
+from common.metrics import registry
+
+TRACE_ID_HEADER = "trace_id"
+# {etapa: [recibido, publicado]}
+TRACE_HEADER = "trace"
+# Momento en que se publicó el mensaje que se está leyendo
+TRACE_SENT_HEADER = "trace_sent_at"
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_context = threading.local()
+
+
+def now_us():
+    return int(time.time() * 1_000_000)
+
+
+class Stage:
+    """Queue-wait and processing histograms of one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.queue_wait = registry.histogram(
+            f"{name}_queue_wait_seconds", f"Time messages waited in the queue before {name} took them",
+            buckets=STAGE_BUCKETS
+        )
+        self.processing = registry.histogram(
+            f"{name}_processing_seconds", f"Time {name} spent processing a message",
+            buckets=STAGE_BUCKETS
+        )
+
+
+def traced(stage_name):
+    """Decorate a pika callback ``(ch, method, properties, body)`` of ``stage_name``.
+
+    While the callback runs, messages built with
+    ``common.publisher.propagate_properties`` carry the trace forward stamped
+    with this stage.
+    """
+    stage = Stage(stage_name)
+
+    def decorator(callback):
+        @functools.wraps(callback)
+        def wrapper(ch, method, properties, body):
+            received = now_us()
+            headers = getattr(properties, 'headers', None) or {}
+            sent_at = headers.get(TRACE_SENT_HEADER)
+            if sent_at is not None:
+                stage.queue_wait.observe(max(received - sent_at, 0) / 1e6)
+            _context.current = (stage_name, received)
+            start = time.perf_counter()
+            try:
+                return callback(ch, method, properties, body)
+            finally:
+                stage.processing.observe(time.perf_counter() - start)
+                _context.current = None
+        return wrapper
+    return decorator
+
+
+def start_trace(trace_id, stage_name="gateway"):
+    """Headers that open a trace (used by whoever injects the request)."""
+    now = now_us()
+    return {TRACE_ID_HEADER: trace_id, TRACE_HEADER: {stage_name: [now, now]}, TRACE_SENT_HEADER: now}
+
+
+def trace_headers(headers):
+    """Trace headers for a message published now by the current stage.
+
+    ``headers`` are those of the message being processed. Returns an empty
+    dict when it carried no trace.
+    """
+    trace_id = headers.get(TRACE_ID_HEADER)
+    if trace_id is None:
+        return {}
+    now = now_us()
+    trace = dict(headers.get(TRACE_HEADER) or {})
+    current = getattr(_context, 'current', None)
+    if current is not None:
+        stage_name, received = current
+        trace[stage_name] = [received, now]
+    return {TRACE_ID_HEADER: trace_id, TRACE_HEADER: trace, TRACE_SENT_HEADER: now}
+
+
+def stage_breakdown(trace, received=None):
+    """``[(stage, queue_wait, processing)]`` in seconds, in pipeline order.
+
+    The queue wait of a stage is the gap since the previous stage published;
+    ``received`` (``now_us()`` when the trace came back) closes the last one as
+    ``reply``.
+    """
+    stages = sorted(((name, times[0], times[1]) for name, times in trace.items()), key=lambda s: s[1])
+    breakdown = []
+    previous_sent = None
+    for name, stage_received, stage_sent in stages:
+        wait = max(stage_received - previous_sent, 0) / 1e6 if previous_sent is not None else 0.0
+        breakdown.append((name, wait, max(stage_sent - stage_received, 0) / 1e6))
+        previous_sent = stage_sent
+    if received is not None and previous_sent is not None:
+        breakdown.append(("reply", max(received - previous_sent, 0) / 1e6, 0.0))
+    return breakdown
@@ -0,0 +1,288 @@
+# common/transport.py
+#
+# Transporte de mensajes entre etapas. Los servicios publican, consumen, hacen
+# peticiones RPC y escuchan eventos con get_transport(host) sin saber qué hay
+# debajo: RabbitMQ (AMQPTransport, el de siempre) o colas en memoria dentro de un
+# único proceso (InMemoryTransport, el modo embebido de benchmarks.embedded, sin
+# broker). TRANSPORT=memory elige el segundo para todo el proceso.
+#
+# Sin dependencias fuera de la biblioteca estándar al importarse (pika se importa
+# al usar AMQPTransport): el gateway también lo usa.
+
+import os
+import time
+import uuid
+import logging
+import itertools
+import threading
+from queue import Queue, Empty
+from common.metrics import registry
+from common.readiness import readiness
+from common.queues import MESSAGE_MAX_RETRIES, RETRIES_HEADER, retry_delay
+
+logger = logging.getLogger(__name__)
+
+# "amqp" (RabbitMQ) o "memory" (colas del propio proceso)
+TRANSPORT = os.getenv("TRANSPORT", "amqp")
+
+
+class Properties:
+    """Transport-neutral message properties: the subset of AMQP's that the
+    stages read and write (pika's ``BasicProperties`` has the same attributes)."""
+
+    def __init__(self, correlation_id=None, reply_to=None, headers=None, content_type=None, expiration=None):
+        self.correlation_id = correlation_id
+        self.reply_to = reply_to
+        self.headers = headers
+        self.content_type = content_type
+        self.expiration = expiration
+
+    def copy(self):
+        return Properties(
+            correlation_id=self.correlation_id,
+            reply_to=self.reply_to,
+            headers=dict(self.headers) if self.headers is not None else None,
+            content_type=self.content_type,
+            expiration=self.expiration
+        )
+
+
+class Delivery:
+    """Stand-in for pika's ``method`` frame in in-memory deliveries."""
+
+    def __init__(self, routing_key, delivery_tag, redelivered=False):
+        self.routing_key = routing_key
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+
+
+class AMQPTransport:
+    """RabbitMQ through the process-wide ``Publisher`` and the ``Consumer``."""
+
+    def __init__(self, host):
+        self.host = host
+
+    def _properties(self, properties):
+        import pika
+        if properties is None or isinstance(properties, pika.BasicProperties):
+            return properties
+        return pika.BasicProperties(
+            correlation_id=properties.correlation_id,
+            reply_to=properties.reply_to,
+            headers=properties.headers,
+            content_type=properties.content_type,
+            expiration=properties.expiration
+        )
+
+    def publish(self, queue, body, properties=None, declare=True):
+        from common.publisher import get_publisher
+        get_publisher(self.host).publish(queue, body, properties=self._properties(properties), declare=declare)
+
+    def publish_event(self, exchange, body):
+        from common.publisher import get_publisher
+        get_publisher(self.host).publish_event(exchange, body)
+
+    def consume(self, queue, callback, concurrency=1):
+        from common.consumer import Consumer
+        Consumer(self.host, queue, callback, concurrency=concurrency).run()
+
+    def request(self, queue, body, properties=None, timeout=10):
+        """Publish ``body`` to ``queue`` and wait for the reply; returns
+        ``(properties, body)`` or ``None`` if nothing arrives within ``timeout`` seconds."""
+        from common.utils import get_rabbitmq_connection
+        connection = get_rabbitmq_connection(self.host)
+        try:
+            channel = connection.channel()
+            callback_queue = channel.queue_declare(queue='', exclusive=True).method.queue
+            properties = properties.copy() if properties is not None else Properties()
+            properties.reply_to = callback_queue
+            properties.correlation_id = str(uuid.uuid4())
+            channel.basic_publish(exchange='', routing_key=queue, properties=self._properties(properties), body=body)
+            for method_frame, reply_properties, reply_body in channel.consume(callback_queue, inactivity_timeout=timeout):
+                if method_frame is None:
+                    break
+                channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+                if reply_properties.correlation_id == properties.correlation_id:
+                    return reply_properties, reply_body
+            return None
+        finally:
+            connection.close()
+
+    def subscribe(self, exchange, handler, retry_delay=5):
+        """Call ``handler(body)`` for every event published on the fanout ``exchange``.
+
+        Runs on a daemon thread with its own connection. Events published while
+        the listener is reconnecting are lost.
+        """
+        thread = threading.Thread(
+            target=self._listen,
+            args=(exchange, handler, retry_delay),
+            name=f"events-{exchange}",
+            daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _listen(self, exchange, handler, retry_delay):
+        import pika
+        from common.utils import get_rabbitmq_connection
+        while True:
+            try:
+                connection = get_rabbitmq_connection(self.host)
+                channel = connection.channel()
+                channel.exchange_declare(exchange=exchange, exchange_type='fanout')
+                result = channel.queue_declare(queue='', exclusive=True)
+                channel.queue_bind(exchange=exchange, queue=result.method.queue)
+                channel.basic_consume(
+                    queue=result.method.queue,
+                    on_message_callback=lambda ch, method, properties, body: handler(body),
+                    auto_ack=True
+                )
+                logger.info(f"Listening for events on exchange '{exchange}'")
+                channel.start_consuming()
+            except pika.exceptions.AMQPError as e:
+                logger.warning(f"Event listener for '{exchange}' disconnected ({e!r}), reconnecting in {retry_delay} seconds...")
+                time.sleep(retry_delay)
+
+
+class InMemoryTransport:
+    """Queues and fanout exchanges inside a single process.
+
+    Keeps the delivery rules the stages rely on with RabbitMQ: every queue is
+    consumed by up to ``concurrency`` worker threads, a callback that raises is
+    retried with the same backoff (``common.queues.retry_delay``) and, after
+    ``max_retries``, the message is kept in ``dead_letters``. Events reach every
+    subscriber synchronously. Messages are lost when the process exits.
+    """
+
+    def __init__(self, max_retries=MESSAGE_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.dead_letters = {}
+        self._queues = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._delivery_tags = itertools.count(1)
+
+    def _queue(self, name):
+        with self._lock:
+            q = self._queues.get(name)
+            if q is None:
+                q = self._queues[name] = Queue()
+            return q
+
+    def depth(self, queue_name):
+        return self._queue(queue_name).qsize()
+
+    def publish(self, queue, body, properties=None, declare=True):
+        # Copia: quien publica puede seguir modificando sus propiedades
+        properties = properties.copy() if isinstance(properties, Properties) else Properties(
+            correlation_id=getattr(properties, 'correlation_id', None),
+            reply_to=getattr(properties, 'reply_to', None),
+            headers=dict(getattr(properties, 'headers', None) or {}) or None,
+            content_type=getattr(properties, 'content_type', None)
+        )
+        self._queue(queue).put((properties, body))
+
+    def publish_event(self, exchange, body):
+        with self._lock:
+            handlers = list(self._subscribers.get(exchange, ()))
+        for handler in handlers:
+            handler(body)
+
+    def subscribe(self, exchange, handler):
+        with self._lock:
+            self._subscribers.setdefault(exchange, []).append(handler)
+
+    def consume(self, queue, callback, concurrency=1):
+        """Run ``callback(None, delivery, properties, body)`` for the messages of
+        ``queue`` on ``concurrency`` threads until ``stop`` is called."""
+        workers = [
+            threading.Thread(target=self._work, args=(queue, callback), name=f"{queue}-{i}", daemon=True)
+            for i in range(concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        logger.info(f"Waiting for messages on '{queue}' (in memory, concurrency {concurrency})...")
+        readiness.set(f"consumer:{queue}")
+        try:
+            self._stopped.wait()
+        finally:
+            readiness.set(f"consumer:{queue}", False)
+            for worker in workers:
+                worker.join()
+
+    def _work(self, queue_name, callback):
+        q = self._queue(queue_name)
+        while not self._stopped.is_set():
+            try:
+                properties, body = q.get(timeout=0.1)
+            except Empty:
+                continue
+            retries = (properties.headers or {}).get(RETRIES_HEADER, 0)
+            delivery = Delivery(queue_name, next(self._delivery_tags), redelivered=retries > 0)
+            try:
+                callback(None, delivery, properties, body)
+            except Exception as e:
+                self._retry(queue_name, properties, body, retries, e)
+
+    def _retry(self, queue_name, properties, body, retries, error):
+        if retries >= self.max_retries:
+            logger.error(f"Error processing message from '{queue_name}', sending it to the dead-letter queue: {error}")
+            registry.counter(
+                f"{queue_name}_dead_lettered_total", f"Messages from {queue_name} sent to the dead-letter queue"
+            ).inc()
+            with self._lock:
+                self.dead_letters.setdefault(queue_name, []).append((properties, body))
+            return
+        logger.warning(f"Error processing message from '{queue_name}' (retry {retries + 1}/{self.max_retries}): {error}")
+        registry.counter(f"{queue_name}_retries_total", f"Messages from {queue_name} scheduled for a retry").inc()
+        properties.headers = {**(properties.headers or {}), RETRIES_HEADER: retries + 1}
+        timer = threading.Timer(retry_delay(retries), self._queue(queue_name).put, args=((properties, body),))
+        timer.daemon = True
+        timer.start()
+
+    def request(self, queue, body, properties=None, timeout=10):
+        properties = properties.copy() if properties is not None else Properties()
+        properties.reply_to = f"rpc.{uuid.uuid4().hex}"
+        properties.correlation_id = properties.reply_to
+        reply_queue = self._queue(properties.reply_to)
+        try:
+            self.publish(queue, body, properties)
+            return reply_queue.get(timeout=timeout)
+        except Empty:
+            return None
+        finally:
+            with self._lock:
+                self._queues.pop(properties.reply_to, None)
+
+    def stop(self):
+        """Stop every ``consume`` loop of this transport."""
+        self._stopped.set()
+
+
+_transports = {}
+_installed = None
+_transports_lock = threading.Lock()
+
+
+def get_transport(host=None):
+    """Return the process-wide transport: the one installed with
+    ``set_transport``, else one per RabbitMQ host (or a single in-memory one
+    with ``TRANSPORT=memory``)."""
+    with _transports_lock:
+        if _installed is not None:
+            return _installed
+        key = None if TRANSPORT == "memory" else host
+        transport = _transports.get(key)
+        if transport is None:
+            transport = InMemoryTransport() if TRANSPORT == "memory" else AMQPTransport(host)
+            _transports[key] = transport
+        return transport
+
+
+def set_transport(transport):
+    """Use ``transport`` for every host from now on (embedded mode)."""
+    global _installed
+    with _transports_lock:
+        _installed = transport
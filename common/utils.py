@@ -1,17 +1,23 @@
 # common/utils.py
 
+import os
 import time
 import pika
+from common.readiness import backoff_delays
 
-def get_rabbitmq_connection(host, max_retries=10, retry_delay=10):
-    connection = None
+# Reintentos de conexión a RabbitMQ: esperas exponenciales con jitter desde
+# RABBITMQ_RETRY_DELAY hasta RABBITMQ_MAX_RETRY_DELAY segundos
+RABBITMQ_MAX_RETRIES = int(os.getenv("RABBITMQ_MAX_RETRIES", "30"))
+RABBITMQ_RETRY_DELAY = float(os.getenv("RABBITMQ_RETRY_DELAY", "0.1"))
+RABBITMQ_MAX_RETRY_DELAY = float(os.getenv("RABBITMQ_MAX_RETRY_DELAY", "5"))
+
+def get_rabbitmq_connection(host, max_retries=RABBITMQ_MAX_RETRIES, retry_delay=RABBITMQ_RETRY_DELAY):
+    delays = backoff_delays(retry_delay, max(retry_delay, RABBITMQ_MAX_RETRY_DELAY))
     for attempt in range(max_retries):
         try:
-            connection = pika.BlockingConnection(pika.ConnectionParameters(host))
-            break
+            return pika.BlockingConnection(pika.ConnectionParameters(host))
         except pika.exceptions.AMQPConnectionError as e:
-            print(f"Unable to connect to RabbitMQ. Attempt {attempt + 1}/{max_retries}. Retrying in {retry_delay} seconds...")
-            time.sleep(retry_delay)
-    if connection is None:
-        raise pika.exceptions.AMQPConnectionError(f"Failed to connect to RabbitMQ after {max_retries} attempts.")
-    return connection
+            delay = next(delays)
+            print(f"Unable to connect to RabbitMQ. Attempt {attempt + 1}/{max_retries}. Retrying in {delay:.2f} seconds...")
+            time.sleep(delay)
+    raise pika.exceptions.AMQPConnectionError(f"Failed to connect to RabbitMQ after {max_retries} attempts.")
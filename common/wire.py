@@ -0,0 +1,123 @@
+# common/wire.py
+#
+# Codificación de los lotes de resultados entre execution-service y
+# formatting-service. El formato viaja en la propiedad content_type del mensaje:
+# JSON por filas (el formato histórico, siempre disponible) o Arrow IPC por
+# columnas, tipado y que formatting puede cargar sin copiar.
+
+import json
+import logging
+from decimal import Decimal
+from datetime import date, datetime, time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+JSON_CONTENT_TYPE = "application/json"
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+# Filas con las que se decide el tipo de cada columna de un lote Arrow
+ARROW_TYPE_SAMPLE_ROWS = 1000
+
+WIRE_FORMATS = {
+    "json": JSON_CONTENT_TYPE,
+    "arrow": ARROW_CONTENT_TYPE,
+}
+
+
+def json_serial(obj):
+    """JSON serializer for objects not serializable by default json code"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (date, datetime, time)):
+        return obj.isoformat()
+    raise TypeError("Type not serializable")
+
+
+def encode_json(columns, rows, meta):
+    return json.dumps({"results": rows, "columns": columns, **meta}, default=json_serial).encode()
+
+
+def row_type(rows, sample_size=ARROW_TYPE_SAMPLE_ROWS):
+    """Struct type of ``rows`` inferred from the first ``sample_size`` of them."""
+    fields = []
+    for i, values in enumerate(zip(*rows[:sample_size])):
+        value_type = pa.array(values).type
+        if pa.types.is_decimal128(value_type):
+            # La precisión de la muestra puede quedarse corta: la máxima con su misma escala
+            value_type = pa.decimal128(38, value_type.scale)
+        fields.append(pa.field(f"f{i}", value_type))
+    return pa.struct(fields)
+
+
+def encode_arrow(columns, rows):
+    if not rows:
+        arrays = [pa.array([]) for _ in columns]
+    else:
+        # Con el tipo ya decidido pyarrow convierte las tuplas del driver sin
+        # trasponerlas ni inferir cada valor (lo más caro con DECIMAL)
+        try:
+            arrays = pa.array(rows, type=row_type(rows)).flatten()
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # La muestra no representaba a todas las filas (p. ej. NULL al principio)
+            arrays = [pa.array(values) for values in zip(*rows)]
+    table = pa.Table.from_arrays(arrays, names=list(columns))
+    sink = pa.BufferOutputStream()
+    # Compresión por buffer: barata de descomprimir y reduce mucho los bytes en RabbitMQ
+    options = pa.ipc.IpcWriteOptions(compression="zstd" if pa.Codec.is_available("zstd") else None)
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_result(columns, rows, meta, wire_format="json"):
+    """Encode one result chunk; returns ``(body, content_type)``.
+
+    Falls back to JSON when pyarrow is not installed or cannot type a column
+    (e.g. mixed Python types coming from the driver).
+    """
+    if WIRE_FORMATS.get(wire_format) == ARROW_CONTENT_TYPE and pa is not None:
+        try:
+            return encode_arrow(columns, rows), ARROW_CONTENT_TYPE
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            logger.warning(f"Arrow encoding failed, falling back to JSON: {e}")
+    return encode_json(columns, rows, meta), JSON_CONTENT_TYPE
+
+
+def decode_result(body, content_type=None):
+    """Decode a chunk; returns ``(columns, data)`` where ``data`` is a list of rows
+    (JSON) or a ``pyarrow.Table`` (Arrow)."""
+    if content_type == ARROW_CONTENT_TYPE:
+        if pa is None:
+            raise ValueError("Received an Arrow payload but pyarrow is not installed")
+        table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+        return table.column_names, table
+    data = json.loads(body)
+    return data.get("columns"), data.get("results")
+
+
+def arrow_to_pandas(table):
+    """``pyarrow.Table`` -> DataFrame with the same value types the JSON path produces
+    (decimals as floats, dates and times as ISO strings)."""
+    columns = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_decimal(field.type):
+            column = pc.cast(column, pa.float64())
+        elif pa.types.is_timestamp(field.type):
+            # Con zona horaria (timestamptz), con su desplazamiento como isoformat()
+            column = pc.strftime(column, format="%Y-%m-%dT%H:%M:%S%z" if field.type.tz else "%Y-%m-%dT%H:%M:%S")
+        elif pa.types.is_temporal(field.type):
+            column = pc.cast(column, pa.string())
+        if pa.types.is_timestamp(field.type) or pa.types.is_time(field.type):
+            # Igual que isoformat(): sin fracción de segundo si es cero
+            column = pc.replace_substring_regex(column, pattern=r"\.0+([+-]\d{4})?$", replacement=r"\1")
+        if pa.types.is_timestamp(field.type) and field.type.tz:
+            # %z da "+0000"; isoformat(), "+00:00"
+            column = pc.replace_substring_regex(column, pattern=r"([+-]\d{2})(\d{2})$", replacement=r"\1:\2")
+        columns.append(column)
+    return pa.Table.from_arrays(columns, names=table.column_names).to_pandas()
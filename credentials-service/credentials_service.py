@@ -1,10 +1,16 @@
 import os
 import json
 import pika
-import time
 import logging
 from pymongo import MongoClient
 from common.utils import get_rabbitmq_connection
+from common.queues import declare_queue
+from common.publisher import get_publisher
+from common.events import publish_event, CREDENTIALS_EVENTS_EXCHANGE
+from common.datasources import DEFAULT_DATASOURCE_ID
+from common.metrics import start_metrics_server
+from common.readiness import readiness, wait_for
+from common.tracing import traced
 
 # Configurar el registro
 logging.basicConfig(level=logging.INFO)
@@ -12,12 +18,18 @@ logger = logging.getLogger(__name__)
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 MONGO_URI = os.getenv("MONGO_URI")
+METRICS_PORT = os.getenv("METRICS_PORT")
 
 # Conexión a MongoDB
 mongo_client = MongoClient(MONGO_URI)
 db = mongo_client['credentials_db']
 collection = db['credentials']
 
+def ensure_indexes():
+    # Documento anterior a las fuentes de datos: pasa a ser la fuente por defecto
+    collection.update_many({"datasource_id": {"$exists": False}}, {"$set": {"datasource_id": DEFAULT_DATASOURCE_ID}})
+    collection.create_index("datasource_id", unique=True)
+
 # Credenciales de la base de datos local
 LOCAL_DB_CREDENTIALS = {
     "db_type": "postgresql",
@@ -28,39 +40,51 @@ LOCAL_DB_CREDENTIALS = {
 }
 
 def store_credentials(credentials):
-    collection.update_one({}, {"$set": credentials}, upsert=True)
-    logger.info("Credenciales almacenadas en MongoDB")
-    request_metadata_update()
+    datasource_id = credentials.get("datasource_id") or DEFAULT_DATASOURCE_ID
+    credentials = {**credentials, "datasource_id": datasource_id}
+    collection.update_one({"datasource_id": datasource_id}, {"$set": credentials}, upsert=True)
+    logger.info("Credenciales de '%s' almacenadas en MongoDB", datasource_id)
+    # Avisar a los servicios que guardan credenciales o conexiones en memoria
+    try:
+        publish_event(
+            RABBITMQ_HOST,
+            CREDENTIALS_EVENTS_EXCHANGE,
+            {"event": "credentials_changed", "datasource_id": datasource_id}
+        )
+    except Exception as e:
+        logger.error(f"Error publicando el evento de cambio de credenciales: {e}")
+    request_metadata_update(datasource_id)
 
-def request_metadata_update():
-    credentials = collection.find_one({}, {'_id': False})
+def request_metadata_update(datasource_id=DEFAULT_DATASOURCE_ID):
+    credentials = collection.find_one({"datasource_id": datasource_id}, {'_id': False})
     if credentials:
-        connection = get_rabbitmq_connection(RABBITMQ_HOST)
-        channel = connection.channel()
-        channel.queue_declare(queue='metadata_update_queue')
-        channel.basic_publish(exchange='', routing_key='metadata_update_queue', body=json.dumps(credentials))
+        get_publisher(RABBITMQ_HOST).publish('metadata_update_queue', json.dumps(credentials))
         logger.info("Solicitud de actualización de metadatos enviada")
-        connection.close()
 
 def initialize_credentials():
-    if collection.count_documents({}) == 0:
+    wait_for("MongoDB", lambda: mongo_client.admin.command("ping"))
+    ensure_indexes()
+    if collection.count_documents({"datasource_id": DEFAULT_DATASOURCE_ID}) == 0:
         logger.info("La colección de credenciales está vacía. Almacenando credenciales locales...")
         store_credentials(LOCAL_DB_CREDENTIALS)
 
+@traced("credentials")
 def callback(ch, method, properties, body):
     credentials = json.loads(body)
     store_credentials(credentials)
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
 def main():
-    time.sleep(10)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
     initialize_credentials()
 
     connection = get_rabbitmq_connection(RABBITMQ_HOST)
     channel = connection.channel()
-    channel.queue_declare(queue='credentials_queue')
+    declare_queue(channel, 'credentials_queue')
     channel.basic_consume(queue='credentials_queue', on_message_callback=callback, auto_ack=False)
     logger.info("Esperando mensajes en la cola 'credentials_queue'...")
+    readiness.set("rabbitmq")
     channel.start_consuming()
 
 if __name__ == "__main__":
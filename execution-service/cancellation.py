@@ -0,0 +1,68 @@
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+cancellations = registry.counter("execution_cancellations_total", "Cancel commands received for a query")
+queries_running = registry.gauge("execution_queries_running", "Queries currently running against the database")
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class RunningQueries:
+    """Queries in progress by request id, so a cancel command can reach them.
+
+    ``track`` registers a ``cancel`` callable (which interrupts the statement on
+    the database) for the duration of a query. Cancels for requests that are
+    not running yet are remembered for ``ttl`` seconds, so a query that is still
+    queued in an earlier stage is dropped when it gets here.
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._running = {}
+        self._cancelled = {}
+        self._lock = threading.Lock()
+
+    def is_cancelled(self, request_id):
+        with self._lock:
+            return request_id in self._cancelled
+
+    def cancel(self, request_id):
+        """Mark ``request_id`` as cancelled and interrupt it if it is running."""
+        cancellations.inc()
+        now = time.monotonic()
+        with self._lock:
+            self._cancelled[request_id] = now + self.ttl
+            for expired in [r for r, expires in self._cancelled.items() if expires < now]:
+                del self._cancelled[expired]
+            cancel = self._running.get(request_id)
+        if cancel is None:
+            return False
+        try:
+            cancel()
+        except Exception as e:
+            logger.error(f"Error cancelando la consulta {request_id}: {e}")
+        return True
+
+    @contextmanager
+    def track(self, request_id, cancel):
+        if request_id is None:
+            yield
+            return
+        with self._lock:
+            if request_id in self._cancelled:
+                raise QueryCancelled(request_id)
+            self._running[request_id] = cancel
+        queries_running.inc()
+        try:
+            yield
+        finally:
+            queries_running.dec()
+            with self._lock:
+                self._running.pop(request_id, None)
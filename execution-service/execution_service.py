@@ -1,13 +1,23 @@
 import json
 import os
+import sqlite3
 import psycopg2
 import mysql.connector
 from pymongo import MongoClient
-from common.utils import get_rabbitmq_connection
-import pika
+from common.publisher import propagate_properties, publish_error, RECONNECT_ERRORS
+from common.events import start_event_listener, CREDENTIALS_EVENTS_EXCHANGE, QUERY_CONTROL_EXCHANGE, PREVIEW_HEADER
+from common.transport import get_transport
+from common.datasources import DEFAULT_DATASOURCE_ID, LRUCache, get_datasource_id, find_credentials
+from common.metrics import start_metrics_server
+from common.tracing import traced
+from common.wire import encode_result
+from pools import ConnectionPool, PoolRegistry, credentials_key
+from result_cache import ResultCache, referenced_tables
+from cancellation import RunningQueries, QueryCancelled
+from preview import preview_query
 import logging
-from decimal import Decimal
-from datetime import date, datetime
+import time
+import uuid
 
 # Configurar el registro
 logging.basicConfig(level=logging.INFO)
@@ -15,102 +25,406 @@ logger = logging.getLogger(__name__)
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 MONGO_URI = os.getenv("MONGO_URI")
+METRICS_PORT = os.getenv("METRICS_PORT")
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+# Filas por mensaje hacia formatting_queue y máximo de filas por consulta
+RESULT_CHUNK_SIZE = int(os.getenv("RESULT_CHUNK_SIZE", "5000"))
+MAX_RESULT_ROWS = int(os.getenv("MAX_RESULT_ROWS", "100000"))
+# Formato de los lotes hacia formatting_queue: "json" (por filas) o "arrow" (columnar)
+RESULT_WIRE_FORMAT = os.getenv("RESULT_WIRE_FORMAT", "json")
+# Caché de resultados: tamaño en memoria, TTL, directorio de volcado a disco opcional
+# y, en PostgreSQL, invalidación por los contadores de pg_stat_user_tables
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "60"))
+RESULT_CACHE_SPILL_DIR = os.getenv("RESULT_CACHE_SPILL_DIR")
+RESULT_CACHE_MAX_DISK_BYTES = int(os.getenv("RESULT_CACHE_MAX_DISK_BYTES", str(512 * 1024 * 1024)))
+RESULT_CACHE_CHANGE_MARKER = os.getenv("RESULT_CACHE_CHANGE_MARKER", "false").lower() == "true"
+# Segundos máximos por consulta (statement_timeout / max_execution_time); 0 = sin límite
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "30"))
+# Consultas que se ejecutan a la vez; una consulta lenta no bloquea a las demás
+EXECUTION_CONCURRENCY = int(os.getenv("EXECUTION_CONCURRENCY", "4"))
+# Vista previa de las peticiones que la piden: filas, porcentaje de muestreo
+# (TABLESAMPLE, solo PostgreSQL; 0 = solo LIMIT) y segundos máximos antes de
+# renunciar a ella y pasar a la consulta completa
+RESULT_PREVIEW_ROWS = int(os.getenv("RESULT_PREVIEW_ROWS", "100"))
+RESULT_PREVIEW_SAMPLE_PERCENT = float(os.getenv("RESULT_PREVIEW_SAMPLE_PERCENT", "1"))
+RESULT_PREVIEW_TIMEOUT = float(os.getenv("RESULT_PREVIEW_TIMEOUT", "2"))
 
 # Conexión a MongoDB
 mongo_client = MongoClient(MONGO_URI)
 db = mongo_client['credentials_db']
 credentials_collection = db['credentials']
 
-def get_credentials():
-    credentials = credentials_collection.find_one({}, {'_id': False})
-    if credentials:
-        return credentials
-    else:
-        raise Exception("No se encontraron credenciales en MongoDB")
+# Credenciales en memoria por fuente de datos (las menos usadas se descartan); se
+# invalidan con el evento credentials_changed
+credentials_cache = LRUCache()
+
+def load_credentials(datasource_id):
+    credentials = find_credentials(credentials_collection, datasource_id)
+    if not credentials:
+        raise Exception(f"No se encontraron credenciales de '{datasource_id}' en MongoDB")
+    return credentials
+
+def get_credentials(datasource_id=DEFAULT_DATASOURCE_ID):
+    return credentials_cache.get_or_create(datasource_id, load_credentials)
 
-def execute_postgresql_query(sql_query, credentials):
-    conn = psycopg2.connect(
+def on_credentials_event(event):
+    if event.get("event") == "credentials_changed":
+        datasource_id = event.get("datasource_id")
+        # Las conexiones abiertas con las credenciales antiguas ya no sirven
+        if datasource_id is None:
+            credentials_cache.clear()
+            pools.close_all()
+        else:
+            credentials = credentials_cache.pop(datasource_id)
+            if credentials is not None:
+                pools.close(credentials)
+        logger.info(f"Credenciales de '{datasource_id or 'todas las fuentes'}' invalidadas, se recargarán en la próxima consulta")
+
+def connect_postgresql(credentials):
+    return psycopg2.connect(
         host=credentials['db_host'],
         user=credentials['db_user'],
         password=credentials['db_password'],
         dbname=credentials['db_name']
     )
-    cur = conn.cursor()
-    cur.execute(sql_query)
-    results = cur.fetchall()
-    colnames = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
-    
-    return results, colnames
-
-def execute_mysql_query(sql_query, credentials):
-    conn = mysql.connector.connect(
+
+def connect_mysql(credentials):
+    return mysql.connector.connect(
         host=credentials['db_host'],
         user=credentials['db_user'],
         password=credentials['db_password'],
         database=credentials['db_name']
     )
-    cur = conn.cursor()
-    cur.execute(sql_query)
-    results = cur.fetchall()
-    colnames = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
 
-    return results, colnames
+def connect_sqlite(credentials):
+    # db_name es la ruta del fichero; el pool reparte la conexión entre hilos
+    return sqlite3.connect(credentials['db_name'], check_same_thread=False)
+
+def check_connection(conn):
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchall()
+        cur.close()
+        return True
+    except Exception:
+        return False
 
-def execute_query(sql_query):
-    credentials = get_credentials()
+def create_pool(credentials):
     db_type = credentials.get("db_type", "postgresql")
     if db_type == "postgresql":
-        return execute_postgresql_query(sql_query, credentials)
+        connect = connect_postgresql
     elif db_type == "mysql":
-        return execute_mysql_query(sql_query, credentials)
+        connect = connect_mysql
+    elif db_type == "sqlite":
+        connect = connect_sqlite
+    else:
+        raise ValueError(f"Tipo de base de datos no soportado: {db_type}")
+    return ConnectionPool(
+        lambda: connect(credentials),
+        check_connection,
+        max_size=DB_POOL_MAX_SIZE,
+        health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL
+    )
+
+pools = PoolRegistry(create_pool)
+
+result_cache = ResultCache(
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    ttl=RESULT_CACHE_TTL,
+    spill_dir=RESULT_CACHE_SPILL_DIR,
+    max_disk_bytes=RESULT_CACHE_MAX_DISK_BYTES
+) if RESULT_CACHE_MAX_BYTES > 0 else None
+
+running_queries = RunningQueries()
+
+def on_control_event(event):
+    if event.get("event") == "cancel" and event.get("request_id"):
+        if running_queries.cancel(event["request_id"]):
+            logger.info(f"Consulta {event['request_id']} cancelada en la base de datos")
+
+def set_statement_timeout(conn, db_type, timeout):
+    cur = conn.cursor()
+    try:
+        if db_type == "postgresql":
+            # SET LOCAL: solo dura la transacción, que el pool deshace al devolver la conexión
+            cur.execute("SET LOCAL statement_timeout = %s", (int(timeout * 1000),))
+        elif db_type == "sqlite":
+            # SQLite no tiene límite de tiempo: el manejador de progreso aborta la
+            # sentencia al pasar el plazo (se sustituye en cada consulta)
+            deadline = time.monotonic() + timeout
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        else:
+            # Solo aplica a SELECT, que es lo único que deja pasar el servicio de validación
+            cur.execute("SET SESSION max_execution_time = %s", (int(timeout * 1000),))
+    finally:
+        cur.close()
+
+def cancel_statement(conn, db_type, credentials):
+    """Interrupt the statement running on ``conn`` (called from another thread)."""
+    if db_type == "postgresql":
+        conn.cancel()
+    elif db_type == "sqlite":
+        conn.interrupt()
+    else:
+        # MySQL no cancela desde la propia conexión: KILL QUERY desde otra
+        killer = connect_mysql(credentials)
+        try:
+            cur = killer.cursor()
+            cur.execute(f"KILL QUERY {int(conn.connection_id)}")
+            cur.close()
+        finally:
+            killer.close()
+
+def open_cursor(conn, db_type):
+    if db_type == "postgresql":
+        # Cursor con nombre (server-side): las filas se quedan en el servidor y se
+        # traen por lotes con fetchmany
+        cur = conn.cursor(name=f"smartquery_{uuid.uuid4().hex}")
+        cur.itersize = RESULT_CHUNK_SIZE
+        return cur
+    # Los cursores por defecto de mysql.connector y sqlite3 no cargan el resultado completo
+    return conn.cursor()
+
+def raise_if_interrupted(error, db_type, request_id, timeout):
+    """Re-raise ``error`` of an interrupted statement as ``QueryCancelled`` (cancel
+    of ``request_id``) or ``TimeoutError`` (PostgreSQL ``statement_timeout``)."""
+    if request_id is not None and running_queries.is_cancelled(request_id):
+        raise QueryCancelled(request_id) from error
+    if db_type == "postgresql" and isinstance(error, psycopg2.extensions.QueryCanceledError):
+        raise TimeoutError(f"La consulta superó el tiempo máximo de {timeout} segundos") from error
+
+def iter_query(sql_query, credentials, chunk_size=RESULT_CHUNK_SIZE, max_rows=MAX_RESULT_ROWS,
+               request_id=None, timeout=QUERY_TIMEOUT):
+    """Yield ``(colnames, rows, final, truncated)`` batches of at most ``chunk_size`` rows.
+
+    At most ``max_rows`` rows are read; ``truncated`` tells whether more were left.
+    Each statement is limited to ``timeout`` seconds by the database and the
+    whole read, fetches included, by the same deadline. A cancel for
+    ``request_id`` interrupts the statement and raises ``QueryCancelled``.
+    """
+    db_type = credentials.get("db_type", "postgresql")
+    deadline = time.monotonic() + timeout if timeout else None
+    pool = pools.get(credentials)
+    with pool.connection(timeout=DB_POOL_TIMEOUT) as conn, \
+            running_queries.track(request_id, lambda: cancel_statement(conn, db_type, credentials)):
+        if timeout:
+            set_statement_timeout(conn, db_type, timeout)
+        cur = open_cursor(conn, db_type)
+
+        def fetch(size):
+            # Con cursor con nombre PostgreSQL ejecuta la consulta al traer las
+            # filas: una cancelación o statement_timeout llega aquí, no en execute
+            try:
+                return cur.fetchmany(size)
+            except Exception as e:
+                raise_if_interrupted(e, db_type, request_id, timeout)
+                raise
+
+        exhausted = True
+        try:
+            try:
+                cur.execute(sql_query.strip().rstrip(';'))
+            except Exception as e:
+                raise_if_interrupted(e, db_type, request_id, timeout)
+                raise
+            exhausted = False
+            rows = fetch(min(chunk_size, max_rows))
+            colnames = [desc[0] for desc in cur.description]
+            sent = 0
+            while True:
+                sent += len(rows)
+                remaining = max_rows - sent
+                next_rows = fetch(min(chunk_size, remaining)) if rows and remaining > 0 else []
+                truncated = remaining <= 0 and bool(fetch(1))
+                final = not next_rows
+                exhausted = final and not truncated
+                yield colnames, rows, final, truncated
+                if final:
+                    break
+                if request_id is not None and running_queries.is_cancelled(request_id):
+                    raise QueryCancelled(request_id)
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"La consulta superó el tiempo máximo de {timeout} segundos")
+                rows = next_rows
+        finally:
+            if db_type == "mysql" and not exhausted:
+                # Quedan filas sin leer (resultado truncado, cancelación, error o lectura
+                # interrumpida): mysql.connector no deja cerrar el cursor ni reutilizar la
+                # conexión sin leerlas todas, y descartarla es más barato
+                pool.discard_on_release(conn)
+            else:
+                try:
+                    cur.close()
+                except Exception as e:
+                    logger.warning(f"Error cerrando el cursor: {e}")
+
+def change_marker(sql_query, credentials):
+    """Modification counters of the tables read by ``sql_query`` (PostgreSQL only).
+
+    A single catalog lookup, much cheaper than re-running the query. The
+    counters are flushed by the statistics system with a small delay (under a
+    second), so a write is seen by the cache at most that late. Returns ``None``
+    when the marker is disabled or not available; the TTL is then the only
+    invalidation.
+    """
+    if not RESULT_CACHE_CHANGE_MARKER or credentials.get("db_type", "postgresql") != "postgresql":
+        return None
+    tables = referenced_tables(sql_query)
+    if not tables:
+        return None
+    with pools.get(credentials).connection(timeout=DB_POOL_TIMEOUT) as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT schemaname, relname, n_tup_ins, n_tup_upd, n_tup_del, n_live_tup "
+                "FROM pg_stat_user_tables WHERE relname = ANY(%s) ORDER BY schemaname, relname",
+                (tables,)
+            )
+            return tuple(cur.fetchall())
+        finally:
+            cur.close()
+
+def estimate_rows(sql_query, credentials):
+    """Planner's estimate of the rows of ``sql_query`` (PostgreSQL only), or ``None``."""
+    if credentials.get("db_type", "postgresql") != "postgresql":
+        return None
+    with pools.get(credentials).connection(timeout=DB_POOL_TIMEOUT) as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql_query.strip().rstrip(';'))
+            return int(cur.fetchone()[0][0]["Plan"]["Plan Rows"])
+        finally:
+            cur.close()
+
+def run_preview(sql_query, credentials, request_id=None):
+    """``(colnames, rows, meta)`` of a cheap variant of ``sql_query`` (see
+    ``preview.preview_query``), or ``None`` if there is none or it fails.
+
+    A cancel of ``request_id`` still raises ``QueryCancelled``.
+    """
+    db_type = credentials.get("db_type", "postgresql")
+    variant = preview_query(sql_query, db_type, RESULT_PREVIEW_ROWS, RESULT_PREVIEW_SAMPLE_PERCENT)
+    if variant is None:
+        return None
+    preview_sql, sampled = variant
+    batches = iter_query(
+        preview_sql, credentials, chunk_size=RESULT_PREVIEW_ROWS, max_rows=RESULT_PREVIEW_ROWS,
+        request_id=request_id, timeout=RESULT_PREVIEW_TIMEOUT
+    )
+    try:
+        colnames, rows, _, _ = next(batches)
+    except QueryCancelled:
+        raise
+    except Exception as e:
+        # Sin vista previa la consulta sigue: solo se pierde el adelanto
+        logger.warning(f"Preview skipped ({preview_sql}): {e}")
+        return None
+    finally:
+        # Devuelve la conexión al pool antes de la consulta completa
+        batches.close()
+    meta = {"seq": 0, "final": False, "truncated": False, "preview": True, "sampled": sampled}
+    try:
+        estimated = estimate_rows(sql_query, credentials)
+    except Exception as e:
+        logger.warning(f"Row estimate not available: {e}")
+        estimated = None
+    if estimated is not None:
+        meta["estimated_rows"] = estimated
+    logger.info(f"Preview ready: {len(rows)} rows{' (sampled)' if sampled else ''} from {preview_sql}")
+    return colnames, rows, meta
+
+def execute_query(sql_query, request_id=None, datasource_id=DEFAULT_DATASOURCE_ID):
+    credentials = get_credentials(datasource_id)
+    db_type = credentials.get("db_type", "postgresql")
+    if db_type in ("postgresql", "mysql", "sqlite"):
+        return iter_query(sql_query, credentials, request_id=request_id)
     else:
-        logger.error(f"Tipo de base de datos no soportado: {db_type}")
-        return None, None
+        raise ValueError(f"Tipo de base de datos no soportado: {db_type}")
 
-def json_serial(obj):
-    """JSON serializer for objects not serializable by default json code"""
-    if isinstance(obj, Decimal):
-        return float(obj)
-    if isinstance(obj, (date, datetime)):
-        return obj.isoformat()
-    raise TypeError("Type not serializable")
+def publish_chunk(transport, properties, body, content_type, meta):
+    chunk_properties = propagate_properties(properties)
+    chunk_properties.content_type = content_type
+    chunk_properties.headers = {**(chunk_properties.headers or {}), **meta}
+    transport.publish('formatting_queue', body, properties=chunk_properties)
 
+@traced("execution")
 def callback(ch, method, properties, body):
     data = json.loads(body)
     sql_query = data.get("sql_query")
+    request_id = properties.correlation_id
+    datasource_id = get_datasource_id(properties)
     logger.info(f"Executing SQL Query: {sql_query}")
 
     try:
-        results, colnames = execute_query(sql_query)
-        if results is None or colnames is None:
-            raise Exception("Error al ejecutar la consulta")
-
-        logger.info(f"Query executed successfully: {results} -- {colnames}")
-
-        connection = get_rabbitmq_connection(RABBITMQ_HOST)
-        channel = connection.channel()
-        channel.queue_declare(queue='formatting_queue')
-        channel.basic_publish(
-            exchange='', 
-            routing_key='formatting_queue', 
-            body=json.dumps({"results": results, "columns": colnames}, default=json_serial)
-        )
-        logger.info("Data sent to Formatting Service")
-        connection.close()
+        if request_id is not None and running_queries.is_cancelled(request_id):
+            raise QueryCancelled(request_id)
+        transport = get_transport(RABBITMQ_HOST)
+        cache_key, marker = None, None
+        if result_cache is not None:
+            credentials = get_credentials(datasource_id)
+            cache_key = result_cache.key(sql_query, credentials_key(credentials))
+            marker = change_marker(sql_query, credentials)
+            cached = result_cache.get(cache_key, marker)
+            if cached is not None:
+                # Acierto: los lotes ya codificados van directos a formatting_queue
+                for chunk_body, content_type, meta in cached:
+                    publish_chunk(transport, properties, chunk_body, content_type, meta)
+                logger.info(f"Query served from the result cache in {len(cached)} chunks")
+                return
+
+        # Vista previa barata primero: el cliente ve algo mientras corre la consulta completa
+        if (properties.headers or {}).get(PREVIEW_HEADER):
+            preview = run_preview(sql_query, get_credentials(datasource_id), request_id)
+            if preview is not None:
+                colnames, rows, meta = preview
+                chunk_body, content_type = encode_result(colnames, rows, meta, RESULT_WIRE_FORMAT)
+                publish_chunk(transport, properties, chunk_body, content_type, meta)
+
+        total_rows = 0
+        chunks, cached_bytes = [], 0
+        # Cada lote se publica como un mensaje propio, numerado con seq
+        for seq, (colnames, rows, final, truncated) in enumerate(execute_query(sql_query, request_id, datasource_id)):
+            total_rows += len(rows)
+            meta = {"seq": seq, "final": final, "truncated": truncated, "preview": False}
+            chunk_body, content_type = encode_result(colnames, rows, meta, RESULT_WIRE_FORMAT)
+            publish_chunk(transport, properties, chunk_body, content_type, meta)
+            if chunks is not None and cache_key is not None:
+                cached_bytes += len(chunk_body)
+                if cached_bytes <= result_cache.max_bytes // 4:
+                    chunks.append((chunk_body, content_type, meta))
+                else:
+                    # Resultados demasiado grandes no se guardan: se deja de acumular
+                    chunks = None
+        if chunks is not None and cache_key is not None:
+            result_cache.put(cache_key, chunks, marker)
+        logger.info(f"Query executed successfully: {total_rows} rows sent to Formatting Service in {seq + 1} chunks")
+    except QueryCancelled:
+        logger.info(f"Query {request_id} cancelled")
+        publish_error(RABBITMQ_HOST, properties, "Query cancelled")
+    except RECONNECT_ERRORS:
+        # RabbitMQ no acepta los lotes: el Consumer reintenta el mensaje (el
+        # cliente puede recibir repetidos los lotes que ya se hubieran enviado)
+        raise
     except Exception as e:
         logger.error(f"Error executing query: {e}")
+        publish_error(RABBITMQ_HOST, properties, f"Error executing query: {e}")
+
+def setup():
+    # Lo necesario en cada proceso que consume execution_queue (también los de
+    # common.supervisor: las cancelaciones llegan por difusión a todos)
+    start_event_listener(RABBITMQ_HOST, CREDENTIALS_EVENTS_EXCHANGE, on_credentials_event)
+    start_event_listener(RABBITMQ_HOST, QUERY_CONTROL_EXCHANGE, on_control_event)
 
 def main():
-    connection = get_rabbitmq_connection(RABBITMQ_HOST)
-    channel = connection.channel()
-    channel.queue_declare(queue='execution_queue')
-    channel.basic_consume(queue='execution_queue', on_message_callback=callback, auto_ack=True)
-    logger.info("Waiting for messages...")
-    channel.start_consuming()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    setup()
+
+    get_transport(RABBITMQ_HOST).consume('execution_queue', callback, concurrency=EXECUTION_CONCURRENCY)
 
 if __name__ == "__main__":
     main()
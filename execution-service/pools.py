@@ -0,0 +1,168 @@
+import json
+import time
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager
+from common.metrics import registry
+from common.datasources import LRUCache, DATASOURCE_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+pool_wait_seconds = registry.histogram("execution_pool_wait_seconds", "Time spent waiting for a pooled DB connection")
+connections_opened = registry.counter("execution_pool_connections_opened_total", "DB connections opened by the pools")
+connections_closed = registry.counter("execution_pool_connections_closed_total", "DB connections closed by the pools")
+connections_in_use = registry.gauge("execution_pool_connections_in_use", "DB connections currently checked out")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Bounded pool of DB connections for one set of credentials.
+
+    ``connect`` opens a new connection and ``check`` tells whether an existing
+    one is still usable; idle connections older than ``health_check_interval``
+    seconds are checked before being handed out and replaced if broken.
+    """
+
+    def __init__(self, connect, check, max_size=5, health_check_interval=30):
+        self.connect = connect
+        self.check = check
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._discarded = set()
+        self._cond = threading.Condition()
+
+    def _open(self):
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        connections_opened.inc()
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Error cerrando conexión: {e}")
+        connections_closed.inc()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def acquire(self, timeout=None):
+        start = time.perf_counter()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("El pool de conexiones está cerrado")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeout(f"No hay conexiones libres tras {timeout} segundos")
+                self._cond.wait(remaining)
+
+        if conn is not None and time.monotonic() - last_used > self.health_check_interval and not self.check(conn):
+            logger.info("Conexión inactiva caducada, abriendo una nueva")
+            self._discard(conn)
+            with self._cond:
+                self._size += 1
+            conn = None
+        if conn is None:
+            conn = self._open()
+
+        pool_wait_seconds.observe(time.perf_counter() - start)
+        connections_in_use.inc()
+        return conn
+
+    def discard_on_release(self, conn):
+        """Close ``conn`` instead of returning it to the pool when it is released
+        (e.g. it still has an unread result)."""
+        with self._cond:
+            self._discarded.add(id(conn))
+
+    def release(self, conn, broken=False):
+        connections_in_use.dec()
+        with self._cond:
+            if id(conn) in self._discarded:
+                self._discarded.discard(id(conn))
+                broken = True
+        if broken or self._closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        failed = False
+        try:
+            yield conn
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            # La conexión vuelve al pool limpia; si no responde, se descarta
+            if id(conn) in self._discarded:
+                broken = True
+            else:
+                try:
+                    conn.rollback()
+                    broken = failed and not self.check(conn)
+                except Exception:
+                    broken = True
+            self.release(conn, broken=broken)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+def credentials_key(credentials):
+    """Stable identity of a set of credentials (used to key pools and caches)."""
+    return hashlib.sha256(json.dumps(credentials, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class PoolRegistry:
+    """One ``ConnectionPool`` per distinct set of credentials.
+
+    At most ``max_pools`` pools are kept; the least recently used one is closed
+    when another datasource needs room (its checked-out connections are closed
+    as they are released).
+    """
+
+    def __init__(self, factory, max_pools=DATASOURCE_CACHE_SIZE):
+        self.factory = factory
+        self._pools = LRUCache(max_pools, on_evict=lambda key, pool: pool.close())
+
+    def get(self, credentials):
+        return self._pools.get_or_create(credentials_key(credentials), lambda key: self.factory(credentials))
+
+    def close(self, credentials):
+        """Close the pool of ``credentials``, if any."""
+        self._pools.pop(credentials_key(credentials))
+
+    def close_all(self):
+        self._pools.clear()
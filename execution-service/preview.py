@@ -0,0 +1,106 @@
+import sqlglot
+from sqlglot import exp
+
+# Dialecto de sqlglot de cada tipo de base de datos soportado
+DIALECTS = {"postgresql": "postgres", "mysql": "mysql", "sqlite": "sqlite"}
+# Bases que admiten TABLESAMPLE (MySQL y SQLite no tienen muestreo)
+SAMPLING_DB_TYPES = ("postgresql",)
+# Explícitas en lugar de exp.SetOperation, que no existe en versiones antiguas de sqlglot
+SET_OPERATIONS = (exp.Union, exp.Intersect, exp.Except)
+# Agregados que dependen del número de filas leídas: sobre una muestra no sirven
+ADDITIVE_AGGREGATES = (exp.Count, exp.Sum)
+
+
+def _from(select):
+    # "from_" en las versiones recientes de sqlglot, "from" en las antiguas
+    return select.args.get("from_") or select.args.get("from")
+
+
+def reads_everything(tree):
+    """Whether the first row of ``tree`` can only come after reading all its
+    input (aggregates, GROUP BY, ORDER BY, DISTINCT, windows, set operations)."""
+    return tree.find(exp.AggFunc, exp.Window, exp.Group, exp.Order, exp.Distinct, *SET_OPERATIONS) is not None
+
+
+def additive(tree):
+    """Whether the outermost SELECT of ``tree`` computes an aggregate that grows
+    with the rows read (``COUNT``, ``SUM``): over a sample it would come out
+    ``100 / percent`` times too small, not just approximate."""
+    return any(node.find_ancestor(exp.Select) is tree for node in tree.find_all(*ADDITIVE_AGGREGATES))
+
+
+def sample_from(tree, percent):
+    """Read the table in the outermost ``FROM`` of ``tree`` with
+    ``TABLESAMPLE SYSTEM (percent)``; returns whether it could.
+
+    Only that table is sampled: tables joined to it and subqueries stay
+    complete, so joins still match and filters do not compound the sampling.
+    """
+    if not isinstance(tree, exp.Select):
+        return False
+    ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    source = _from(tree)
+    table = source.this if source is not None else None
+    if not isinstance(table, exp.Table) or table.name in ctes:
+        return False
+    table.set("sample", exp.TableSample(method=exp.var("SYSTEM"), percent=exp.Literal.number(percent)))
+    return True
+
+
+def limit_count(tree):
+    """Row count of the literal ``LIMIT n`` or ``FETCH FIRST n ROWS ONLY`` of
+    ``tree``; ``None`` without one or when it cannot be read as a plain count."""
+    limit = tree.args.get("limit") if isinstance(tree, exp.Select) else None
+    if isinstance(limit, exp.Fetch):
+        options = limit.args.get("limit_options")
+        if options is not None and (options.args.get("percent") or options.args.get("with_ties")):
+            return None
+        value = limit.args.get("count")
+    else:
+        value = limit.expression if limit is not None else None
+    return int(value.name) if isinstance(value, exp.Literal) and value.is_int else None
+
+
+def limited(tree, rows):
+    """Whether ``tree`` already returns at most ``rows`` rows."""
+    count = limit_count(tree)
+    return count is not None and count <= rows
+
+
+def limit_rows(tree, rows):
+    """``tree`` returning at most ``rows`` rows (or fewer, if its own limit is lower)."""
+    if limited(tree, rows):
+        return tree
+    if not isinstance(tree, exp.Select) or (tree.args.get("limit") is not None and limit_count(tree) is None):
+        # Límite que no se puede comparar (FETCH ... PERCENT, WITH TIES, expresiones): se respeta envolviéndolo
+        tree = exp.select("*").from_(tree.subquery("preview"))
+    return tree.limit(rows)
+
+
+def preview_query(sql_query, db_type, rows, sample_percent=0):
+    """Cheap variant of ``sql_query`` for a quick preview of its result.
+
+    Returns ``(sql, sampled)``, or ``None`` when no variant would be cheaper.
+    A query that can stop early gets a ``LIMIT rows`` (its exact first rows).
+    One that reads all its input before the first row (see ``reads_everything``)
+    reads a sample of its main table instead (``sample_from``), if the database
+    supports it and ``sample_percent`` is set: averages, extremes and sorts over
+    large tables come back fast but approximate. Counts and sums (``additive``)
+    get no preview.
+    """
+    dialect = DIALECTS.get(db_type)
+    try:
+        tree = sqlglot.parse_one(sql_query, read=dialect)
+    except sqlglot.errors.ParseError:
+        return None
+    if tree is None or not tree.find(exp.Table):
+        return None
+    if not reads_everything(tree):
+        if limited(tree, rows):
+            return None
+        return limit_rows(tree, rows).sql(dialect=dialect), False
+    if sample_percent <= 0 or db_type not in SAMPLING_DB_TYPES or additive(tree):
+        return None
+    if sample_from(tree, sample_percent):
+        return limit_rows(tree, rows).sql(dialect=dialect), True
+    return None
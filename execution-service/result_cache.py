@@ -0,0 +1,187 @@
+import os
+import re
+import time
+import pickle
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+hits = registry.counter("execution_result_cache_hits_total", "Queries answered from the result cache")
+misses = registry.counter("execution_result_cache_misses_total", "Queries that had to run against the database")
+hit_ratio = registry.gauge("execution_result_cache_hit_ratio", "Fraction of queries answered from the result cache")
+bytes_held = registry.gauge("execution_result_cache_bytes", "Bytes of encoded results held in memory")
+disk_bytes_held = registry.gauge("execution_result_cache_disk_bytes", "Bytes of encoded results spilled to disk")
+
+WHITESPACE = re.compile(r"\s+")
+STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+TABLE_REFERENCE = re.compile(r'\b(?:from|join)\s+((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)', re.IGNORECASE)
+
+
+def normalize_sql(sql_query):
+    """Case- and whitespace-insensitive form of ``sql_query`` (string literals are kept as is)."""
+    parts = STRING_LITERAL.split(sql_query.strip().rstrip(';'))
+    for i in range(0, len(parts), 2):
+        parts[i] = WHITESPACE.sub(" ", parts[i].lower())
+    return "".join(parts).strip()
+
+
+def referenced_tables(sql_query):
+    """Table names after FROM/JOIN, without schema or quotes (best effort)."""
+    tables = set()
+    for reference in TABLE_REFERENCE.findall(STRING_LITERAL.sub("''", sql_query)):
+        name = reference.split(".")[-1]
+        tables.add(name[1:-1] if name.startswith('"') else name.lower())
+    return sorted(tables)
+
+
+class Entry:
+    def __init__(self, chunks, marker, size):
+        self.chunks = chunks
+        self.marker = marker
+        self.size = size
+        self.created = time.monotonic()
+        self.created_wall = time.time()
+
+
+class ResultCache:
+    """LRU cache of encoded result chunks keyed by (normalized SQL, credentials).
+
+    Entries expire after ``ttl`` seconds or as soon as the caller's change
+    marker for the referenced tables differs from the one stored with them.
+    Memory is bounded by ``max_bytes``; entries evicted from memory are spilled
+    to ``spill_dir`` (if set, bounded by ``max_disk_bytes``) and promoted back on
+    the next hit. The spilled files and their sizes are tracked in memory, so
+    the directory is only listed once, at start-up.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60, spill_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+        # Resultados en disco, del más antiguo al más reciente: clave -> bytes
+        self._spilled = OrderedDict()
+        self._disk_bytes = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def key(sql_query, credentials_key):
+        return hashlib.sha256(f"{credentials_key}\n{normalize_sql(sql_query)}".encode()).hexdigest()
+
+    def _record(self, hit):
+        self._lookups += 1
+        if hit:
+            self._hits += 1
+            hits.inc()
+        else:
+            misses.inc()
+        hit_ratio.set(self._hits / self._lookups)
+
+    def _fresh(self, entry, marker):
+        return time.monotonic() - entry.created < self.ttl and entry.marker == marker
+
+    def get(self, key, marker=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.spill_dir:
+                entry = self._load_spilled(key)
+            if entry is not None and not self._fresh(entry, marker):
+                self._drop(key)
+                entry = None
+            self._record(entry is not None)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.chunks
+
+    def put(self, key, chunks, marker=None):
+        size = sum(len(body) for body, _, _ in chunks)
+        # Un resultado que no cabe holgadamente no desplaza al resto de la caché
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = Entry(chunks, marker, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest_key, oldest = self._entries.popitem(last=False)
+                self._bytes -= oldest.size
+                if self.spill_dir:
+                    self._spill(oldest_key, oldest)
+            bytes_held.set(self._bytes)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            bytes_held.set(self._bytes)
+        if key in self._spilled:
+            self._remove_spilled(key)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.pkl")
+
+    def _spill(self, key, entry):
+        try:
+            with open(self._spill_path(key), "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+        except OSError as e:
+            logger.error(f"Error volcando resultado a disco: {e}")
+            return
+        self._disk_bytes += size - self._spilled.pop(key, 0)
+        self._spilled[key] = size
+        while self._spilled and self._disk_bytes > self.max_disk_bytes:
+            self._remove_spilled(next(iter(self._spilled)))
+        disk_bytes_held.set(self._disk_bytes)
+
+    def _remove_spilled(self, key):
+        self._disk_bytes -= self._spilled.pop(key)
+        disk_bytes_held.set(self._disk_bytes)
+        try:
+            os.remove(self._spill_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _load_spilled(self, key):
+        if key not in self._spilled:
+            return None
+        try:
+            with open(self._spill_path(key), "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError) as e:
+            logger.error(f"Error leyendo resultado de disco: {e}")
+            self._remove_spilled(key)
+            return None
+        # El reloj monotónico no sobrevive a un reinicio: se recalcula la antigüedad
+        entry.created = time.monotonic() - (time.time() - entry.created_wall)
+        self._remove_spilled(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        bytes_held.set(self._bytes)
+        return entry
+
+    def _scan_disk(self):
+        # Resultados volcados antes de un reinicio, por antigüedad
+        files = []
+        for name in os.listdir(self.spill_dir):
+            if name.endswith(".pkl"):
+                stat = os.stat(os.path.join(self.spill_dir, name))
+                files.append((stat.st_mtime, name[:-len(".pkl")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._spilled[key] = size
+            self._disk_bytes += size
+        while self._spilled and self._disk_bytes > self.max_disk_bytes:
+            self._remove_spilled(next(iter(self._spilled)))
+        disk_bytes_held.set(self._disk_bytes)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+# Resultados que el frontend puede pintar como ranking
+TOP_N_MAX_ROWS = 50
+
+ISO_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}"
+# Valores que se inspeccionan para decidir si una columna de texto contiene fechas
+TEMPORAL_SAMPLE_SIZE = 100
+
+
+def column_values(series):
+    """Column as a list of JSON-native values, with nulls as ``None``.
+
+    The conversion is done for the whole column at once (``ndarray.tolist``) and
+    nulls are patched in by mask, instead of boxing and testing every cell.
+    """
+    mask = series.isna().to_numpy()
+    if series.dtype.kind in "iufb":
+        values = series.to_numpy().tolist()
+    elif series.dtype.kind == "M":
+        values = np.datetime_as_string(series.to_numpy(), unit="s").tolist()
+    else:
+        values = series.to_numpy(dtype=object).tolist()
+    if mask.any():
+        for i in np.flatnonzero(mask).tolist():
+            values[i] = None
+    return values
+
+
+def is_numeric(series):
+    return series.dtype.kind in "iuf"
+
+
+def is_temporal(series):
+    if series.dtype.kind == "M":
+        return True
+    if series.dtype.kind != "O" and not pd.api.types.is_string_dtype(series.dtype):
+        return False
+    # Las fechas llegan como cadenas ISO desde el servicio de ejecución; basta con
+    # una muestra para no recorrer la columna entera
+    values = series.head(TEMPORAL_SAMPLE_SIZE).dropna()
+    return len(values) > 0 and bool(values.astype(str).str.match(ISO_DATE_PATTERN).all())
+
+
+def detect_shape(df):
+    """Classify a result as ``scalar``, ``timeseries``, ``top_n`` or plain ``table``."""
+    rows, cols = df.shape
+    if rows == 1 and cols == 1:
+        return "scalar"
+    if rows < 2:
+        return "table"
+
+    # Por posición: un JOIN puede devolver dos columnas con el mismo nombre
+    columns = [df.iloc[:, i] for i in range(cols)]
+    numeric = [i for i, series in enumerate(columns) if is_numeric(series)]
+    if not numeric:
+        return "table"
+
+    temporal = [i for i, series in enumerate(columns) if i not in numeric and is_temporal(series)]
+    if temporal:
+        time_column = columns[temporal[0]]
+        if time_column.is_monotonic_increasing or time_column.is_monotonic_decreasing:
+            return "timeseries"
+
+    if cols == 2 and len(numeric) == 1 and rows <= TOP_N_MAX_ROWS:
+        values = columns[numeric[0]]
+        if values.is_monotonic_decreasing or values.is_monotonic_increasing:
+            return "top_n"
+    return "table"
+
+
+def format_frame(df, with_shape=True):
+    """Formatted payload for one result chunk.
+
+    The shape of a result is decided on its first chunk: later chunks pass
+    ``with_shape=False`` and the gateway gives them the shape of the first one.
+    """
+    columns = [str(name) for name in df.columns]
+    if len(columns) == 1 and "count" in columns[0].lower() and len(df) > 0:
+        return {"type": "counter", "data": column_values(df.iloc[:, 0])[0]}
+
+    formatted = {
+        "type": "table",
+        "layout": "columns",
+        "columns": columns,
+        "data": [column_values(df.iloc[:, i]) for i in range(len(columns))],
+        "rows": len(df),
+    }
+    if with_shape:
+        formatted["shape"] = detect_shape(df)
+    return formatted
@@ -1,8 +1,11 @@
-import json
 import os
 import pandas as pd
-from common.utils import get_rabbitmq_connection
-import pika
+from common.publisher import publish_reply
+from common.transport import get_transport
+from common.metrics import start_metrics_server
+from common.tracing import traced
+from common.wire import decode_result, arrow_to_pandas
+from formatter import format_frame
 import logging
 
 # Configurar el registro
@@ -10,46 +13,59 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
+METRICS_PORT = os.getenv("METRICS_PORT")
 
+@traced("formatting")
 def callback(ch, method, properties, body):
+    # El formato (JSON por filas o Arrow por columnas) viaja en content_type y
+    # seq/final/truncated en las cabeceras
+    meta = properties.headers or {}
     try:
-        data = json.loads(body)
-        results = data.get("results")
-        columns = data.get("columns")
-
-        logger.info(f"Received data: {results} -- {columns}")
-
-        if isinstance(results, list) and isinstance(columns, list):
-            df = pd.DataFrame(results, columns=columns)
-            # Convertir los tipos de datos del DataFrame a tipos nativos de Python
-            df = df.astype(object).where(pd.notnull(df), None)
-            
-            if len(df.columns) == 1 and "count" in df.columns[0].lower():
-                count = df.iloc[0, 0]
-                formatted_data = {"type": "counter", "data": count}
+        columns, results = decode_result(body, properties.content_type)
+
+        logger.info(f"Received chunk {meta.get('seq', 0)} ({properties.content_type or 'application/json'}): {len(results or [])} rows -- {columns}")
+
+        if isinstance(columns, list) and results is not None:
+            if isinstance(results, list):
+                df = pd.DataFrame(results, columns=columns)
             else:
-                table_data = df.to_dict(orient='records')
-                formatted_data = {"type": "table", "data": table_data}
+                # Tabla Arrow: se carga sin copiar las columnas numéricas
+                df = arrow_to_pandas(results)
+            # Formateo por columnas (sin convertir celda a celda); la forma del
+            # resultado se decide solo en el primer lote
+            formatted_data = format_frame(df, with_shape=meta.get("seq", 0) == 0)
         else:
             logger.error("Invalid data format received")
             formatted_data = {"type": "error", "data": "Invalid data format received"}
-
-        connection = get_rabbitmq_connection(RABBITMQ_HOST)
-        channel = connection.channel()
-        channel.queue_declare(queue='response_queue')
-        channel.basic_publish(exchange='', routing_key='response_queue', body=json.dumps(formatted_data))
-        logger.info("Data sent to Response Service: %s", formatted_data)
-        connection.close()
     except Exception as e:
+        # Reintentar no arreglaría unos datos que no se pueden formatear: se avisa al cliente
         logger.error(f"Error processing data: {e}")
+        formatted_data = {"type": "error", "data": f"Error formatting results: {e}"}
+
+    # Cada lote se formatea por separado y se reenvía con su número de secuencia;
+    # el gateway cierra el stream SSE al recibir el lote final
+    formatted_data["seq"] = meta.get("seq", 0)
+    formatted_data["final"] = meta.get("final", True)
+    formatted_data["truncated"] = meta.get("truncated", False)
+    # Una vista previa (muestra o primeras filas) llega antes que el resultado
+    # completo, que la sustituye a partir de su seq 0
+    formatted_data["preview"] = meta.get("preview", False)
+    if formatted_data["preview"]:
+        formatted_data["sampled"] = meta.get("sampled", False)
+        if "estimated_rows" in meta:
+            formatted_data["estimated_rows"] = meta["estimated_rows"]
+    # Si la publicación falla, el transporte reintenta el mensaje
+    publish_reply(RABBITMQ_HOST, properties, formatted_data)
+    logger.info(
+        "Chunk %s sent to Response Service (type %s, shape %s)",
+        formatted_data["seq"], formatted_data["type"], formatted_data.get("shape")
+    )
 
 def main():
-    connection = get_rabbitmq_connection(RABBITMQ_HOST)
-    channel = connection.channel()
-    channel.queue_declare(queue='formatting_queue')
-    channel.basic_consume(queue='formatting_queue', on_message_callback=callback, auto_ack=True)
-    logger.info("Waiting for messages...")
-    channel.start_consuming()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    # Cada lote se confirma solo después de enviarse al gateway
+    get_transport(RABBITMQ_HOST).consume('formatting_queue', callback)
 
 if __name__ == "__main__":
     main()
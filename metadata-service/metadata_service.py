@@ -1,15 +1,20 @@
 import os
 import json
 import logging
-import time
 import pika
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, ReplaceOne, DeleteOne
 import psycopg2
 import mysql.connector
 # Importa más conectores según sea necesario
 
 from common.utils import get_rabbitmq_connection
-from utils import get_db_schema
+from common.queues import declare_queue, DEAD_LETTER_SUFFIX
+from common.events import publish_event, SCHEMA_EVENTS_EXCHANGE
+from common.datasources import DEFAULT_DATASOURCE_ID, DATASOURCE_CACHE_SIZE, LRUCache, get_datasource_id
+from common.readiness import readiness, wait_for
+from common.metrics import start_metrics_server
+from common.tracing import traced
+from utils import get_db_schema, table_fingerprint
 
 # Configurar el registro
 logging.basicConfig(level=logging.INFO)
@@ -17,11 +22,15 @@ logger = logging.getLogger(__name__)
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 MONGO_URI = os.getenv("MONGO_URI")
+METRICS_PORT = os.getenv("METRICS_PORT")
 
 # Conexión a MongoDB
 mongo_client = MongoClient(MONGO_URI)
 db = mongo_client['metadata_db']
 metadata_collection = db['metadata']
+# Un documento por fuente de datos y tabla con su huella; el documento de cada
+# fuente en metadata_collection guarda solo la versión de su esquema
+tables_collection = db['metadata_tables']
 credentials_collection = db['credentials']
 
 # Credenciales de la base de datos local
@@ -34,33 +43,121 @@ LOCAL_DB_CREDENTIALS = {
 }
 
 
-def store_schema(schema):
-    metadata_collection.update_one({}, {"$set": {"schema": schema}}, upsert=True)
-    logger.info("Metadatos almacenados en MongoDB")
+def ensure_indexes():
+    # Datos anteriores a las fuentes de datos: pasan a la fuente por defecto
+    legacy = {"datasource_id": {"$exists": False}}
+    metadata_collection.update_many(legacy, {"$set": {"datasource_id": DEFAULT_DATASOURCE_ID}})
+    tables_collection.update_many(legacy, [{"$set": {"datasource_id": DEFAULT_DATASOURCE_ID, "table": "$_id"}}])
+    metadata_collection.create_index("datasource_id", unique=True)
+    tables_collection.create_index([("datasource_id", 1), ("table", 1)], unique=True)
 
-def handle_metadata_request(ch, method, properties, body):
-    # Recuperar el esquema almacenado en MongoDB
-    metadata = metadata_collection.find_one({}, {'_id': False, 'schema': True})
-    if metadata and 'schema' in metadata:
+# Esquema serializado de la última versión servida de cada fuente, para no releer
+# todas sus tablas de MongoDB en cada petición
+_served = LRUCache()
+
+def load_schema(datasource_id):
+    """``(schema, version)`` stored in MongoDB, or ``(None, None)`` if there is none."""
+    metadata = metadata_collection.find_one({"datasource_id": datasource_id}, {'_id': False})
+    if not metadata:
+        return None, None
+    schema = {
+        doc['table']: doc['details']
+        for doc in tables_collection.find({"datasource_id": datasource_id}, {'table': True, 'details': True})
+    }
+    if not schema and 'schema' in metadata:
+        # Formato anterior: el esquema completo dentro del documento de metadatos
         schema = metadata['schema']
-        ch.basic_publish(
-            exchange='',
-            routing_key=properties.reply_to,
-            properties=pika.BasicProperties(correlation_id=properties.correlation_id),
-            body=json.dumps(schema)
+    return schema, metadata.get('version', 0)
+
+def store_schema(schema, datasource_id=DEFAULT_DATASOURCE_ID):
+    """Write only the tables whose fingerprint changed and bump the schema version.
+
+    Returns the current version; no new version is created (nor event sent)
+    when nothing changed.
+    """
+    stored = {
+        doc['table']: doc['fingerprint']
+        for doc in tables_collection.find({"datasource_id": datasource_id}, {'table': True, 'fingerprint': True})
+    }
+    fingerprints = {table: table_fingerprint(details) for table, details in schema.items()}
+    changed = [table for table, fingerprint in fingerprints.items() if stored.get(table) != fingerprint]
+    removed = [table for table in stored if table not in schema]
+
+    metadata = metadata_collection.find_one({"datasource_id": datasource_id}, {'version': True, 'schema': True})
+    if metadata and not changed and not removed and 'schema' not in metadata:
+        logger.info("Esquema de '%s' sin cambios (versión %s)", datasource_id, metadata.get('version'))
+        return metadata.get('version')
+
+    operations = [
+        ReplaceOne(
+            {'datasource_id': datasource_id, 'table': table},
+            {'datasource_id': datasource_id, 'table': table, 'fingerprint': fingerprints[table], 'details': schema[table]},
+            upsert=True
         )
-        logger.info("Metadatos enviados al servicio de NLP: %s", schema)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-    else:
-        logger.error("No se encontraron metadatos en MongoDB")
-        ch.basic_nack(delivery_tag=method.delivery_tag)
+        for table in changed
+    ] + [DeleteOne({'datasource_id': datasource_id, 'table': table}) for table in removed]
+    if operations:
+        tables_collection.bulk_write(operations, ordered=False)
+
+    metadata = metadata_collection.find_one_and_update(
+        {"datasource_id": datasource_id},
+        {"$unset": {"schema": ""}, "$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    logger.info(
+        "Metadatos de '%s' almacenados en MongoDB (versión %s): %d tablas nuevas o modificadas, %d eliminadas, %d sin cambios",
+        datasource_id, metadata["version"], len(changed), len(removed), len(schema) - len(changed)
+    )
+    # Avisar a las cachés de esquema de los demás servicios
+    try:
+        publish_event(
+            RABBITMQ_HOST,
+            SCHEMA_EVENTS_EXCHANGE,
+            {"event": "schema_changed", "datasource_id": datasource_id, "version": metadata["version"]}
+        )
+    except Exception as e:
+        logger.error(f"Error publicando el evento de cambio de esquema: {e}")
+    return metadata["version"]
+
+def serialized_schema(datasource_id):
+    """``(body, version)`` of the current schema, serialized once per version."""
+    version = (metadata_collection.find_one({"datasource_id": datasource_id}, {'version': True}) or {}).get('version')
+    served = _served.get(datasource_id)
+    if version is None or served is None or served[1] != version:
+        schema, version = load_schema(datasource_id)
+        served = (json.dumps(schema) if schema else None, version)
+        _served.put(datasource_id, served)
+    return served
+
+@traced("metadata")
+def handle_metadata_request(ch, method, properties, body):
+    # Recuperar el esquema almacenado en MongoDB
+    datasource_id = get_datasource_id(properties)
+    schema_body, version = serialized_schema(datasource_id)
+    if not schema_body:
+        # Fuente de datos desconocida: se responde sin esquema en lugar de
+        # devolver la petición a la cola, donde se reintentaría sin fin
+        logger.error(f"No se encontraron metadatos de '{datasource_id}' en MongoDB")
+        schema_body = json.dumps(None)
+    ch.basic_publish(
+        exchange='',
+        routing_key=properties.reply_to,
+        properties=pika.BasicProperties(
+            correlation_id=properties.correlation_id,
+            headers={"schema_version": version}
+        ),
+        body=schema_body
+    )
+    logger.info("Metadatos de '%s' enviados (versión %s)", datasource_id, version)
+    ch.basic_ack(delivery_tag=method.delivery_tag)
 
 def handle_metadata_update(ch, method, properties, body):
     credentials = json.loads(body)
     try:
         schema = get_db_schema(credentials)
         if schema:
-            store_schema(schema)
+            store_schema(schema, credentials.get("datasource_id") or DEFAULT_DATASOURCE_ID)
             ch.basic_ack(delivery_tag=method.delivery_tag)
         else:
             raise ValueError("Error al actualizar los metadatos")
@@ -68,28 +165,53 @@ def handle_metadata_update(ch, method, properties, body):
         logger.error(f"Error al actualizar los metadatos: {e}")
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
+def introspect_local_schema():
+    # PostgreSQL puede aceptar conexiones antes de terminar los scripts de db-init
+    schema = get_db_schema(LOCAL_DB_CREDENTIALS)
+    if not schema:
+        raise RuntimeError("esquema vacío o base de datos no disponible")
+    return schema
+
+def warm_start():
+    """Serialize the stored schemas so the first requests are served from memory."""
+    for metadata in metadata_collection.find({}, {'datasource_id': True}).limit(DATASOURCE_CACHE_SIZE):
+        serialized_schema(metadata['datasource_id'])
+
 def initialize_metadata():
-    if metadata_collection.count_documents({}) == 0:
+    wait_for("MongoDB", lambda: mongo_client.admin.command("ping"))
+    ensure_indexes()
+    if metadata_collection.count_documents({"datasource_id": DEFAULT_DATASOURCE_ID}) == 0:
         logger.info("La colección de metadatos está vacía. Obteniendo metadatos iniciales...")
-        schema = get_db_schema(LOCAL_DB_CREDENTIALS)
-        if schema:
-            store_schema(schema)
-        else:
-            logger.error("Error al obtener el esquema de la base de datos local")
+        try:
+            store_schema(wait_for("la base de datos local", introspect_local_schema))
+        except TimeoutError as e:
+            logger.error(f"Error al obtener el esquema de la base de datos local: {e}")
+    else:
+        # Arranque en caliente: se sirve la última versión guardada sin volver a
+        # inspeccionar la base de datos (se actualiza con metadata_update_queue)
+        logger.info("Usando los esquemas guardados en MongoDB")
+    warm_start()
+    readiness.add_check(
+        "schema", lambda: metadata_collection.count_documents({"datasource_id": DEFAULT_DATASOURCE_ID}, limit=1) > 0
+    )
 
 def main():
-    time.sleep(25)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
     initialize_metadata()
     
     connection = get_rabbitmq_connection(RABBITMQ_HOST)
     channel = connection.channel()
-    channel.queue_declare(queue='metadata_request_queue')
-    channel.queue_declare(queue='metadata_update_queue')
+    declare_queue(channel, 'metadata_request_queue')
+    declare_queue(channel, 'metadata_update_queue')
+    # Las actualizaciones que fallan (nack) quedan en la DLQ para revisarlas
+    channel.queue_declare(queue='metadata_update_queue' + DEAD_LETTER_SUFFIX)
 
     channel.basic_consume(queue='metadata_request_queue', on_message_callback=handle_metadata_request, auto_ack=False)
     channel.basic_consume(queue='metadata_update_queue', on_message_callback=handle_metadata_update, auto_ack=False)
 
     logger.info("Esperando mensajes en las colas 'metadata_request_queue' y 'metadata_update_queue'...")
+    readiness.set("rabbitmq")
     channel.start_consuming()
 
 if __name__ == "__main__":
@@ -1,20 +1,34 @@
+import json
+import time
+import hashlib
+import sqlite3
 import psycopg2
 import mysql.connector
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
-def execute_schema_queries(conn, queries):
+def run_schema_query(connect, query):
+    conn = connect()
     try:
         cur = conn.cursor()
-
-        results = {}
-        for query_name, query in queries.items():
-            cur.execute(query)
-            results[query_name] = cur.fetchall()
-
+        cur.execute(query)
+        rows = cur.fetchall()
         cur.close()
+        return rows
+    finally:
         conn.close()
+
+def execute_schema_queries(connect, queries):
+    # Cada consulta del catálogo va en su propia conexión y todas a la vez: el
+    # tiempo total es el de la más lenta en lugar de la suma
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix="schema") as executor:
+            futures = {name: executor.submit(run_schema_query, connect, query) for name, query in queries.items()}
+            results = {name: future.result() for name, future in futures.items()}
+        logger.info("Consultas de esquema ejecutadas en %.2f s", time.perf_counter() - start)
         return results
     except Exception as e:
         logger.error(f"Error ejecutando consultas de esquema: {e}")
@@ -31,8 +45,10 @@ def format_schema(columns, primary_keys, foreign_keys):
             }
         schema[table_name]["columns"].append({"column_name": column_name, "data_type": data_type})
 
+    seen_primary_keys = set()
     for table_name, column_name in primary_keys:
-        if table_name in schema and column_name not in schema[table_name]["primary_keys"]:
+        if table_name in schema and (table_name, column_name) not in seen_primary_keys:
+            seen_primary_keys.add((table_name, column_name))
             schema[table_name]["primary_keys"].append(column_name)
 
     for table_name, column_name, foreign_table_name, foreign_column_name in foreign_keys:
@@ -45,40 +61,49 @@ def format_schema(columns, primary_keys, foreign_keys):
 
     return schema
 
+def table_fingerprint(details):
+    """Hash of a table's columns and keys, used to detect which tables changed."""
+    return hashlib.sha256(json.dumps(details, sort_keys=True).encode()).hexdigest()
 
-# Queries específicas para PostgreSQL
+
+# Queries específicas para PostgreSQL: pg_catalog en lugar de information_schema,
+# cuyas vistas comprueban privilegios fila a fila y son mucho más lentas con
+# miles de tablas. format_type(oid, NULL) da los mismos nombres que
+# information_schema.columns.data_type ("integer", "character varying"...).
 def get_postgresql_queries():
     return {
-        "columns": f"""
-        SELECT table_name, column_name, data_type 
-        FROM information_schema.columns 
-        WHERE table_schema = 'public'
+        "columns": """
+        SELECT c.relname, a.attname, pg_catalog.format_type(a.atttypid, NULL)
+        FROM pg_catalog.pg_attribute AS a
+            JOIN pg_catalog.pg_class AS c ON c.oid = a.attrelid
+            JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public'
+            AND c.relkind IN ('r', 'v', 'm', 'f', 'p')
+            AND a.attnum > 0
+            AND NOT a.attisdropped
+        ORDER BY c.relname, a.attnum
         """,
-        "primary_keys": f"""
-        SELECT
-            tc.table_name, 
-            kcu.column_name
-        FROM 
-            information_schema.table_constraints AS tc 
-            JOIN information_schema.key_column_usage AS kcu
-              ON tc.constraint_name = kcu.constraint_name
-              AND tc.table_schema = kcu.table_schema
-        WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_schema = 'public'
+        "primary_keys": """
+        SELECT c.relname, a.attname
+        FROM pg_catalog.pg_constraint AS con
+            JOIN pg_catalog.pg_class AS c ON c.oid = con.conrelid
+            JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+            CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_catalog.pg_attribute AS a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+        WHERE con.contype = 'p' AND n.nspname = 'public'
+        ORDER BY c.relname, k.ord
         """,
-        "foreign_keys": f"""
-        SELECT
-            tc.table_name, 
-            kcu.column_name,
-            ccu.table_name AS foreign_table_name,
-            ccu.column_name AS foreign_column_name 
-        FROM 
-            information_schema.table_constraints AS tc 
-            JOIN information_schema.key_column_usage AS kcu
-              ON tc.constraint_name = kcu.constraint_name
-              AND tc.table_schema = kcu.table_schema
-            JOIN information_schema.constraint_column_usage AS ccu
-              ON ccu.constraint_name = tc.constraint_name
-        WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = 'public'
+        "foreign_keys": """
+        SELECT c.relname, a.attname, fc.relname, fa.attname
+        FROM pg_catalog.pg_constraint AS con
+            JOIN pg_catalog.pg_class AS c ON c.oid = con.conrelid
+            JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+            JOIN pg_catalog.pg_class AS fc ON fc.oid = con.confrelid
+            CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, fattnum, ord)
+            JOIN pg_catalog.pg_attribute AS a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+            JOIN pg_catalog.pg_attribute AS fa ON fa.attrelid = con.confrelid AND fa.attnum = k.fattnum
+        WHERE con.contype = 'f' AND n.nspname = 'public'
+        ORDER BY c.relname, con.conname, k.ord
         """
     }
 
@@ -116,16 +141,42 @@ def get_mysql_queries():
         """
     }
 
+# Queries para SQLite (modo embebido y pruebas sin servidor de base de datos). Los
+# nombres se pasan a minúsculas, como los que PostgreSQL da a los identificadores
+# sin comillas de db-init/init.sql, para que el esquema sea el mismo en ambos
+def get_sqlite_queries():
+    return {
+        "columns": """
+        SELECT lower(m.name), lower(p.name), lower(p.type)
+        FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+        WHERE m.type IN ('table', 'view') AND m.name NOT LIKE 'sqlite_%'
+        ORDER BY m.name, p.cid
+        """,
+        "primary_keys": """
+        SELECT lower(m.name), lower(p.name)
+        FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+        WHERE m.type = 'table' AND p.pk > 0
+        ORDER BY m.name, p.pk
+        """,
+        "foreign_keys": """
+        SELECT lower(m.name), lower(f."from"), lower(f."table"), lower(f."to")
+        FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f
+        WHERE m.type = 'table'
+        ORDER BY m.name, f.id, f.seq
+        """
+    }
+
 def get_postgresql_schema(credentials):
     try:
-        conn = psycopg2.connect(
-            host=credentials['db_host'],
-            user=credentials['db_user'],
-            password=credentials['db_password'],
-            dbname=credentials['db_name']
-        )
+        def connect():
+            return psycopg2.connect(
+                host=credentials['db_host'],
+                user=credentials['db_user'],
+                password=credentials['db_password'],
+                dbname=credentials['db_name']
+            )
         queries = get_postgresql_queries()
-        results = execute_schema_queries(conn, queries)
+        results = execute_schema_queries(connect, queries)
         if results:
             return format_schema(results['columns'], results['primary_keys'], results['foreign_keys'])
         else:
@@ -136,14 +187,15 @@ def get_postgresql_schema(credentials):
 
 def get_mysql_schema(credentials):
     try:
-        conn = mysql.connector.connect(
-            host=credentials['db_host'],
-            user=credentials['db_user'],
-            password=credentials['db_password'],
-            database=credentials['db_name']
-        )
+        def connect():
+            return mysql.connector.connect(
+                host=credentials['db_host'],
+                user=credentials['db_user'],
+                password=credentials['db_password'],
+                database=credentials['db_name']
+            )
         queries = get_mysql_queries()
-        results = execute_schema_queries(conn, queries)
+        results = execute_schema_queries(connect, queries)
         if results:
             return format_schema(results['columns'], results['primary_keys'], results['foreign_keys'])
         else:
@@ -152,12 +204,26 @@ def get_mysql_schema(credentials):
         logger.error(f"Error al obtener el esquema de MySQL: {e}")
         return None
 
+def get_sqlite_schema(credentials):
+    try:
+        # db_name es la ruta del fichero de la base de datos
+        results = execute_schema_queries(lambda: sqlite3.connect(credentials['db_name']), get_sqlite_queries())
+        if results:
+            return format_schema(results['columns'], results['primary_keys'], results['foreign_keys'])
+        else:
+            return None
+    except Exception as e:
+        logger.error(f"Error al obtener el esquema de SQLite: {e}")
+        return None
+
 def get_db_schema(credentials):
     db_type = credentials.get("db_type", "postgresql")
     if db_type == "postgresql":
         return get_postgresql_schema(credentials)
     elif db_type == "mysql":
         return get_mysql_schema(credentials)
+    elif db_type == "sqlite":
+        return get_sqlite_schema(credentials)
     # Agrega más condiciones según el tipo de base de datos
     else:
         logger.error(f"Tipo de base de datos no soportado: {db_type}")
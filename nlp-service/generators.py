@@ -0,0 +1,199 @@
+import re
+import abc
+import time
+import logging
+from collections import namedtuple
+from common.metrics import registry
+from schema_prompt import tokenize
+from rate_limit import RateLimitGate, retry_after
+
+logger = logging.getLogger(__name__)
+
+GenerationResult = namedtuple("GenerationResult", ["sql", "backend", "latency", "prompt_tokens", "completion_tokens"])
+
+NUMERIC_TYPES = ("int", "numeric", "decimal", "real", "double", "float", "money")
+
+
+def statement_end(text):
+    """Index just past the ``;`` that ends the first statement of ``text``, or ``None``."""
+    quote = None
+    for i, char in enumerate(text):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == ";":
+            return i + 1
+    return None
+
+
+class SQLGenerator(abc.ABC):
+    """Turns a prompt (plus the question and its ``SchemaPrompt``) into SQL.
+
+    Subclasses implement ``_generate``; latency and token counts are recorded
+    per backend. ``OpenAIGenerator`` streams the completion and stops reading
+    at the end of the first statement.
+    """
+
+    name = "base"
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.latency = registry.histogram(f"nlp_{self.name}_generation_seconds", f"Latency of {self.name} SQL generations")
+        self.prompt_tokens = registry.counter(f"nlp_{self.name}_prompt_tokens_total", f"Prompt tokens sent to {self.name}")
+        self.completion_tokens = registry.counter(f"nlp_{self.name}_completion_tokens_total", f"Completion tokens produced by {self.name}")
+
+    @abc.abstractmethod
+    def _generate(self, question, prompt, schema_prompt):
+        """``(sql, prompt_tokens, completion_tokens)`` for one question."""
+
+    def _record(self, start, sql, prompt_tokens, completion_tokens):
+        latency = time.perf_counter() - start
+        self.latency.observe(latency)
+        self.prompt_tokens.inc(prompt_tokens)
+        self.completion_tokens.inc(completion_tokens)
+        return GenerationResult(sql, self.name, latency, prompt_tokens, completion_tokens)
+
+    def generate(self, question, prompt, schema_prompt):
+        start = time.perf_counter()
+        sql, prompt_tokens, completion_tokens = self._generate(question, prompt, schema_prompt)
+        return self._record(start, sql, prompt_tokens, completion_tokens)
+
+
+class OpenAIGenerator(SQLGenerator):
+    name = "openai"
+
+    def __init__(self, api_key=None, model="gpt-3.5-turbo", max_tokens=512, timeout=30, max_retries=5, retry_delay=1,
+                 stream=True):
+        super().__init__(timeout)
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+        self.stream = stream
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.rate_limit_gate = RateLimitGate()
+        self._client = None
+
+    @property
+    def client(self):
+        # Creación diferida: el resto de backends no necesitan clave de OpenAI
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key, timeout=self.timeout)
+        return self._client
+
+    def _create(self, prompt, **kwargs):
+        from openai import RateLimitError
+        for attempt in range(self.max_retries):
+            self.rate_limit_gate.wait()
+            try:
+                return self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "user", "content": prompt},
+                    ],
+                    max_tokens=self.max_tokens,
+                    **kwargs
+                )
+            except RateLimitError as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                self.rate_limit_gate.backoff(retry_after(e, self.retry_delay * 2 ** attempt))
+
+    def _generate(self, question, prompt, schema_prompt):
+        if self.stream:
+            return self._generate_streaming(prompt)
+        completion = self._create(prompt)
+        usage = completion.usage
+        sql = completion.choices[0].message.content
+        if completion.choices[0].finish_reason == "length":
+            logger.warning(f"La consulta SQL generada se ha truncado en {self.max_tokens} tokens")
+        return sql, getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0)
+
+    def _generate_streaming(self, prompt):
+        # Los tokens se leen según llegan y se deja de leer al terminar la primera
+        # sentencia: no se espera al texto que el modelo añada detrás (explicaciones,
+        # otra consulta) y la validación recibe una única sentencia
+        response = self._create(prompt, stream=True, stream_options={"include_usage": True})
+        sql, usage, finish_reason = "", None, None
+        try:
+            for chunk in response:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                sql += chunk.choices[0].delta.content or ""
+                end = statement_end(sql)
+                if end is not None:
+                    sql = sql[:end]
+                    break
+        finally:
+            response.close()
+        if finish_reason == "length":
+            logger.warning(f"La consulta SQL generada se ha truncado en {self.max_tokens} tokens")
+        if usage is None:
+            # Cortada antes del final, la API no informa del uso: se estima por palabras
+            return sql, len(prompt.split()), len(sql.split())
+        return sql, usage.prompt_tokens, usage.completion_tokens
+
+
+class TemplateGenerator(SQLGenerator):
+    """Deterministic, offline stand-in for the LLM.
+
+    Picks the most relevant table for the question and fills a handful of
+    templates (count, average, sum, plain listing). The SQL is not meant to be
+    clever, only reproducible, so the pipeline can be load-tested without
+    network access.
+    """
+
+    name = "template"
+
+    COUNT_WORDS = {"cuanto", "cuanta", "numero", "count", "many", "total"}
+    AVG_WORDS = {"media", "medio", "promedio", "average", "avg"}
+    SUM_WORDS = {"suma", "sum", "ingreso", "recaudacion", "revenue"}
+
+    def _numeric_column(self, question, details):
+        tokens = tokenize(question)
+        # Las claves (id_*) no tienen sentido en un AVG/SUM
+        numeric = [
+            col['column_name'] for col in details['columns']
+            if col['data_type'].lower().startswith(NUMERIC_TYPES) and not re.match(r"id_|.*_id$", col['column_name'])
+        ]
+        for column in numeric:
+            if tokenize(column) & tokens:
+                return column
+        return numeric[0] if numeric else None
+
+    def _generate(self, question, prompt, schema_prompt):
+        ranked = schema_prompt.rank_tables(question) or sorted(schema_prompt.tables)
+        if not ranked:
+            raise ValueError("El esquema no contiene tablas")
+        table = ranked[0]
+        details = schema_prompt.schema[table]
+        tokens = tokenize(question)
+
+        sql = f"SELECT * FROM {table} LIMIT 10;"
+        if tokens & self.COUNT_WORDS:
+            sql = f"SELECT COUNT(*) FROM {table};"
+        elif tokens & (self.AVG_WORDS | self.SUM_WORDS):
+            column = self._numeric_column(question, details)
+            if column:
+                function = "AVG" if tokens & self.AVG_WORDS else "SUM"
+                sql = f"SELECT {function}({column}) FROM {table};"
+        return sql, len(prompt.split()), len(sql.split())
+
+
+GENERATORS = {
+    OpenAIGenerator.name: OpenAIGenerator,
+    TemplateGenerator.name: TemplateGenerator,
+}
+
+
+def get_generator(name, **kwargs):
+    try:
+        cls = GENERATORS[name]
+    except KeyError:
+        raise ValueError(f"Generador de SQL no soportado: {name}")
+    return cls(**kwargs)
@@ -1,10 +1,20 @@
 import json
 import os
+import sys
+import signal
 import logging
-import pika
-import uuid
-from openai import OpenAI
-from common.utils import get_rabbitmq_connection
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from common.publisher import propagate_properties, publish_error
+from common.transport import get_transport
+from common.events import start_event_listener, SCHEMA_EVENTS_EXCHANGE, SQL_EVENTS_EXCHANGE
+from common.metrics import registry, start_metrics_server
+from common.tracing import traced
+from common.schema_cache import SchemaCache
+from common.metadata import request_metadata
+from common.datasources import DEFAULT_DATASOURCE_ID, LRUCache, get_datasource_id
+from schema_prompt import get_schema_prompt
+from sql_cache import SQLCache
+from generators import get_generator
 
 # Configurar el registro
 logging.basicConfig(level=logging.INFO)
@@ -12,56 +22,98 @@ logger = logging.getLogger(__name__)
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-# Configurar la clave de API de OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-def request_metadata():
-    connection = get_rabbitmq_connection(RABBITMQ_HOST)
-    channel = connection.channel()
-    result = channel.queue_declare(queue='', exclusive=True)
-    callback_queue = result.method.queue
-
-    corr_id = str(uuid.uuid4())
-    channel.basic_publish(
-        exchange='',
-        routing_key='metadata_request_queue',
-        properties=pika.BasicProperties(
-            reply_to=callback_queue,
-            correlation_id=corr_id,
-        ),
-        body=json.dumps({})
+# Segundos que se reutiliza el esquema en memoria si no llega ningún evento de cambio
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "600"))
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Número máximo de tablas relevantes que se envían al LLM (0 = esquema completo)
+SCHEMA_MAX_TABLES = int(os.getenv("SCHEMA_MAX_TABLES", "8"))
+
+prompt_schema_chars = registry.histogram(
+    "nlp_prompt_schema_chars", "Characters of schema text sent to the LLM",
+    buckets=(500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+)
+prompt_schema_ratio = registry.histogram(
+    "nlp_prompt_schema_ratio", "Fraction of the full schema text sent to the LLM",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+)
+
+# Número de generaciones simultáneas (cada una espera segundos al LLM)
+NLP_CONCURRENCY = int(os.getenv("NLP_CONCURRENCY", "1"))
+# Llamadas simultáneas al LLM para las preguntas de un mismo lote (POST /query/batch)
+NLP_BATCH_CONCURRENCY = int(os.getenv("NLP_BATCH_CONCURRENCY", "8"))
+# Cabecera con los request ids de un lote ya enviados a validación: el reintento
+# de un lote que falló a medias solo repite las preguntas que faltan
+BATCH_ANSWERED_HEADER = "x-batch-answered"
+
+# Backend de generación de SQL: "openai" o "template" (determinista, sin red)
+SQL_GENERATOR = os.getenv("SQL_GENERATOR", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "512"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_DELAY = float(os.getenv("LLM_RETRY_DELAY", "1"))
+# Leer la respuesta del LLM en streaming y cortarla al terminar la primera sentencia
+LLM_STREAM = os.getenv("LLM_STREAM", "true").lower() == "true"
+
+if SQL_GENERATOR == "openai":
+    generator = get_generator(
+        SQL_GENERATOR,
+        api_key=OPENAI_API_KEY,
+        model=LLM_MODEL,
+        max_tokens=LLM_MAX_TOKENS,
+        timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+        retry_delay=LLM_RETRY_DELAY,
+        stream=LLM_STREAM
+    )
+else:
+    generator = get_generator(SQL_GENERATOR, timeout=LLM_TIMEOUT)
+
+# Caché de SQL generado por pregunta normalizada y versión del esquema
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "1000"))
+SQL_CACHE_SIMILARITY = float(os.getenv("SQL_CACHE_SIMILARITY", "0.9"))
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH")
+# Segundos entre volcados de la caché de SQL a SQL_CACHE_PATH (también se vuelca al salir)
+SQL_CACHE_SAVE_INTERVAL = float(os.getenv("SQL_CACHE_SAVE_INTERVAL", "30"))
+
+# El esquema casi nunca cambia: se guarda en memoria (uno por fuente de datos, las
+# menos usadas se descartan) y solo se vuelve a pedir al servicio de metadatos
+# cuando caduca o llega un evento de cambio de esquema
+schema_caches = LRUCache()
+
+def get_schema_cache(datasource_id):
+    return schema_caches.get_or_create(
+        datasource_id,
+        lambda datasource_id: SchemaCache(lambda: request_metadata(RABBITMQ_HOST, datasource_id), ttl=SCHEMA_CACHE_TTL)
     )
 
-    logger.info("Solicitud de metadatos enviada, esperando respuesta...")
-
-    for method_frame, properties, body in channel.consume(callback_queue, inactivity_timeout=10):
-        if properties.correlation_id == corr_id:
-            channel.basic_ack(delivery_tag=method_frame.delivery_tag)
-            channel.queue_delete(callback_queue)
-            connection.close()
-            logger.info("Metadatos recibidos correctamente")
-            return json.loads(body)
-    else:
-        logger.error("No se recibió respuesta en el tiempo esperado")
-        channel.queue_delete(callback_queue)
-        connection.close()
-        return None
-
-def generate_sql(query, schema):
-    schema_str = "Schema:\n"
-    for table, details in schema.items():
-        if "columns" not in details:
-            logger.error(f"Missing 'columns' in table {table}")
-            continue
-        schema_str += f"Table {table}: "
-        schema_str += ", ".join([f"{col['column_name']} ({col['data_type']})" for col in details['columns']])
-        schema_str += "\n"
-        schema_str += f"Primary Keys: {', '.join(details['primary_keys'])}\n"
-        if details['foreign_keys']:
-            schema_str += "Foreign Keys:\n"
-            for fk in details['foreign_keys']:
-                schema_str += f" - {fk['column_name']} references {fk['foreign_table_name']}({fk['foreign_column_name']})\n"
+sql_cache = SQLCache(
+    max_entries=SQL_CACHE_SIZE, threshold=SQL_CACHE_SIMILARITY, path=SQL_CACHE_PATH,
+    save_interval=SQL_CACHE_SAVE_INTERVAL
+)
+
+def on_schema_event(event):
+    if event.get("event") == "schema_changed":
+        datasource_id = event.get("datasource_id") or DEFAULT_DATASOURCE_ID
+        schema_cache = schema_caches.get(datasource_id)
+        if schema_cache is not None:
+            schema_cache.invalidate(event.get("version"))
+        keep_version = f"{datasource_id}:{event['version']}" if event.get("version") is not None else None
+        sql_cache.invalidate(keep_version=keep_version, prefix=f"{datasource_id}:")
+
+def on_sql_event(event):
+    # El SQL se guarda en caché antes de validarse: el que se rechaza deja de servirse
+    if event.get("event") == "sql_rejected":
+        datasource_id = event.get("datasource_id") or DEFAULT_DATASOURCE_ID
+        if sql_cache.discard(event.get("sql_query"), prefix=f"{datasource_id}:"):
+            logger.info(f"Consulta SQL rechazada eliminada de la caché: {event.get('sql_query')}")
+
+def generate_sql(query, schema, schema_version=None):
+    schema_prompt = get_schema_prompt(schema, schema_version)
+    schema_str = schema_prompt.render(query, SCHEMA_MAX_TABLES)
+    prompt_schema_chars.observe(len(schema_str))
+    prompt_schema_ratio.observe(len(schema_str) / max(len(schema_prompt.full_text), 1))
+    logger.info("Esquema enviado al LLM: %d de %d caracteres", len(schema_str), len(schema_prompt.full_text))
 
     prompt = f"""
     You are an SQL expert. Based on the given database schema, generate an SQL query for the following natural language request.
@@ -76,46 +128,127 @@ def generate_sql(query, schema):
     """
 
     try:
-        logger.info("Prompt para GPT-3: %s", prompt)
-        completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # Utiliza el motor adecuado (GPT-3.5, GPT-4, etc.)
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=150
+        logger.debug("Prompt para %s: %s", generator.name, prompt)
+        result = generator.generate(query, prompt, schema_prompt)
+        logger.info(
+            f"Consulta SQL generada correctamente con {result.backend} en {result.latency:.2f} s "
+            f"({result.prompt_tokens} + {result.completion_tokens} tokens): {result.sql}"
         )
-        sql_query = completion.choices[0].message.content
-        logger.info(f"Consulta SQL generada correctamente: {sql_query}")
-        return {"sql_query": sql_query}
+        return {"sql_query": result.sql}
     except Exception as e:
         logger.error(f"Error generando consulta SQL: {e}")
         raise e
 
+def answer(query, schema, schema_version):
+    """``{"sql_query": ...}`` for ``query``, from the SQL cache or the LLM
+    (always the LLM when the schema has no version)."""
+    if schema_version is None:
+        return generate_sql(query, schema)
+    cached_sql = sql_cache.get(query, schema_version)
+    if cached_sql is not None:
+        logger.info(f"Consulta SQL obtenida de la caché: {cached_sql}")
+        return {"sql_query": cached_sql}
+    sql_query = generate_sql(query, schema, schema_version)
+    sql_cache.put(query, schema_version, sql_query["sql_query"])
+    return sql_query
+
+def forward(sql_query, properties):
+    get_transport(RABBITMQ_HOST).publish(
+        'validation_queue',
+        json.dumps({"sql_query": sql_query}),
+        properties=properties
+    )
+    logger.info(f"Query sent to Validation Service: {sql_query}")
+
+def item_properties(properties, request_id):
+    # Cada pregunta de un lote sigue la tubería con su propio request id
+    item = propagate_properties(properties)
+    item.correlation_id = request_id
+    return item
+
+def answer_batch(items, properties, schema, schema_version):
+    """Answer the questions of a batch concurrently, forwarding each one to
+    validation as soon as its SQL is ready.
+
+    The request ids already answered are recorded in ``properties`` under
+    ``BATCH_ANSWERED_HEADER``, which the consumer keeps when it retries the
+    message: if publishing one item fails, the others are still sent and the
+    retry only answers the missing ones.
+    """
+    headers = properties.headers = dict(properties.headers or {})
+    answered = headers[BATCH_ANSWERED_HEADER] = list(headers.get(BATCH_ANSWERED_HEADER) or [])
+    pending = [item for item in items if item["request_id"] not in answered]
+    if len(pending) < len(items):
+        logger.info(f"Reintento de lote: {len(items) - len(pending)} de {len(items)} preguntas ya enviadas")
+    failure = None
+    with ThreadPoolExecutor(max_workers=NLP_BATCH_CONCURRENCY) as executor:
+        futures = {executor.submit(answer, item.get("query"), schema, schema_version): item for item in pending}
+        # Se publica desde este hilo: la traza de la etapa es local a él
+        for future in as_completed(futures):
+            request_id = futures[future]["request_id"]
+            item_props = item_properties(properties, request_id)
+            try:
+                sql_query = future.result()
+            except Exception as e:
+                publish_error(RABBITMQ_HOST, item_props, f"Error generando consulta SQL: {e}")
+            else:
+                try:
+                    forward(sql_query, item_props)
+                except Exception as e:
+                    # Se reintenta el lote al final, sin las preguntas ya enviadas
+                    failure = failure or e
+                    continue
+            answered.append(request_id)
+    if failure is not None:
+        raise failure
+
+@traced("nlp")
 def callback(ch, method, properties, body):
     data = json.loads(body)
-    query = data.get("query")
+    # Lote de POST /query/batch: [{"request_id", "query"}, ...]
+    batch = data.get("batch")
+    datasource_id = get_datasource_id(properties)
 
-    schema = request_metadata()
+    # Un lote comparte una única lectura del esquema
+    schema_cache = get_schema_cache(datasource_id)
+    schema = schema_cache.get()
     if schema is None:
         logger.error("No se pudo obtener el esquema de la base de datos")
+        targets = [item_properties(properties, item["request_id"]) for item in batch] if batch else [properties]
+        for target in targets:
+            publish_error(RABBITMQ_HOST, target, "No se pudo obtener el esquema de la base de datos")
         return
 
-    sql_query = generate_sql(query, schema)
+    # Versión con espacio de nombres por fuente de datos: las versiones de fuentes
+    # distintas no se confunden en la caché de SQL ni en la de prompts. Sin versión
+    # no se puede saber si el esquema ha cambiado y no se usa ninguna de las dos
+    schema_version = f"{datasource_id}:{schema_cache.version}" if schema_cache.version is not None else None
+    if batch:
+        answer_batch(batch, properties, schema, schema_version)
+        return
 
-    connection = get_rabbitmq_connection(RABBITMQ_HOST)
-    channel = connection.channel()
-    channel.queue_declare(queue='validation_queue')
-    channel.basic_publish(exchange='', routing_key='validation_queue', body=json.dumps({"sql_query": sql_query}))
-    logger.info(f"Query sent to Validation Service: {sql_query}")
-    connection.close()
+    try:
+        sql_query = answer(data.get("query"), schema, schema_version)
+    except Exception as e:
+        publish_error(RABBITMQ_HOST, properties, f"Error generando consulta SQL: {e}")
+        return
+    forward(sql_query, propagate_properties(properties))
+
+def setup():
+    # Lo necesario en cada proceso que consume nlp_queue (también los de common.supervisor)
+    start_event_listener(RABBITMQ_HOST, SCHEMA_EVENTS_EXCHANGE, on_schema_event)
+    start_event_listener(RABBITMQ_HOST, SQL_EVENTS_EXCHANGE, on_sql_event)
+    get_schema_cache(DEFAULT_DATASOURCE_ID).prefetch()
 
 def main():
-    connection = get_rabbitmq_connection(RABBITMQ_HOST)
-    channel = connection.channel()
-    channel.queue_declare(queue='nlp_queue')
-    channel.basic_consume(queue='nlp_queue', on_message_callback=callback, auto_ack=True)
-    logger.info("Waiting for messages...")
-    channel.start_consuming()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    setup()
+    # docker stop manda SIGTERM: salir con sys.exit deja que atexit vuelque la caché de SQL
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Cada mensaje se confirma solo después de publicarse en validation_queue
+    get_transport(RABBITMQ_HOST).consume('nlp_queue', callback, concurrency=NLP_CONCURRENCY)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,43 @@
+import time
+import threading
+import logging
+from common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+throttled = registry.counter("nlp_llm_rate_limited_total", "LLM calls rejected by the backend rate limit")
+
+
+class RateLimitGate:
+    """Shared pause for every LLM call of the process.
+
+    When one generation is rate-limited all worker threads hold off until the
+    backend's retry delay has passed, instead of each of them hammering the API.
+    While the workers wait no message is acked, so the bounded prefetch stops
+    RabbitMQ from delivering more work.
+    """
+
+    def __init__(self):
+        self._resume_at = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, delay):
+        throttled.inc()
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        logger.warning(f"LLM rate limit reached, pausing generations for {delay:.1f} seconds")
+
+
+def retry_after(error, default):
+    """Delay requested by a rate-limit error (``Retry-After`` header) or ``default``."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", default))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,114 @@
+import re
+import unicodedata
+import logging
+from common.datasources import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Peso de una coincidencia con el nombre de la tabla frente a uno de sus columnas
+TABLE_NAME_WEIGHT = 3
+COLUMN_NAME_WEIGHT = 1
+
+
+def tokenize(text):
+    """Lowercase, accent-free word stems of ``text`` (``Categorías`` -> ``categoria``)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    tokens = set()
+    for word in re.split(r"[^a-z0-9]+", text):
+        if len(word) < 3:
+            continue
+        # Stemming mínimo para singular/plural en español e inglés
+        if len(word) > 4 and word.endswith("es"):
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        tokens.add(word)
+    return tokens
+
+
+def render_table(table, details):
+    lines = [
+        f"Table {table}: " + ", ".join(f"{col['column_name']} ({col['data_type']})" for col in details['columns']),
+        f"Primary Keys: {', '.join(details['primary_keys'])}",
+    ]
+    if details['foreign_keys']:
+        lines.append("Foreign Keys:")
+        lines.extend(
+            f" - {fk['column_name']} references {fk['foreign_table_name']}({fk['foreign_column_name']})"
+            for fk in details['foreign_keys']
+        )
+    return "\n".join(lines) + "\n"
+
+
+class SchemaPrompt:
+    """Prompt text and table-selection index built once per schema version."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.tables = {}
+        self.index = {}
+        self.neighbours = {}
+        for table, details in schema.items():
+            if "columns" not in details:
+                logger.error(f"Missing 'columns' in table {table}")
+                continue
+            self.tables[table] = render_table(table, details)
+            self.neighbours.setdefault(table, set())
+            for token in tokenize(table):
+                self.index.setdefault(token, {})[table] = TABLE_NAME_WEIGHT
+            for col in details['columns']:
+                for token in tokenize(col['column_name']):
+                    self.index.setdefault(token, {}).setdefault(table, COLUMN_NAME_WEIGHT)
+
+        # Las claves foráneas se recorren en ambos sentidos al ampliar la selección
+        for table, details in schema.items():
+            for fk in details.get('foreign_keys', []):
+                other = fk['foreign_table_name']
+                if table in self.tables and other in self.tables and other != table:
+                    self.neighbours[table].add(other)
+                    self.neighbours[other].add(table)
+
+        self.full_text = "Schema:\n" + "".join(self.tables.values())
+
+    def rank_tables(self, question):
+        """Tables mentioned by ``question``, most relevant first."""
+        scores = {}
+        for token in tokenize(question):
+            for table, weight in self.index.get(token, {}).items():
+                scores[table] = scores.get(table, 0) + weight
+        return sorted(scores, key=lambda table: (-scores[table], table))
+
+    def select_tables(self, question, max_tables):
+        ranked = self.rank_tables(question)[:max_tables]
+        if not ranked:
+            return None
+
+        selected = set(ranked)
+        for table in ranked:
+            selected.update(self.neighbours[table])
+        return sorted(selected)
+
+    def render(self, question, max_tables=None):
+        """Schema text for ``question``; the whole schema if nothing matches."""
+        if not max_tables:
+            return self.full_text
+        tables = self.select_tables(question, max_tables)
+        if tables is None or len(tables) == len(self.tables):
+            return self.full_text
+        return "Schema:\n" + "".join(self.tables[table] for table in tables)
+
+
+# Varias fuentes de datos se alternan: se guarda un SchemaPrompt por versión
+_prompts = LRUCache()
+
+
+def get_schema_prompt(schema, version=None):
+    """Return the ``SchemaPrompt`` for ``schema``, rebuilding it only when the schema changes.
+
+    Without a ``version`` nothing tells a changed schema apart, so the prompt
+    is built every time instead of cached.
+    """
+    if version is None:
+        return SchemaPrompt(schema)
+    return _prompts.get_or_create(version, lambda version: SchemaPrompt(schema))
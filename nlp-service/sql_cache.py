@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import atexit
+import threading
+import time
+import unicodedata
+import logging
+from collections import OrderedDict
+from common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+exact_hits = registry.counter("nlp_sql_cache_exact_hits_total", "Questions answered by an exact SQL cache match")
+similar_hits = registry.counter("nlp_sql_cache_similar_hits_total", "Questions answered by a near-duplicate SQL cache match")
+misses = registry.counter("nlp_sql_cache_misses_total", "Questions that required an LLM call")
+entries_gauge = registry.gauge("nlp_sql_cache_entries", "Entries held in the SQL cache")
+
+
+def normalize_question(question):
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def numbers(text):
+    # Dos preguntas que solo difieren en una cifra ("ventas de 2023" / "de 2024")
+    # son casi idénticas en n-gramas pero piden SQL distinto
+    return frozenset(re.findall(r"\d+", text))
+
+
+class SQLCache:
+    """Two-tier cache of generated SQL keyed by (normalized question, schema version).
+
+    Tier one is an exact-match LRU. Tier two finds near-duplicate questions by
+    character-trigram Jaccard similarity through an inverted index, accepting
+    matches at or above ``threshold``. Entries are persisted to ``path`` (JSON)
+    so a restart does not start cold: every ``save_interval`` seconds if they
+    changed, and on exit. The file is written outside the lock, so lookups
+    never wait on the disk.
+    """
+
+    def __init__(self, max_entries=1000, threshold=0.9, path=None, save_interval=30):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()
+        self._ngrams = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+        # Solo un volcado a la vez (el periódico y el de salida)
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        if path:
+            self._load()
+            threading.Thread(target=self._save_periodically, name="sql-cache-save", daemon=True).start()
+            atexit.register(self.save)
+
+    def _add(self, key, sql):
+        self._entries[key] = sql
+        self._entries.move_to_end(key)
+        grams = trigrams(key[0])
+        self._ngrams[key] = grams
+        for gram in grams:
+            self._postings.setdefault((key[1], gram), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+        entries_gauge.set(len(self._entries))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        for gram in self._ngrams.pop(key, ()):
+            keys = self._postings.get((key[1], gram))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[(key[1], gram)]
+        entries_gauge.set(len(self._entries))
+
+    def _most_similar(self, question, version):
+        grams = trigrams(question)
+        shared = {}
+        for gram in grams:
+            for key in self._postings.get((version, gram), ()):
+                shared[key] = shared.get(key, 0) + 1
+
+        best_key, best_score = None, 0.0
+        for key, common in shared.items():
+            score = common / (len(grams) + len(self._ngrams[key]) - common)
+            if score > best_score and numbers(key[0]) == numbers(question):
+                best_key, best_score = key, score
+        if best_score >= self.threshold:
+            return best_key
+        return None
+
+    def get(self, question, version):
+        normalized = normalize_question(question)
+        key = (normalized, version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                exact_hits.inc()
+                return self._entries[key]
+            if self.threshold < 1:
+                similar = self._most_similar(normalized, version)
+                if similar is not None:
+                    self._entries.move_to_end(similar)
+                    similar_hits.inc()
+                    logger.info("Pregunta similar encontrada en caché: '%s'", similar[0])
+                    return self._entries[similar]
+            misses.inc()
+            return None
+
+    def put(self, question, version, sql):
+        with self._lock:
+            self._add((normalize_question(question), version), sql)
+            self._dirty = True
+
+    def discard(self, sql, prefix=None):
+        """Drop every entry whose SQL is ``sql`` (e.g. rejected by validation);
+        returns how many. ``prefix`` limits it to versions starting with it."""
+        with self._lock:
+            keys = [
+                key for key, cached_sql in self._entries.items()
+                if cached_sql == sql and (prefix is None or str(key[1]).startswith(prefix))
+            ]
+            for key in keys:
+                self._remove(key)
+            if keys:
+                self._dirty = True
+            return len(keys)
+
+    def invalidate(self, keep_version=None, prefix=None):
+        """Drop every entry generated against a schema version other than ``keep_version``.
+
+        With ``prefix`` only versions starting with it are considered (versions
+        are namespaced per datasource as ``"<datasource_id>:<version>"``).
+        """
+        with self._lock:
+            for key in [
+                key for key in self._entries
+                if (keep_version is None or key[1] != keep_version)
+                and (prefix is None or str(key[1]).startswith(prefix))
+            ]:
+                self._remove(key)
+                self._dirty = True
+
+    def _save_periodically(self):
+        while True:
+            time.sleep(self.save_interval)
+            self.save()
+
+    def save(self):
+        """Write the entries to ``path`` if they changed since the last save."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = [[question, version, sql] for (question, version), sql in self._entries.items()]
+                self._dirty = False
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error(f"Error guardando la caché de SQL en {self.path}: {e}")
+                with self._lock:
+                    self._dirty = True
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                for question, version, sql in json.load(f):
+                    self._add((question, version), sql)
+            logger.info("Caché de SQL cargada desde %s (%d entradas)", self.path, len(self._entries))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Error cargando la caché de SQL desde {self.path}: {e}")
@@ -0,0 +1,36 @@
+from dispatch import ChunkSequencer
+
+
+def chunk(seq, final=False, preview=False):
+    payload = {"seq": seq, "final": final, "rows": [[seq]]}
+    if preview:
+        payload["preview"] = True
+    return payload
+
+
+def test_chunks_are_released_in_order():
+    sequencer = ChunkSequencer()
+    assert sequencer.accept("r", chunk(1, final=True)) == []
+    assert sequencer.accept("r", chunk(0)) == [chunk(0), chunk(1, final=True)]
+
+
+def test_preview_after_final_result_is_dropped():
+    sequencer = ChunkSequencer()
+    assert sequencer.accept("r", chunk(0, final=True)) == [chunk(0, final=True)]
+    assert sequencer.accept("r", chunk(0, final=True, preview=True)) == []
+    assert "r" not in sequencer._streams
+
+
+def test_finished_ids_are_bounded():
+    sequencer = ChunkSequencer(max_finished=2)
+    for request_id in ("a", "b", "c"):
+        sequencer.accept(request_id, chunk(0, final=True))
+    assert list(sequencer._finished) == ["b", "c"]
+
+
+def test_later_chunks_get_the_shape_of_the_first():
+    sequencer = ChunkSequencer()
+    first = {"seq": 0, "final": False, "type": "table", "shape": "timeseries"}
+    later = {"seq": 1, "final": True, "type": "table"}
+    assert sequencer.accept("r", later) == []
+    assert [c.get("shape") for c in sequencer.accept("r", first)] == ["timeseries", "timeseries"]
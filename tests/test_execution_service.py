@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+
+import psycopg2.errors
+import pytest
+
+import execution_service
+from cancellation import QueryCancelled
+
+CREDENTIALS = {"db_type": "postgresql"}
+
+
+class CancelledCursor:
+    """Server-side cursor whose first fetch is interrupted by the database."""
+
+    description = [("n",)]
+
+    def __init__(self, on_fetch):
+        self.on_fetch = on_fetch
+
+    def execute(self, *args):
+        pass
+
+    def fetchmany(self, size):
+        self.on_fetch()
+        raise psycopg2.errors.QueryCanceled("canceling statement due to user request")
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, on_fetch):
+        self.on_fetch = on_fetch
+        self.cancelled = False
+
+    def cursor(self, name=None):
+        return CancelledCursor(self.on_fetch)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @contextmanager
+    def connection(self, timeout=None):
+        yield self.conn
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    def install(on_fetch=lambda: None):
+        conn = FakeConnection(on_fetch)
+        monkeypatch.setattr(execution_service.pools, "get", lambda credentials: FakePool(conn))
+        return conn
+    return install
+
+
+def test_cancel_during_fetch_raises_query_cancelled(postgres):
+    conn = postgres(lambda: execution_service.running_queries.cancel("req-fetch"))
+    with pytest.raises(QueryCancelled):
+        list(execution_service.iter_query("SELECT 1", CREDENTIALS, request_id="req-fetch"))
+    assert conn.cancelled
+
+
+def test_statement_timeout_during_fetch_raises_timeout(postgres):
+    postgres()
+    with pytest.raises(TimeoutError):
+        list(execution_service.iter_query("SELECT 1", CREDENTIALS, request_id="req-timeout", timeout=1))
@@ -0,0 +1,15 @@
+from generators import statement_end
+
+
+def test_statement_ends_at_first_semicolon():
+    text = "SELECT COUNT(*) FROM usuarios;\nEsta consulta cuenta los usuarios."
+    assert text[:statement_end(text)] == "SELECT COUNT(*) FROM usuarios;"
+
+
+def test_semicolon_inside_string_literal_does_not_end_statement():
+    text = "SELECT 'a;b', \"c;d\" FROM t WHERE x = 'it''s;' ; SELECT 2;"
+    assert text[:statement_end(text)] == "SELECT 'a;b', \"c;d\" FROM t WHERE x = 'it''s;' ;"
+
+
+def test_incomplete_statement():
+    assert statement_end("SELECT * FROM eventos WHERE nombre = 'a;") is None
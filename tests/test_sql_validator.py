@@ -0,0 +1,25 @@
+import pytest
+
+from sql_validator import ASTCache, SchemaIndex, ValidationError, validate_sql
+
+SCHEMA = {
+    "eventos": {"columns": [{"column_name": "id"}, {"column_name": "nombre"}]},
+}
+
+
+def validate(sql):
+    return validate_sql(sql, ASTCache(), schema_index=SchemaIndex(SCHEMA))
+
+
+def test_known_tables_and_columns_pass():
+    assert validate("SELECT id, nombre FROM eventos")
+
+
+def test_unknown_outer_table_referenced_from_correlated_subquery():
+    with pytest.raises(ValidationError, match="zz"):
+        validate("SELECT (SELECT id FROM eventos WHERE eventos.id = z.id) FROM zz z")
+
+
+def test_unknown_column():
+    with pytest.raises(ValidationError, match="apellido"):
+        validate("SELECT apellido FROM eventos")
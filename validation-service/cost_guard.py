@@ -0,0 +1,150 @@
+import json
+import threading
+import logging
+from common.metrics import registry
+from sql_validator import ValidationError
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
+
+estimated_cost = registry.histogram(
+    "validation_estimated_cost", "Planner cost estimate of validated queries",
+    buckets=(10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+)
+estimated_rows = registry.histogram(
+    "validation_estimated_rows", "Largest planner row estimate of any plan node",
+    buckets=(10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+)
+
+# Claves del plan JSON con el número de filas estimado por nodo
+ROW_KEYS = ("Plan Rows", "rows_produced_per_join")
+
+
+def max_rows(node):
+    """Largest row estimate found anywhere in an EXPLAIN JSON plan."""
+    if isinstance(node, dict):
+        own = max((float(node[key]) for key in ROW_KEYS if key in node), default=0)
+        return max([own] + [max_rows(value) for value in node.values()])
+    if isinstance(node, list):
+        return max((max_rows(value) for value in node), default=0)
+    return 0
+
+
+def plan_estimate(plan, db_type):
+    """``(cost, rows)`` of an EXPLAIN FORMAT JSON plan."""
+    if db_type == "postgresql":
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return float(plan[0]["Plan"]["Total Cost"]), max_rows(plan)
+    plan = json.loads(plan)
+    return float(plan["query_block"]["cost_info"]["query_cost"]), max_rows(plan)
+
+
+class CostGuard:
+    """Rejects queries whose plan on the target database is too expensive.
+
+    Runs ``EXPLAIN`` (never ``ANALYZE``) with the credentials returned by
+    ``get_credentials`` over one connection kept open between queries. The cost
+    is the planner's total cost and the row estimate is the largest of any plan
+    node, so an exploding join is caught even below a ``LIMIT``. If the database
+    cannot be reached the query is let through: the execution service will
+    report the error anyway.
+    """
+
+    def __init__(self, get_credentials, max_cost=None, max_rows=None):
+        self.get_credentials = get_credentials
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self._conn = None
+        self._db_type = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.max_cost or self.max_rows)
+
+    def _connect(self):
+        credentials = self.get_credentials()
+        db_type = credentials.get("db_type", "postgresql")
+        if db_type == "postgresql" and psycopg2 is not None:
+            conn = psycopg2.connect(
+                host=credentials['db_host'],
+                user=credentials['db_user'],
+                password=credentials['db_password'],
+                dbname=credentials['db_name']
+            )
+            conn.autocommit = True
+        elif db_type == "mysql" and mysql is not None:
+            conn = mysql.connector.connect(
+                host=credentials['db_host'],
+                user=credentials['db_user'],
+                password=credentials['db_password'],
+                database=credentials['db_name']
+            )
+        else:
+            raise ValueError(f"EXPLAIN no disponible para {db_type}")
+        return conn, db_type
+
+    def reset(self):
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+            self._conn = None
+
+    def _alive(self):
+        if self._conn is None:
+            return False
+        if self._db_type == "postgresql":
+            return not self._conn.closed
+        return self._conn.is_connected()
+
+    def estimate(self, sql_query):
+        cur = self._conn.cursor()
+        try:
+            if self._db_type == "postgresql":
+                cur.execute(f"EXPLAIN (FORMAT JSON) {sql_query}")
+            else:
+                cur.execute(f"EXPLAIN FORMAT=JSON {sql_query}")
+            plan = cur.fetchone()[0]
+        finally:
+            cur.close()
+        return plan_estimate(plan, self._db_type)
+
+    def check(self, sql_query):
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                if not self._alive():
+                    self._conn, self._db_type = self._connect()
+            except Exception as e:
+                logger.warning(f"No se pudo conectar para estimar el coste, se omite la comprobación: {e}")
+                self._conn = None
+                return
+            try:
+                cost, rows = self.estimate(sql_query)
+            except Exception as e:
+                if not self._alive():
+                    logger.warning(f"Conexión perdida al estimar el coste, se omite la comprobación: {e}")
+                    self._conn = None
+                    return
+                raise ValidationError(f"El plan de la consulta no se pudo obtener: {e}")
+
+        estimated_cost.observe(cost)
+        estimated_rows.observe(rows)
+        if self.max_cost and cost > self.max_cost:
+            raise ValidationError(f"Coste estimado {cost:.0f} por encima del máximo {self.max_cost:.0f}")
+        if self.max_rows and rows > self.max_rows:
+            raise ValidationError(f"Filas estimadas {rows:.0f} por encima del máximo {self.max_rows:.0f}")
@@ -0,0 +1,173 @@
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.scope import traverse_scope
+from common.metrics import registry
+from common.datasources import LRUCache
+
+logger = logging.getLogger(__name__)
+
+ast_cache_hits = registry.counter("validation_ast_cache_hits_total", "SQL statements whose AST was reused")
+ast_cache_misses = registry.counter("validation_ast_cache_misses_total", "SQL statements that had to be parsed")
+
+# Sentencias que nunca pueden aparecer, ni siquiera dentro de un CTE
+FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop,
+    exp.Alter, exp.TruncateTable, exp.Command, exp.Into, exp.Lock,
+)
+# Las versiones de sqlglot que aún instalan en Python 3.8 no tienen exp.SetOperation
+SET_OPERATIONS = (exp.Union, exp.Intersect, exp.Except)
+# Funciones con efectos fuera de la consulta (esperas, acceso a ficheros, otras sesiones)
+FORBIDDEN_FUNCTIONS = {
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "pg_terminate_backend", "pg_cancel_backend",
+    "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "lo_import", "lo_export", "dblink",
+    "dblink_exec", "set_config", "sleep", "benchmark", "load_file", "get_lock",
+}
+
+
+class ValidationError(Exception):
+    """The generated SQL must not reach the execution service."""
+
+
+class ASTCache:
+    """Parsed statements memoized by the hash of their text (LRU)."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse(self, sql_query, dialect):
+        key = hashlib.sha256(f"{dialect}\n{sql_query}".encode()).hexdigest()
+        with self._lock:
+            tree = self._entries.get(key)
+            if tree is not None:
+                self._entries.move_to_end(key)
+                ast_cache_hits.inc()
+                # Quien valida modifica el árbol (LIMIT): se entrega una copia
+                return tree.copy()
+        ast_cache_misses.inc()
+        try:
+            statements = [s for s in sqlglot.parse(sql_query, read=dialect) if s is not None]
+        except SqlglotError as e:
+            raise ValidationError(f"SQL no válido: {e}")
+        if len(statements) != 1:
+            raise ValidationError(f"Se esperaba una única sentencia y hay {len(statements)}")
+        tree = statements[0]
+        with self._lock:
+            self._entries[key] = tree
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return tree.copy()
+
+
+class SchemaIndex:
+    """Lower-cased table -> column names of a metadata schema."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.tables = {
+            table.lower(): {col['column_name'].lower() for col in details.get('columns', [])}
+            for table, details in schema.items()
+        }
+
+
+# Un índice por versión de esquema (las versiones llevan la fuente de datos delante)
+_schema_indexes = LRUCache()
+
+
+def get_schema_index(schema, version=None):
+    """Index for ``schema``; rebuilt only when the schema (or its version) changes."""
+    key = version if version is not None else id(schema)
+    return _schema_indexes.get_or_create(key, lambda key: SchemaIndex(schema))
+
+
+def check_statement(tree):
+    if not isinstance(tree, (exp.Select,) + SET_OPERATIONS):
+        raise ValidationError(f"Solo se permiten consultas SELECT (recibido {tree.key.upper()})")
+    node = tree.find(*FORBIDDEN_NODES)
+    if node is not None:
+        raise ValidationError(f"Operación no permitida en la consulta: {node.key.upper()}")
+    for func in tree.find_all(exp.Func):
+        name = func.name if isinstance(func, exp.Anonymous) else func.sql_name()
+        if name.lower() in FORBIDDEN_FUNCTIONS:
+            raise ValidationError(f"Función no permitida: {name}")
+
+
+def scope_tables(scope):
+    """Selected sources of ``scope`` and its parents, innermost first: ``(name, table or None)``.
+
+    ``None`` stands for a derived table or CTE, whose columns are not checked.
+    """
+    while scope is not None:
+        for alias, (_, source) in scope.selected_sources.items():
+            if isinstance(source, exp.Table) and isinstance(source.this, exp.Identifier):
+                yield alias.lower(), source.name.lower()
+            else:
+                yield alias.lower(), None
+        scope = scope.parent
+
+
+def check_schema(tree, index):
+    """Every table must exist in the schema and every column in one of the tables in scope.
+
+    Checks are skipped where they cannot be decided (derived tables, CTEs), so a
+    query is only rejected for names that certainly do not exist.
+    """
+    try:
+        scopes = traverse_scope(tree)
+    except SqlglotError as e:
+        logger.warning(f"No se pudo analizar el ámbito de la consulta: {e}")
+        return
+
+    # Primero todas las tablas: una subconsulta correlacionada puede citar la
+    # tabla de un ámbito exterior que aún no se ha recorrido
+    for scope in scopes:
+        for _, (_, source) in scope.selected_sources.items():
+            if isinstance(source, exp.Table) and isinstance(source.this, exp.Identifier):
+                if source.name.lower() not in index.tables:
+                    raise ValidationError(f"La tabla {source.name} no existe en el esquema")
+
+    for scope in scopes:
+        if not isinstance(scope.expression, exp.Select):
+            continue
+        aliases = {e.alias.lower() for e in scope.expression.expressions if e.alias}
+        for column in scope.columns:
+            # Las columnas de subconsultas correlacionadas se comprueban en su propio ámbito
+            if column.find_ancestor(exp.Select) is not scope.expression or isinstance(column.this, exp.Star):
+                continue
+            name = column.name.lower()
+            sources = list(scope_tables(scope))
+            if column.table:
+                table = next((t for alias, t in sources if alias == column.table.lower()), None)
+                if table is not None and name not in index.tables[table]:
+                    raise ValidationError(f"La columna {column.table}.{column.name} no existe en la tabla {table}")
+            elif name not in aliases and all(t is not None for _, t in sources):
+                if not any(name in index.tables[t] for _, t in sources):
+                    raise ValidationError(f"La columna {column.name} no existe en las tablas consultadas")
+
+
+def cap_limit(tree, max_rows):
+    """Add ``LIMIT max_rows`` or lower an existing literal limit above it."""
+    limit = tree.args.get("limit")
+    if limit is None:
+        return tree.limit(max_rows, copy=False)
+    count = limit.args.get("count") if isinstance(limit, exp.Fetch) else limit.expression
+    if isinstance(count, exp.Literal) and count.is_int and int(count.this) <= max_rows:
+        return tree
+    return tree.limit(max_rows, copy=False)
+
+
+def validate_sql(sql_query, ast_cache, dialect="postgres", schema_index=None, max_rows=None):
+    """Validated (and possibly limited) SQL for ``sql_query``; raises ``ValidationError``."""
+    tree = ast_cache.parse(sql_query, dialect)
+    check_statement(tree)
+    if schema_index is not None:
+        check_schema(tree, schema_index)
+    if max_rows:
+        tree = cap_limit(tree, max_rows)
+    return tree.sql(dialect=dialect)
@@ -2,8 +2,18 @@
 
 import json
 import os
-from common.utils import get_rabbitmq_connection
-import pika
+import time
+from common.publisher import propagate_properties, publish_error
+from common.transport import get_transport
+from common.events import publish_event, start_event_listener, SCHEMA_EVENTS_EXCHANGE, CREDENTIALS_EVENTS_EXCHANGE, SQL_EVENTS_EXCHANGE
+from common.metrics import registry, start_metrics_server
+from common.tracing import traced
+from common.schema_cache import SchemaCache
+from common.metadata import request_metadata
+from common.datasources import DEFAULT_DATASOURCE_ID, LRUCache, get_datasource_id, find_credentials
+from sql_validator import ASTCache, ValidationError, validate_sql, get_schema_index
+from cost_guard import CostGuard
+from pymongo import MongoClient
 import logging
 import re
 
@@ -12,37 +22,166 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
+MONGO_URI = os.getenv("MONGO_URI")
+METRICS_PORT = os.getenv("METRICS_PORT")
+# LIMIT que se añade a las consultas sin él (o que rebaja uno mayor); 0 = sin límite
+VALIDATION_MAX_ROWS = int(os.getenv("VALIDATION_MAX_ROWS", "100000"))
+VALIDATION_AST_CACHE_SIZE = int(os.getenv("VALIDATION_AST_CACHE_SIZE", "1000"))
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "600"))
+# Umbrales del EXPLAIN previo a la ejecución; sin ninguno de los dos no se consulta la base de datos
+EXPLAIN_MAX_COST = float(os.getenv("EXPLAIN_MAX_COST", "0"))
+EXPLAIN_MAX_ROWS = float(os.getenv("EXPLAIN_MAX_ROWS", "0"))
 
+validated = registry.counter("validation_accepted_total", "Queries forwarded to the execution service")
+rejected = registry.counter("validation_rejected_total", "Queries rejected by the validation service")
+validation_seconds = registry.histogram("validation_seconds", "Time spent validating a query")
+
+ast_cache = ASTCache(max_entries=VALIDATION_AST_CACHE_SIZE)
+
+# Esquema, credenciales y control de coste por fuente de datos; las menos usadas se descartan
+schema_caches = LRUCache()
+
+def get_schema_cache(datasource_id):
+    return schema_caches.get_or_create(
+        datasource_id,
+        lambda datasource_id: SchemaCache(
+            lambda: request_metadata(RABBITMQ_HOST, datasource_id),
+            ttl=SCHEMA_CACHE_TTL,
+            name="validation_schema_cache"
+        )
+    )
+
+def on_schema_event(event):
+    if event.get("event") == "schema_changed":
+        schema_cache = schema_caches.get(event.get("datasource_id") or DEFAULT_DATASOURCE_ID)
+        if schema_cache is not None:
+            schema_cache.invalidate(event.get("version"))
+
+# Credenciales de cada fuente de datos: su db_type decide el dialecto y, con el
+# control de coste activo, con ellas se hace el EXPLAIN
+mongo_client = MongoClient(MONGO_URI)
+credentials_collection = mongo_client['credentials_db']['credentials']
+
+credentials_cache = LRUCache()
+
+def load_credentials(datasource_id):
+    credentials = find_credentials(credentials_collection, datasource_id)
+    if not credentials:
+        raise Exception(f"No se encontraron credenciales de '{datasource_id}' en MongoDB")
+    return credentials
+
+def get_credentials(datasource_id=DEFAULT_DATASOURCE_ID):
+    return credentials_cache.get_or_create(datasource_id, load_credentials)
+
+# Dialecto de sqlglot con el que se analiza y se reescribe el SQL de cada db_type
+SQL_DIALECTS = {"postgresql": "postgres", "mysql": "mysql", "sqlite": "sqlite"}
+
+def get_dialect(datasource_id):
+    db_type = get_credentials(datasource_id).get("db_type", "postgresql")
+    if db_type not in SQL_DIALECTS:
+        raise ValueError(f"Tipo de base de datos no soportado: {db_type}")
+    return SQL_DIALECTS[db_type]
+
+# Cada control de coste mantiene una conexión abierta: se cierra al descartarlo
+cost_guards = LRUCache(on_evict=lambda datasource_id, guard: guard.reset())
+
+def get_cost_guard(datasource_id):
+    return cost_guards.get_or_create(
+        datasource_id,
+        lambda datasource_id: CostGuard(
+            lambda: get_credentials(datasource_id),
+            max_cost=EXPLAIN_MAX_COST,
+            max_rows=EXPLAIN_MAX_ROWS
+        )
+    )
+
+def on_credentials_event(event):
+    if event.get("event") == "credentials_changed":
+        datasource_id = event.get("datasource_id")
+        if datasource_id is None:
+            credentials_cache.clear()
+            cost_guards.clear()
+        else:
+            credentials_cache.pop(datasource_id)
+            cost_guards.pop(datasource_id)
+
+def validate(sql_query, datasource_id=DEFAULT_DATASOURCE_ID):
+    schema_cache = get_schema_cache(datasource_id)
+    schema = schema_cache.get()
+    if schema is None:
+        logger.warning("Esquema no disponible: se valida la consulta sin comprobar tablas ni columnas")
+    schema_index = get_schema_index(schema, f"{datasource_id}:{schema_cache.version}") if schema is not None else None
+    valid_sql_query = validate_sql(
+        sql_query,
+        ast_cache,
+        dialect=get_dialect(datasource_id),
+        schema_index=schema_index,
+        max_rows=VALIDATION_MAX_ROWS
+    )
+    if EXPLAIN_MAX_COST or EXPLAIN_MAX_ROWS:
+        get_cost_guard(datasource_id).check(valid_sql_query)
+    return valid_sql_query
+
+@traced("validation")
 def callback(ch, method, properties, body):
     data = json.loads(body)
     sql_query = data.get("sql_query")["sql_query"]
 
-    # Aquí podrías agregar validaciones específicas de SQL
-    valid_sql_query = clean_sql_query(sql_query)
-
+    start = time.perf_counter()
     try:
-        connection = get_rabbitmq_connection(RABBITMQ_HOST)
-        channel = connection.channel()
-        channel.queue_declare(queue='execution_queue')
-        channel.basic_publish(exchange='', routing_key='execution_queue', body=json.dumps({"sql_query": valid_sql_query}))
-        logger.info("Query sent to Execution Service: %s", valid_sql_query)
+        valid_sql_query = validate(clean_sql_query(sql_query), get_datasource_id(properties))
+    except ValidationError as e:
+        rejected.inc()
+        logger.warning(f"Query rejected: {e} ({sql_query})")
+        publish_error(RABBITMQ_HOST, properties, f"Consulta rechazada: {e}")
+        report_rejected(sql_query, get_datasource_id(properties))
+        return
     except Exception as e:
-        logger.error(f"Error publishing to RabbitMQ: {e}")
+        logger.error(f"Error validating query: {e}")
+        publish_error(RABBITMQ_HOST, properties, f"Error validando la consulta: {e}")
+        return
     finally:
-        connection.close()
+        validation_seconds.observe(time.perf_counter() - start)
+
+    # Si la publicación falla, el transporte reintenta el mensaje
+    get_transport(RABBITMQ_HOST).publish(
+        'execution_queue',
+        json.dumps({"sql_query": valid_sql_query}),
+        properties=propagate_properties(properties)
+    )
+    validated.inc()
+    logger.info("Query sent to Execution Service: %s", valid_sql_query)
+
+def report_rejected(sql_query, datasource_id):
+    # El servicio NLP guarda el SQL generado antes de validarlo: sin este aviso
+    # repetiría la consulta rechazada para cada pregunta igual
+    try:
+        publish_event(
+            RABBITMQ_HOST,
+            SQL_EVENTS_EXCHANGE,
+            {"event": "sql_rejected", "datasource_id": datasource_id, "sql_query": sql_query}
+        )
+    except Exception as e:
+        logger.error(f"Error publicando el evento de consulta rechazada: {e}")
 
 def clean_sql_query(sql_query):
     # Eliminar los bloques de código (```sql y ```)
     cleaned_query = re.sub(r'```sql|```', '', sql_query).strip()
     return cleaned_query
 
+def setup():
+    # Lo necesario en cada proceso que consume validation_queue (también los de common.supervisor)
+    start_event_listener(RABBITMQ_HOST, SCHEMA_EVENTS_EXCHANGE, on_schema_event)
+    start_event_listener(RABBITMQ_HOST, CREDENTIALS_EVENTS_EXCHANGE, on_credentials_event)
+    get_schema_cache(DEFAULT_DATASOURCE_ID).prefetch()
+
 def main():
-    connection = get_rabbitmq_connection(RABBITMQ_HOST)
-    channel = connection.channel()
-    channel.queue_declare(queue='validation_queue')
-    channel.basic_consume(queue='validation_queue', on_message_callback=callback, auto_ack=True)
-    logger.info("Waiting for messages...")
-    channel.start_consuming()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    setup()
+
+    # Cada mensaje se confirma solo después de publicarse en execution_queue
+    get_transport(RABBITMQ_HOST).consume('validation_queue', callback)
 
 if __name__ == "__main__":
     main()